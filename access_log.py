@@ -0,0 +1,203 @@
+# access_log.py
+# Incremental aggregation of the xray access log on the node, so the bot can ask
+# "who is using this node" without the raw log ever leaving the server.
+import base64, calendar, json, os, re, time
+from collections import Counter
+from hyperloglog import HyperLogLog, DEFAULT_PRECISION
+
+STATS_RETENTION_HOURS = 24
+MAX_DESTINATIONS_PER_HOUR = 5000
+DESTINATIONS_KEEP = 2000
+# Distinct source IPs per user are sketched in slots of this many hours, so the
+# memory per user stays at (retention / slot) sketches of 1 KB each.
+SKETCH_SLOT_HOURS = 4
+
+# 2024/05/01 12:00:00.123456 from 1.2.3.4:5678 accepted tcp:www.example.com:443 [VLESS_TCP >> DIRECT] email: 42.user
+ACCESS_LINE_RE = re.compile(
+    r'^(?P<time>\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2})(?:\.\d+)? (?:from )?(?P<source>\S+) '
+    r'(?P<status>accepted|rejected) (?:(?P<network>tcp|udp):)?(?P<destination>\S+)'
+    r'(?: \[(?P<route>[^\]]*)\])?(?: email: (?P<email>\S+))?'
+)
+
+
+def split_host_port(address: str):
+    """'1.2.3.4:443' -> ('1.2.3.4', '443'), '[::1]:443' -> ('::1', '443'), 'example.com' -> ('example.com', '')."""
+    if address.startswith('['):
+        host, _, rest = address[1:].partition(']')
+        return host, rest.lstrip(':')
+    if address.count(':') == 1:
+        host, _, port = address.partition(':')
+        return host, port
+    return address, ''
+
+
+def parse_access_line(line: str):
+    """Parses one xray access log line, or returns None for anything else (errors, startup messages)."""
+    match = ACCESS_LINE_RE.match(line)
+    if not match:
+        return None
+    ts = calendar.timegm(time.strptime(match['time'], "%Y/%m/%d %H:%M:%S"))
+    return {
+        'ts': ts,
+        'source': split_host_port(match['source'])[0],
+        'status': match['status'],
+        'network': match['network'] or 'tcp',
+        'destination': split_host_port(match['destination'])[0],
+        'route': match['route'] or '',
+        'email': match['email'] or '',
+    }
+
+
+class HourBucket:
+    """Aggregates of one hour of the access log."""
+
+    def __init__(self):
+        self.total = 0
+        self.rejected = 0
+        self.users = Counter()
+        self.destinations = Counter()
+        self.minutes = Counter()
+
+    def add(self, entry: dict):
+        self.total += 1
+        if entry['status'] == 'rejected': self.rejected += 1
+        if entry['email']: self.users[entry['email']] += 1
+        self.destinations[entry['destination']] += 1
+        self.minutes[entry['ts'] // 60 * 60] += 1
+        if len(self.destinations) > MAX_DESTINATIONS_PER_HOUR:
+            # فقط پرتکرارترین مقصدها نگه داشته می‌شوند؛ شمارش مقصدهای کم‌تکرار تقریبی است
+            self.destinations = Counter(dict(self.destinations.most_common(DESTINATIONS_KEEP)))
+
+    def to_dict(self) -> dict:
+        return {'total': self.total, 'rejected': self.rejected, 'users': self.users,
+                'destinations': self.destinations, 'minutes': {str(k): v for k, v in self.minutes.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        bucket = cls()
+        bucket.total = data.get('total', 0)
+        bucket.rejected = data.get('rejected', 0)
+        bucket.users = Counter(data.get('users', {}))
+        bucket.destinations = Counter(data.get('destinations', {}))
+        bucket.minutes = Counter({int(k): v for k, v in data.get('minutes', {}).items()})
+        return bucket
+
+
+class AccessLogAggregator:
+    """
+    Hourly aggregates of the access log plus the byte offset up to which the log
+    has been read. Both are snapshotted to `state_path`, so after an agent restart
+    reading resumes at the saved offset instead of counting lines twice.
+    Windows are measured in log time (relative to the newest line seen), which
+    keeps them correct whatever time zone the container writes its log in.
+    """
+
+    def __init__(self, state_path: str, retention_hours: int = STATS_RETENTION_HOURS):
+        self.state_path = state_path
+        self.retention_hours = retention_hours
+        self.offset = None
+        self.inode = None  # of the file `offset` belongs to
+        self.latest_ts = 0
+        self.buckets = {}
+        self.ip_sketches = {}
+        self.dirty = False
+
+    def feed(self, line: str):
+        entry = parse_access_line(line)
+        if not entry:
+            return
+        hour = entry['ts'] // 3600 * 3600
+        if hour not in self.buckets:
+            self.buckets[hour] = HourBucket()
+            oldest = hour - (self.retention_hours - 1) * 3600
+            for old_hour in [h for h in self.buckets if h < oldest]:
+                del self.buckets[old_hour]
+        self.buckets[hour].add(entry)
+        if entry['email']:
+            self.add_source_ip(entry)
+        self.latest_ts = max(self.latest_ts, entry['ts'])
+        self.dirty = True
+
+    def add_source_ip(self, entry: dict):
+        slot = entry['ts'] // (SKETCH_SLOT_HOURS * 3600) * SKETCH_SLOT_HOURS * 3600
+        if slot not in self.ip_sketches:
+            self.ip_sketches[slot] = {}
+            oldest = slot - self.retention_hours * 3600
+            for old_slot in [s for s in self.ip_sketches if s < oldest]:  # the slot holding latest - retention still counts
+                del self.ip_sketches[old_slot]
+        sketches = self.ip_sketches[slot]
+        sketch = sketches.get(entry['email'])
+        if sketch is None:
+            sketch = sketches[entry['email']] = HyperLogLog()
+        sketch.add(entry['source'])
+
+    def ip_sketch_window(self, hours: int) -> dict:
+        """Merges each user's IP sketches over the slots covering the last `hours` hours (rounded up to whole slots)."""
+        slot_seconds = SKETCH_SLOT_HOURS * 3600
+        first_slot = (self.latest_ts - hours * 3600) // slot_seconds * slot_seconds
+        merged = {}
+        for slot, sketches in self.ip_sketches.items():
+            if slot < first_slot: continue
+            for email, sketch in sketches.items():
+                if email in merged: merged[email].merge(sketch)
+                else: merged[email] = HyperLogLog(sketch.p, sketch.registers)
+        return merged
+
+    def summary(self, hours: int = 1, top: int = 10) -> dict:
+        latest_hour = self.latest_ts // 3600 * 3600
+        users, destinations, total, rejected = Counter(), Counter(), 0, 0
+        for hour, bucket in self.buckets.items():
+            if hour > latest_hour - hours * 3600:
+                users.update(bucket.users)
+                destinations.update(bucket.destinations)
+                total += bucket.total
+                rejected += bucket.rejected
+
+        last_minute = self.latest_ts // 60 * 60
+        per_minute = []
+        for minute in range(last_minute - 59 * 60, last_minute + 60, 60):
+            bucket = self.buckets.get(minute // 3600 * 3600)
+            per_minute.append(bucket.minutes.get(minute, 0) if bucket else 0)
+
+        return {
+            'hours': hours,
+            'as_of': self.latest_ts,
+            'total': total,
+            'rejected': rejected,
+            'unique_users': len(users),
+            'users': users.most_common(top),
+            'destinations': destinations.most_common(top),
+            'per_minute': per_minute,
+        }
+
+    def load(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.offset = state.get('offset')
+        self.inode = state.get('inode')
+        self.latest_ts = state.get('latest_ts', 0)
+        self.buckets = {int(h): HourBucket.from_dict(b) for h, b in state.get('buckets', {}).items()}
+        self.ip_sketches = {
+            int(slot): {email: HyperLogLog.from_bytes(base64.b64decode(data)) for email, data in sketches.items()}
+            for slot, sketches in state.get('ip_sketches', {}).items()
+        } if state.get('sketch_precision', DEFAULT_PRECISION) == DEFAULT_PRECISION else {}
+
+    def save(self):
+        self.write(self.state())
+        self.dirty = False
+
+    def state(self) -> dict:
+        return {'offset': self.offset, 'inode': self.inode, 'latest_ts': self.latest_ts,
+                'buckets': {str(h): b.to_dict() for h, b in self.buckets.items()},
+                'sketch_precision': DEFAULT_PRECISION,
+                'ip_sketches': {str(slot): {email: base64.b64encode(sketch.to_bytes()).decode() for email, sketch in sketches.items()}
+                                for slot, sketches in self.ip_sketches.items()}}
+
+    def write(self, state: dict):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
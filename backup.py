@@ -0,0 +1,847 @@
+# backup.py
+# Streams pg_dump of the panel database through parallel compression into
+# size-capped parts and uploads every part to Telegram as soon as it is complete,
+# or stores it as a deduplicated snapshot in a local chunk repository.
+import sys
+import os
+import io
+import gzip
+import json
+import zlib
+import fcntl
+import hashlib
+import tarfile
+import tempfile
+import itertools
+import time
+import asyncio
+import subprocess
+from contextlib import contextmanager, suppress
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from send_file import Sender
+
+HISTORY_PATH = '/opt/remna_bot/backup_history.jsonl'
+HISTORY_LIMIT = 1000
+DB_CONTAINER = 'remnawave-db'
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+PART_SIZE = 45 * 1024 * 1024  # Bot API uploads are limited to 50 MB
+COMPRESS_WORKERS = max(2, min(os.cpu_count() or 2, 8))
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 6
+# Content-defined chunking: a chunk ends after a line whose crc32 has these bits
+# all zero (about one line in 2048), so an edit only changes the chunks around it.
+CHUNK_BOUNDARY_MASK = 0x7FF
+CHUNK_MIN_BYTES = 64 * 1024
+CHUNK_MAX_BYTES = 4 * 1024 * 1024
+SNAPSHOT_RETENTION_DAYS = 30
+# 'custom' dumps (pg_dump -Fc, uncompressed since the pipeline compresses) restore
+# with parallel pg_restore; 'plain' SQL dumps replay through a single psql session.
+DEFAULT_DUMP_FORMAT = 'custom'
+# Snapshots default to plain: the chunk boundaries are picked on lines of SQL
+# text, which stay the same where the data did. A custom dump is binary blocks
+# with length headers, where boundaries are not tied to rows and dedup suffers.
+SNAPSHOT_DUMP_FORMAT = 'plain'
+RESTORE_JOBS = max(2, min(os.cpu_count() or 2, 8))
+RESTORE_DUMP_PATH = '/tmp/remna_restore.dump'
+# A dump this much smaller than the previous one is flagged as possibly truncated.
+SHRINK_WARNING_RATIO = 0.8
+
+class ZstdCompressor:
+    """zstd using its own worker threads."""
+    name = 'zstd'
+    suffix = '.zst'
+
+    def __init__(self, workers: int):
+        import zstandard
+        self.cobj = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=workers).compressobj()
+
+    def feed(self, block: bytes):
+        data = self.cobj.compress(block)
+        if data: yield data
+
+    def finish(self):
+        yield self.cobj.flush()
+
+class ParallelGzipCompressor:
+    """
+    Compresses blocks as independent gzip members on a thread pool (zlib releases
+    the GIL) and emits them in order. Concatenated members are a valid gzip
+    stream, so the result still restores with plain gunzip.
+    """
+    name = 'gzip'
+    suffix = '.gz'
+
+    def __init__(self, workers: int):
+        self.pool = ThreadPoolExecutor(workers)
+        self.pending = deque()
+        self.max_pending = workers * 2
+
+    def feed(self, block: bytes):
+        self.pending.append(self.pool.submit(gzip.compress, block, GZIP_LEVEL, mtime=0))
+        while len(self.pending) > self.max_pending:
+            yield self.pending.popleft().result()
+
+    def finish(self):
+        while self.pending:
+            yield self.pending.popleft().result()
+        self.pool.shutdown()
+
+def make_compressor(workers: int = COMPRESS_WORKERS):
+    try:
+        return ZstdCompressor(workers)
+    except ImportError:
+        return ParallelGzipCompressor(workers)
+
+class PartWriter:
+    """Splits a byte stream into files of at most `part_size` bytes, reporting each finished part."""
+
+    def __init__(self, directory: str, base_name: str, part_size: int, on_part):
+        self.directory = directory
+        self.base_name = base_name
+        self.part_size = part_size
+        self.on_part = on_part
+        self.parts = []
+        self.file = None
+
+    def write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            if self.file is None:
+                self.current = {'name': f"{self.base_name}.part{len(self.parts) + 1:03d}", 'size': 0}
+                self.file = open(os.path.join(self.directory, self.current['name']), 'wb')
+                self.sha256 = hashlib.sha256()
+            n = min(len(view), self.part_size - self.current['size'])
+            self.file.write(view[:n])
+            self.sha256.update(view[:n])
+            self.current['size'] += n
+            view = view[n:]
+            if self.current['size'] >= self.part_size:
+                self.close_part()
+
+    def close_part(self):
+        self.file.close()
+        self.file = None
+        self.current['sha256'] = self.sha256.hexdigest()
+        self.parts.append(self.current)
+        self.on_part(os.path.join(self.directory, self.current['name']), len(self.parts))
+
+    def close(self):
+        if self.file is not None:
+            self.close_part()
+
+def dump_and_split(output_dir: str, db_user: str, db_name: str, dump_format: str, on_part) -> dict:
+    """Runs pg_dump and writes its compressed output as parts. Returns the manifest."""
+    base_name = os.path.basename(output_dir.rstrip('/'))
+    compressor = make_compressor()
+    extension = '.dump' if dump_format == 'custom' else '.sql'
+    writer = PartWriter(output_dir, base_name + extension + compressor.suffix, PART_SIZE, on_part)
+    dump_bytes, dump_sha256 = 0, hashlib.sha256()
+    started, compress_seconds = time.monotonic(), 0.0
+    proc = open_dump(db_user, db_name, dump_format)
+    try:
+        while True:
+            block = proc.stdout.read(READ_BLOCK_SIZE)
+            if not block: break
+            dump_bytes += len(block)
+            dump_sha256.update(block)
+            compress_started = time.monotonic()
+            for data in compressor.feed(block):
+                writer.write(data)
+            compress_seconds += time.monotonic() - compress_started
+        compress_started = time.monotonic()
+        for data in compressor.finish():
+            writer.write(data)
+        writer.close()
+        compress_seconds += time.monotonic() - compress_started
+    finally:
+        close_dump(proc)
+    elapsed = time.monotonic() - started
+    if not dump_bytes:
+        raise RuntimeError("pg_dump produced no output")
+    return {
+        'format': 1,
+        'name': base_name,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'database': db_name,
+        'dump_format': dump_format,
+        'compression': compressor.name,
+        'dump_bytes': dump_bytes,
+        'dump_sha256': dump_sha256.hexdigest(),
+        'compressed_bytes': sum(p['size'] for p in writer.parts),
+        # dump = time spent waiting for pg_dump, compress = compressing and writing parts
+        'timings': {'dump': round(elapsed - compress_seconds, 2), 'compress': round(compress_seconds, 2)},
+        'parts': writer.parts,
+    }
+
+class UploadQueue:
+    """
+    Uploads files in order on the event loop while a worker thread keeps producing
+    them. Remembers the time spent uploading and the Telegram file of each path.
+    """
+
+    def __init__(self, sender: Sender):
+        self.sender = sender
+        self.seconds = 0.0
+        self.uploaded_bytes = 0
+        self.documents = {}
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    def submit_threadsafe(self, path: str, caption: str, delete_after: bool = False):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (path, caption, delete_after))
+
+    async def _run(self):
+        while True:
+            item = await self.queue.get()
+            if item is None: return
+            path, caption, delete_after = item
+            started = time.monotonic()
+            self.documents[os.path.basename(path)] = await self.sender.send(path, caption)
+            self.seconds += time.monotonic() - started
+            self.uploaded_bytes += os.path.getsize(path)
+            if delete_after: os.remove(path)
+
+    async def finish(self):
+        self.queue.put_nowait(None)
+        await self.task
+
+    def cancel(self):
+        self.task.cancel()
+
+def open_dump(db_user: str, db_name: str, dump_format: str) -> subprocess.Popen:
+    command = ["docker", "exec", DB_CONTAINER, "pg_dump", "-U", db_user, "-d", db_name]
+    if dump_format == 'custom':
+        command += ["-Fc", "-Z0"]
+    # stderr goes to a file: a pipe nobody reads until stdout ends would block
+    # pg_dump as soon as it wrote more warnings than the pipe buffer holds.
+    errors = tempfile.TemporaryFile()
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors)
+    proc.errors = errors
+    return proc
+
+def close_dump(proc: subprocess.Popen):
+    proc.stdout.close()
+    proc.wait()
+    with proc.errors:
+        proc.errors.seek(0)
+        stderr = proc.errors.read().decode('utf-8', errors='replace').strip()
+    if proc.returncode != 0:
+        raise RuntimeError(f"pg_dump failed: {stderr}")
+
+async def create_backup(output_dir: str, caption: str, db_user: str, db_name: str, dump_format: str = DEFAULT_DUMP_FORMAT):
+    """
+    Dumps and compresses in a worker thread while this loop uploads the parts it
+    produces, so uploading part N overlaps with compressing part N+1. The manifest
+    is uploaded last; restoring needs it together with all the parts.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    name = os.path.basename(output_dir.rstrip('/'))
+    started = time.monotonic()
+
+    async with Sender() as sender:
+        uploads = UploadQueue(sender)
+
+        def on_part(path, number):
+            print(f"Part {number} ready ({os.path.getsize(path) / 1024 / 1024:.1f} MB), uploading...")
+            uploads.submit_threadsafe(path, f"📦 {name} — part {number}")
+
+        try:
+            manifest = await asyncio.to_thread(dump_and_split, output_dir, db_user, db_name, dump_format, on_part)
+        except BaseException:
+            uploads.cancel()
+            raise
+        await uploads.finish()
+        for part in manifest['parts']:
+            part['file_id'] = uploads.documents[part['name']]['file_id']
+        finish_timings(manifest, uploads, started)
+
+        manifest_path = os.path.join(output_dir, f"{manifest['name']}.manifest.json")
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        summary = caption_text(f"{caption}\n{describe_backup(manifest)}\n{record_history(manifest)}".strip())
+        await sender.send(manifest_path, summary)
+    print(f"Backup sent: {len(manifest['parts'])} part(s) and manifest.")
+
+def caption_text(text: str, last_line: str = "", limit: int = 1024) -> str:
+    """Fits a caption into Telegram's limit by dropping whole lines from the end; last_line is always kept."""
+    lines, tail = text.split("\n"), [last_line] if last_line else []
+    if len("\n".join(lines + tail)) <= limit:
+        return "\n".join(lines + tail)
+    while lines and len("\n".join(lines + ["..."] + tail)) > limit:
+        lines.pop()
+    return "\n".join(lines + ["..."] + tail)[:limit]
+
+def finish_timings(manifest: dict, uploads: UploadQueue, started: float):
+    """Adds the upload time and overall duration to a manifest, plus throughput in MB/s."""
+    timings = manifest['timings']
+    timings['upload'] = round(uploads.seconds, 2)
+    timings['total'] = round(time.monotonic() - started, 2)
+    timings['dump_mb_s'] = round(manifest['dump_bytes'] / 1024 / 1024 / max(timings['total'], 0.01), 2)
+    timings['upload_mb_s'] = round(uploads.uploaded_bytes / 1024 / 1024 / max(uploads.seconds, 0.01), 2)
+
+def describe_backup(manifest: dict) -> str:
+    """A few caption lines summarising a split backup or snapshot manifest."""
+    mb = lambda n: f"{n / 1024 / 1024:.1f} MB"
+    timings = manifest['timings']
+    lines = [f"Dump: {mb(manifest['dump_bytes'])} {manifest['dump_format']}, sha256 {manifest['dump_sha256'][:16]}"]
+    if manifest['format'] == 'snapshot':
+        lines.append(f"Snapshot: {manifest['chunk_count']} chunks, {manifest['new_chunks']} new ({mb(manifest['new_bytes'])} uploaded)")
+    else:
+        lines.append(f"Stored: {len(manifest['parts'])} part(s), {manifest['compression']}, {mb(manifest['compressed_bytes'])} "
+                     f"(ratio {manifest['dump_bytes'] / max(manifest['compressed_bytes'], 1):.1f})")
+    phases = ", ".join(f"{phase} {timings[phase]:.1f}s" for phase in ('dump', 'compress', 'upload') if phase in timings)
+    lines.append(f"Time: {phases}, total {timings['total']:.1f}s ({timings['dump_mb_s']:.1f} MB/s, "
+                 f"upload {timings['upload_mb_s']:.1f} MB/s)")
+    return "\n".join(lines)
+
+def load_history() -> list:
+    try:
+        with open(HISTORY_PATH) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError):
+        return []
+
+def record_history(manifest: dict) -> str:
+    """
+    Appends the backup to the history file and returns its trend against earlier
+    backups: a warning when the dump shrank sharply since the previous one (a
+    likely truncated dump) and the size change over the last week.
+    """
+    history = load_history()
+    entry = {'name': manifest['name'], 'created': manifest['created'],
+             'kind': 'snapshot' if manifest['format'] == 'snapshot' else 'split',
+             'dump_format': manifest['dump_format'],
+             'dump_bytes': manifest['dump_bytes'], 'dump_sha256': manifest['dump_sha256'],
+             'stored_bytes': manifest.get('compressed_bytes', manifest.get('new_bytes')),
+             'seconds': manifest['timings']['total']}
+    history.append(entry)
+    tmp_path = HISTORY_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        for item in history[-HISTORY_LIMIT:]:
+            f.write(json.dumps(item) + "\n")
+    os.replace(tmp_path, HISTORY_PATH)
+    return backup_trend(history[:-1], entry)
+
+def comparable(a: dict, b: dict) -> bool:
+    """Snapshots (plain SQL) and split backups (usually -Fc) differ in size for the same data, so only like is compared."""
+    if a['kind'] != b['kind']:
+        return False
+    return a.get('dump_format') is None or b.get('dump_format') is None or a['dump_format'] == b['dump_format']
+
+def backup_trend(history: list, entry: dict) -> str:
+    history = [h for h in history if comparable(h, entry)]
+    if not history:
+        return ""
+    mb = lambda n: f"{n / 1024 / 1024:.1f}"
+    lines = []
+    previous = history[-1]
+    if entry['dump_bytes'] < previous['dump_bytes'] * SHRINK_WARNING_RATIO:
+        lines.append(f"⚠️ Dump is {(1 - entry['dump_bytes'] / previous['dump_bytes']) * 100:.0f}% smaller than "
+                     f"the previous backup ({mb(previous['dump_bytes'])} → {mb(entry['dump_bytes'])} MB)")
+    created = datetime.fromisoformat(entry['created'])
+    week_ago = [h for h in history if (created - datetime.fromisoformat(h['created'])).days >= 7]
+    base = week_ago[-1] if week_ago else history[0]
+    days = max((created - datetime.fromisoformat(base['created'])).days, 0)
+    change = (entry['dump_bytes'] / max(base['dump_bytes'], 1) - 1) * 100
+    lines.append(f"Size {change:+.0f}% over {days} day(s) ({mb(base['dump_bytes'])} → {mb(entry['dump_bytes'])} MB), "
+                 f"duration {base['seconds']:.0f}s → {entry['seconds']:.0f}s")
+    return "\n".join(lines)
+
+def print_history(count: int):
+    history = load_history()
+    for i, entry in enumerate(history[-count:], start=max(len(history) - count, 0)):
+        trend = backup_trend(history[:i], entry).replace("\n", "; ")
+        print(f"{entry['created']}  {entry['kind']:<8} {entry['dump_bytes'] / 1024 / 1024:>9.1f} MB "
+              f"{entry['seconds']:>7.1f}s  {entry['name']}  {trend}")
+
+def iter_chunks(stream):
+    """Splits a line-oriented dump into content-defined chunks."""
+    chunk = bytearray()
+    for line in stream:
+        chunk += line
+        if len(chunk) >= CHUNK_MAX_BYTES or (len(chunk) >= CHUNK_MIN_BYTES and zlib.crc32(line) & CHUNK_BOUNDARY_MASK == 0):
+            yield bytes(chunk)
+            chunk = bytearray()
+    if chunk:
+        yield bytes(chunk)
+
+def compress_chunk(data: bytes, compression: str) -> bytes:
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, GZIP_LEVEL, mtime=0)
+
+def decompress_chunk(data: bytes, compression: str) -> bytes:
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+class PackWriter:
+    """Collects new chunks into tar files of at most PART_SIZE bytes for upload."""
+
+    def __init__(self, directory: str, base_name: str, on_pack):
+        self.directory = directory
+        self.base_name = base_name
+        self.on_pack = on_pack
+        self.count = 0
+        self.tar = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.base_name}.pack{self.count:03d}.tar"
+
+    def add(self, chunk_hash: str, data: bytes):
+        if self.tar is not None and self.size + len(data) + 1024 > PART_SIZE:
+            self.close()
+        if self.tar is None:
+            self.count += 1
+            self.tar = tarfile.open(os.path.join(self.directory, self.name), 'w')
+            self.size = 0
+        info = tarfile.TarInfo(chunk_hash)
+        info.size = len(data)
+        self.tar.addfile(info, io.BytesIO(data))
+        self.size += len(data) + 512
+
+    def close(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+            self.on_pack(os.path.join(self.directory, self.name), self.count)
+
+class ChunkRepository:
+    """
+    Local deduplicated backup store. Every dump is split with iter_chunks and
+    stored as a snapshot: the ordered list of its chunk hashes. A chunk's file is
+    only written (and uploaded, inside a pack) the first time any snapshot
+    contains it. index.json remembers which pack carried each chunk, so a
+    snapshot can list the packs a restore from Telegram needs.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.chunks_dir = os.path.join(directory, 'chunks')
+        self.snapshots_dir = os.path.join(directory, 'snapshots')
+        self.packs_dir = os.path.join(directory, 'packs')
+        for path in (self.chunks_dir, self.snapshots_dir, self.packs_dir):
+            os.makedirs(path, exist_ok=True)
+        self.index_path = os.path.join(directory, 'index.json')
+        try:
+            with open(self.index_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        self.compression = state.get('compression') or make_compressor(1).name
+        self.index = state.get('chunks', {})
+
+    @contextmanager
+    def locked(self):
+        with open(os.path.join(self.directory, 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def chunk_path(self, chunk_hash: str) -> str:
+        return os.path.join(self.chunks_dir, chunk_hash[:2], chunk_hash)
+
+    def save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'compression': self.compression, 'chunks': self.index}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def snapshot(self, name: str, stream, dump_format: str, on_pack) -> dict:
+        """
+        Stores the chunks of the dump read from `stream` and returns the snapshot
+        manifest. The snapshot only becomes part of the repository with commit(),
+        after its packs have been uploaded.
+        """
+        pool = ThreadPoolExecutor(COMPRESS_WORKERS)
+        packs = PackWriter(self.packs_dir, name, on_pack)
+        pending, hashes, new_hashes = deque(), [], set()
+        dump_bytes = new_bytes = 0
+        dump_sha256, started = hashlib.sha256(), time.monotonic()
+
+        def store(chunk_hash, future):
+            nonlocal new_bytes
+            data = future.result()
+            path = self.chunk_path(chunk_hash)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            packs.add(chunk_hash, data)
+            self.index[chunk_hash] = {'pack': packs.name, 'size': len(data)}
+            new_bytes += len(data)
+
+        try:
+            for chunk in iter_chunks(stream):
+                chunk_hash = hashlib.sha256(chunk).hexdigest()
+                hashes.append(chunk_hash)
+                dump_bytes += len(chunk)
+                dump_sha256.update(chunk)
+                if chunk_hash in self.index or chunk_hash in new_hashes:
+                    continue
+                new_hashes.add(chunk_hash)
+                pending.append((chunk_hash, pool.submit(compress_chunk, chunk, self.compression)))
+                while len(pending) > COMPRESS_WORKERS * 2:
+                    store(*pending.popleft())
+            while pending:
+                store(*pending.popleft())
+            packs.close()
+        finally:
+            pool.shutdown()
+        if not dump_bytes:
+            raise RuntimeError("pg_dump produced no output")
+
+        manifest = {
+            'format': 'snapshot',
+            'name': name,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'dump_format': dump_format,
+            'compression': self.compression,
+            'dump_bytes': dump_bytes,
+            'dump_sha256': dump_sha256.hexdigest(),
+            'chunk_count': len(hashes),
+            'new_chunks': len(new_hashes),
+            'new_bytes': new_bytes,
+            # chunking, hashing and compressing overlap, so they are timed together
+            'timings': {'dump': round(time.monotonic() - started, 2)},
+            'packs': sorted({self.index[h]['pack'] for h in hashes}),
+            'chunks': hashes,
+        }
+        return manifest
+
+    def commit(self, manifest: dict) -> str:
+        path = os.path.join(self.snapshots_dir, f"{manifest['name']}.snapshot.json")
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+        self.save_index()
+        return path
+
+    def prune(self, keep_days: int):
+        """Deletes snapshots older than `keep_days` and the chunks no remaining snapshot uses."""
+        cutoff = datetime.now().timestamp() - keep_days * 86400
+        referenced, removed = set(), 0
+        for filename in os.listdir(self.snapshots_dir):
+            path = os.path.join(self.snapshots_dir, filename)
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+                continue
+            with open(path) as f:
+                referenced.update(json.load(f)['chunks'])
+        for chunk_hash in [h for h in self.index if h not in referenced]:
+            with suppress(FileNotFoundError):
+                os.remove(self.chunk_path(chunk_hash))
+            del self.index[chunk_hash]
+        self.save_index()
+        print(f"Pruned {removed} snapshot(s); {len(self.index)} chunk(s) kept.")
+
+def dump_snapshot(repo: ChunkRepository, name: str, db_user: str, db_name: str, dump_format: str, on_pack) -> dict:
+    proc = open_dump(db_user, db_name, dump_format)
+    try:
+        manifest = repo.snapshot(name, proc.stdout, dump_format, on_pack)
+    finally:
+        close_dump(proc)
+    return manifest
+
+async def create_snapshot(repo_dir: str, name: str, caption: str, db_user: str, db_name: str, dump_format: str = SNAPSHOT_DUMP_FORMAT):
+    """
+    Stores a deduplicated snapshot in the local repository and uploads only the
+    chunks it did not have yet (in packs) plus the snapshot manifest.
+    """
+    repo = ChunkRepository(repo_dir)
+    started = time.monotonic()
+    with repo.locked():
+        async with Sender() as sender:
+            uploads = UploadQueue(sender)
+
+            def on_pack(path, number):
+                print(f"Pack {number} ready ({os.path.getsize(path) / 1024 / 1024:.1f} MB), uploading...")
+                uploads.submit_threadsafe(path, f"🧩 {name} — pack {number}", delete_after=True)
+
+            try:
+                manifest = await asyncio.to_thread(dump_snapshot, repo, name, db_user, db_name, dump_format, on_pack)
+            except BaseException:
+                uploads.cancel()
+                raise
+            await uploads.finish()
+            finish_timings(manifest, uploads, started)
+
+            manifest_path = repo.commit(manifest)
+            packs = manifest['packs']
+            # the full list is in the manifest; a caption only has room for a few weeks of it
+            needed = f"{packs[0]} … {packs[-1]}" if len(packs) > 2 else ", ".join(packs)
+            summary = caption_text(f"{caption}\n{describe_backup(manifest)}\n{record_history(manifest)}".strip(),
+                                   f"Restoring needs {len(packs)} pack(s), listed in this manifest: {needed}")
+            await sender.send(manifest_path, summary)
+    print(f"Snapshot {name} stored: {manifest['new_chunks']} new of {manifest['chunk_count']} chunks.")
+
+def iter_snapshot_chunks(path: str, manifest: dict):
+    """
+    Yields the plain chunks of a snapshot, read from the local repository it
+    belongs to, or else from the pack files lying next to the manifest.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(path))
+    repo_root = os.path.dirname(manifest_dir)
+    chunks_dir = os.path.join(repo_root, 'chunks')
+    members = {}
+    if not os.path.isdir(chunks_dir):
+        for filename in os.listdir(manifest_dir):
+            if filename.endswith('.tar'):
+                with tarfile.open(os.path.join(manifest_dir, filename)) as tar:
+                    for member in tar.getmembers():
+                        members[member.name] = (os.path.join(manifest_dir, filename), member.name)
+        missing = sorted({h for h in manifest['chunks'] if h not in members})
+        if missing:
+            raise RuntimeError(f"{len(missing)} chunk(s) missing; put these packs next to the manifest: {', '.join(manifest['packs'])}")
+    tars = {}
+    try:
+        for chunk_hash in manifest['chunks']:
+            if members:
+                tar_path, member_name = members[chunk_hash]
+                if tar_path not in tars: tars[tar_path] = tarfile.open(tar_path)
+                data = tars[tar_path].extractfile(member_name).read()
+            else:
+                with open(os.path.join(chunks_dir, chunk_hash[:2], chunk_hash), 'rb') as f:
+                    data = f.read()
+            chunk = decompress_chunk(data, manifest['compression'])
+            if hashlib.sha256(chunk).hexdigest() != chunk_hash:
+                raise RuntimeError(f"Chunk {chunk_hash} is corrupted (checksum mismatch)")
+            yield chunk
+    finally:
+        for tar in tars.values(): tar.close()
+
+class PartsReader(io.RawIOBase):
+    """Reads the parts listed in a manifest as one continuous stream."""
+
+    def __init__(self, directory: str, parts: list):
+        self.paths = deque(os.path.join(directory, p['name']) for p in parts)
+        self.file = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while True:
+            if self.file is None:
+                if not self.paths: return 0
+                self.file = open(self.paths.popleft(), 'rb')
+            n = self.file.readinto(buffer)
+            if n: return n
+            self.file.close()
+            self.file = None
+
+def find_manifest(path: str):
+    if os.path.isdir(path):
+        manifests = [f for f in os.listdir(path) if f.endswith('.manifest.json')]
+        if len(manifests) != 1:
+            raise RuntimeError(f"Expected one *.manifest.json in {path}, found {len(manifests)}")
+        path = os.path.join(path, manifests[0])
+    with open(path) as f:
+        return os.path.dirname(os.path.abspath(path)), json.load(f)
+
+def open_backup(path: str):
+    """
+    Opens a backup for restoring: a snapshot manifest, a split backup (its folder
+    or manifest) or a legacy .sql.gz file. Returns (info, blocks) where info has
+    the dump format and size and blocks yields the uncompressed dump.
+    """
+    if path.endswith('.sql.gz'):
+        return {'dump_format': 'plain', 'dump_bytes': None, 'dump_sha256': None}, iter_stream(gzip.open(path, 'rb'))
+    if path.endswith('.snapshot.json'):
+        with open(path) as f:
+            manifest = json.load(f)
+        blocks = iter_snapshot_chunks(path, manifest)
+    else:
+        directory, manifest = find_manifest(path)
+        blocks = iter_stream(open_split_backup(directory, manifest))
+    return {'dump_format': manifest.get('dump_format', 'plain'), 'dump_bytes': manifest.get('dump_bytes'),
+            'dump_sha256': manifest.get('dump_sha256')}, blocks
+
+def iter_stream(stream):
+    with stream:
+        yield from iter(lambda: stream.read(READ_BLOCK_SIZE), b'')
+
+class Progress:
+    """Prints a single updating progress line, at most a few times per second."""
+
+    def __init__(self, label: str, total: int | None, unit: str = 'MB'):
+        self.label = label
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self.started = time.monotonic()
+        self.last_print = 0.0
+
+    def update(self, amount: int, force: bool = False):
+        self.done += amount
+        now = time.monotonic()
+        if not force and now - self.last_print < 0.5:
+            return
+        self.last_print = now
+        scale = 1024 * 1024 if self.unit == 'MB' else 1
+        done = f"{self.done / scale:.1f}" if self.unit == 'MB' else str(self.done)
+        line = f"\r{self.label}: {done}"
+        if self.total:
+            total = f"{self.total / scale:.1f}" if self.unit == 'MB' else str(self.total)
+            line += f"/{total} {self.unit} ({min(self.done / self.total, 1) * 100:.0f}%)"
+        else:
+            line += f" {self.unit}"
+        print(f"{line}  {now - self.started:.0f}s", end='', flush=True)
+
+    def finish(self) -> float:
+        self.update(0, force=True)
+        print()
+        return time.monotonic() - self.started
+
+def open_split_backup(directory: str, manifest: dict):
+    for part in manifest['parts']:
+        part_path = os.path.join(directory, part['name'])
+        if not os.path.exists(part_path):
+            raise RuntimeError(f"Missing part {part['name']}")
+        sha256 = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            for block in iter(lambda: f.read(READ_BLOCK_SIZE), b''):
+                sha256.update(block)
+        if sha256.hexdigest() != part['sha256']:
+            raise RuntimeError(f"Part {part['name']} is corrupted (checksum mismatch)")
+    raw = io.BufferedReader(PartsReader(directory, manifest['parts']), READ_BLOCK_SIZE)
+    if manifest['compression'] == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    return gzip.GzipFile(fileobj=raw)
+
+def restore_backup(path: str, db_user: str, db_name: str, jobs: int = RESTORE_JOBS):
+    started = time.monotonic()
+    info, blocks = open_backup(path)
+    first = next(blocks)  # fail before touching the database if the backup is unreadable
+    if info['dump_format'] == 'custom':
+        restore_custom_dump(info, first, blocks, db_user, db_name, jobs)
+    else:
+        restore_plain_dump(info, first, blocks, db_user, db_name)
+    print(f"Restore finished in {time.monotonic() - started:.1f}s.")
+
+def stream_into(command: list, info: dict, first: bytes, blocks, label: str) -> float:
+    """
+    Pipes the dump into `command`'s stdin with a progress line, then checks what
+    went through against the size and checksum in the manifest. The check comes
+    after `command` has consumed the dump, so callers that must not act on a bad
+    dump point `command` at a file. Returns the elapsed seconds.
+    """
+    progress = Progress(label, info['dump_bytes'])
+    sha256 = hashlib.sha256()
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+    try:
+        for block in itertools.chain((first,), blocks):
+            proc.stdin.write(block)
+            sha256.update(block)
+            progress.update(len(block))
+    finally:
+        proc.stdin.close()
+        proc.wait()
+    elapsed = progress.finish()
+    if proc.returncode != 0:
+        raise RuntimeError(f"{label} failed with code {proc.returncode}")
+    if info['dump_bytes'] is not None and progress.done != info['dump_bytes']:
+        raise RuntimeError(f"Dump is {progress.done} bytes, the manifest says {info['dump_bytes']}")
+    if info['dump_sha256'] and sha256.hexdigest() != info['dump_sha256']:
+        raise RuntimeError("Dump checksum does not match the manifest")
+    checked = "verified" if info['dump_bytes'] is not None or info['dump_sha256'] else "not verified, no checksum"
+    print(f"Dump {checked} ({progress.done / 1024 / 1024:.1f} MB, {progress.done / 1024 / 1024 / max(elapsed, 0.01):.1f} MB/s).")
+    return elapsed
+
+def restore_plain_dump(info: dict, first: bytes, blocks, db_user: str, db_name: str):
+    """
+    A dump with a manifest is copied into the database container and checked
+    against it before psql replays it, as for custom dumps, so a corrupt backup
+    is rejected before the database is touched. Legacy .sql.gz backups have no
+    checksum and are replayed as they are read.
+    """
+    psql = ["docker", "exec", "-i", DB_CONTAINER, "psql", "-q", "-U", db_user, "-d", db_name]
+    if info['dump_bytes'] is None and not info['dump_sha256']:
+        print("This backup has no checksum, so it is replayed without verification.")
+        stream_into(psql, info, first, blocks, "Replaying SQL")
+        return
+    try:
+        copy_seconds = stream_into(["docker", "exec", "-i", DB_CONTAINER, "sh", "-c", f"cat > {RESTORE_DUMP_PATH}"],
+                                   info, first, blocks, "Copying dump into the container")
+        print("Replaying SQL...")
+        started = time.monotonic()
+        proc = subprocess.run(psql + ["-f", RESTORE_DUMP_PATH], stdout=subprocess.DEVNULL)
+        replay_seconds = time.monotonic() - started
+    finally:
+        subprocess.run(["docker", "exec", DB_CONTAINER, "rm", "-f", RESTORE_DUMP_PATH], capture_output=True)
+    print(f"Copy: {copy_seconds:.1f}s, psql: {replay_seconds:.1f}s.")
+    if proc.returncode != 0:
+        raise RuntimeError(f"psql exited with code {proc.returncode}")
+
+def restore_custom_dump(info: dict, first: bytes, blocks, db_user: str, db_name: str, jobs: int):
+    """
+    pg_restore needs a seekable file to restore with several jobs, so the dump is
+    first streamed into a file inside the database container, then restored with
+    `pg_restore -j`, counting finished TOC items from its verbose output.
+    """
+    try:
+        copy_seconds = stream_into(["docker", "exec", "-i", DB_CONTAINER, "sh", "-c", f"cat > {RESTORE_DUMP_PATH}"],
+                                   info, first, blocks, "Copying dump into the container")
+        listing = subprocess.run(["docker", "exec", DB_CONTAINER, "pg_restore", "-l", RESTORE_DUMP_PATH],
+                                 capture_output=True, text=True, check=True).stdout
+        total_items = sum(1 for line in listing.splitlines() if line and not line.startswith(';'))
+
+        progress = Progress(f"Restoring with {jobs} jobs (items)", total_items, unit='items')
+        proc = subprocess.Popen(["docker", "exec", DB_CONTAINER, "pg_restore", "-U", db_user, "-d", db_name,
+                                 "-j", str(jobs), "--no-owner", "-v", RESTORE_DUMP_PATH],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        errors = []
+        for line in proc.stderr:
+            # items restored before and after the parallel phase are "processing", the rest "finished"
+            if 'finished item' in line or 'processing item' in line or 'processing missed item' in line:
+                progress.update(1)
+            elif 'error' in line.lower():
+                errors.append(line.strip())
+        proc.wait()
+        restore_seconds = progress.finish()
+    finally:
+        subprocess.run(["docker", "exec", DB_CONTAINER, "rm", "-f", RESTORE_DUMP_PATH], capture_output=True)
+    print(f"Copy: {copy_seconds:.1f}s, pg_restore: {restore_seconds:.1f}s.")
+    if errors:
+        print("\n".join(errors[-10:]), file=sys.stderr)
+    if proc.returncode != 0:
+        raise RuntimeError(f"pg_restore exited with code {proc.returncode} ({len(errors)} error(s))")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python backup.py [create <output_dir> <caption>|snapshot <repo_dir> <name> <caption>] <db_user> <db_name> [plain|custom]", file=sys.stderr)
+        print("       python backup.py restore <path> <db_user> <db_name>", file=sys.stderr)
+        print("       python backup.py prune <repo_dir> [keep_days]", file=sys.stderr)
+        print("       python backup.py history [count]", file=sys.stderr)
+        sys.exit(1)
+
+    command = sys.argv[1]
+    default_format = SNAPSHOT_DUMP_FORMAT if command == 'snapshot' else DEFAULT_DUMP_FORMAT
+    dump_format = sys.argv[-1] if sys.argv[-1] in ('plain', 'custom') else default_format
+    args = sys.argv[:-1] if sys.argv[-1] in ('plain', 'custom') else sys.argv
+    try:
+        if command == 'create' and len(args) == 6:
+            asyncio.run(create_backup(args[2], args[3], args[4], args[5], dump_format))
+        elif command == 'snapshot' and len(args) == 7:
+            asyncio.run(create_snapshot(args[2], args[3], args[4], args[5], args[6], dump_format))
+        elif command == 'prune' and len(sys.argv) in (3, 4):
+            repo = ChunkRepository(sys.argv[2])
+            with repo.locked():
+                repo.prune(int(sys.argv[3]) if len(sys.argv) == 4 else SNAPSHOT_RETENTION_DAYS)
+        elif command == 'history' and len(sys.argv) in (2, 3):
+            print_history(int(sys.argv[2]) if len(sys.argv) == 3 else 20)
+        elif command == 'restore' and len(sys.argv) == 5:
+            restore_backup(sys.argv[2], sys.argv[3], sys.argv[4])
+        else:
+            print(f"Invalid command or arguments for '{command}'.", file=sys.stderr)
+            sys.exit(1)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,284 @@
+# bench/bench.py
+# Runs the bot's panel-facing flows against bench/fake_panel.py and reports the
+# time per run (p50/p99), the panel calls each run makes and their latency.
+#
+#   python bench/bench.py --users 10000 --repeat 5 --latency 5
+#   python bench/bench.py --users 10000 --save-baseline   # record this machine's numbers
+#   python bench/bench.py --users 10000                   # exits 1 if a flow got slower
+#   python bench/bench.py --flows bulk_create --bulk-create 20   # delivery under flood control
+#
+# The bot runs in-process with a temporary config.json pointing at the fake
+# panel. Most flows talk to recording Telegram stand-ins that cost nothing;
+# bulk_create sends through a real telegram.Bot to bench/fake_telegram.py, so
+# its numbers include Telegram's flood control.
+import argparse, asyncio, json, logging, os, sys, tempfile, time, types
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+sys.path[:0] = [REPO_DIR, BENCH_DIR]
+
+from fake_panel import FakePanel
+from fake_telegram import FakeTelegram
+
+
+def percentile(values: list, p: float) -> float:
+    """Nearest-rank percentile; 0 for no values."""
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered) + 0.5) - 1))]
+
+
+def import_bot(panel_url: str, telegram_url: str, workdir: str):
+    """Imports bot.py with its config and working files in `workdir`, talking to the fake servers."""
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump({'TELEGRAM_BOT_TOKEN': '0:bench', 'PANEL_URL': panel_url, 'PANEL_API_TOKEN': 'bench',
+                   'ADMIN_USER_ID': 1, 'NODES': {}, 'TELEGRAM_API_BASE_URL': telegram_url}, f)
+    os.symlink(os.path.join(REPO_DIR, 'locales.json'), os.path.join(workdir, 'locales.json'))
+    os.environ['REMNA_BOT_CONFIG'] = os.path.join(workdir, 'config.json')
+    os.chdir(workdir)
+    import bot
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    return bot
+
+
+class ApiRecorder:
+    """Wraps bot.api_request to time every panel call made by the flow being measured."""
+
+    def __init__(self, bot):
+        self.original = bot.api_request
+        self.calls = []
+        self.errors = 0
+        bot.api_request = self.request
+
+    def request(self, method, endpoint, *args, **kwargs):
+        started = time.perf_counter()
+        data, error = self.original(method, endpoint, *args, **kwargs)
+        self.calls.append(time.perf_counter() - started)
+        if error: self.errors += 1
+        return data, error
+
+
+# --- Telegram stand-ins: just enough of Message/Bot/CallbackQuery for the handlers ---
+
+class FakeMessage:
+    def __init__(self, bot, text=None):
+        self.bot, self.text = bot, text
+        self.chat_id = 1
+        self.message_id = bot.next_id()
+
+    async def edit_text(self, text=None, **kwargs):
+        self.bot.calls['edit_text'] += 1
+        return self
+
+    async def reply_text(self, text=None, **kwargs):
+        self.bot.calls['reply_text'] += 1
+        return FakeMessage(self.bot, text)
+
+    async def delete(self):
+        self.bot.calls['delete'] += 1
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = Counter()
+        self.last_id = 0
+
+    def next_id(self):
+        self.last_id += 1
+        return self.last_id
+
+    def __getattr__(self, name):
+        async def call(*args, **kwargs):
+            self.calls[name] += 1
+            return FakeMessage(self)
+        return call
+
+
+def fake_context(bot, user_data=None):
+    job_queue = types.SimpleNamespace(run_once=lambda *a, **k: None)
+    return types.SimpleNamespace(bot=bot, user_data=user_data or {}, job_queue=job_queue, application=None)
+
+
+def fake_update(bot, text=None, data=None):
+    message = FakeMessage(bot, text)
+    query = None
+    if data is not None:
+        async def answer(*args, **kwargs): bot.calls['answer'] += 1
+        query = types.SimpleNamespace(data=data, message=message, answer=answer)
+    return types.SimpleNamespace(message=message if data is None else None, callback_query=query,
+                                 effective_chat=types.SimpleNamespace(id=1), effective_user=types.SimpleNamespace(id=1))
+
+
+# --- flows; each returns the number of users it processed ---
+
+async def flow_get_all_users(bot, env, args):
+    data, error = await bot.api_request_get_all_users()
+    if error: raise RuntimeError(error)
+    return len(data['response']['users'])
+
+async def flow_bulk_update(bot, env, args):
+    users = bot.BulkTargets()
+    users.extend(map(bot.BulkTarget.from_panel, list(env.panel.data.users.values())[:args.bulk_limit]))
+    count, fake = len(users), FakeBot()
+    await bot.run_bulk_update_background({
+        'bot': fake, 'chat_id': 1, 'lang': 'en', 'languages_dict': bot.LANGUAGES,
+        'bulk_users_list': users, 'bulk_edit_type': 'hwid', 'bulk_change_value': 2, 'message_id_to_delete': 1,
+    })
+    return count  # the job closes the targets when it is done
+
+async def flow_cleanup(bot, env, args):
+    fake = FakeBot()
+    context = fake_context(fake, {'cleanup_status': 'EXPIRED'})
+    before = len(env.panel.data.users)
+    await bot.get_cleanup_hours(fake_update(fake, text='0'), context)
+    await bot.confirm_cleanup_action_handler(fake_update(fake, data='confirm_cleanup_action'), context)
+    return before - len(env.panel.data.users)
+
+async def flow_activity_report(bot, env, args):
+    fake = FakeBot()
+    await bot.process_hours_and_fetch_users(fake_update(fake, text='24'), fake_context(fake))
+    if not fake.calls['send_document']: raise RuntimeError("report was not sent")
+    return len(env.panel.data.users)
+
+async def flow_bulk_create(bot, env, args):
+    before = len(env.panel.data.users)
+    try:
+        await bot.run_bulk_creation_background({
+            'bot': env.telegram_bot, 'chat_id': 1, 'lang': 'en', 'languages_dict': bot.LANGUAGES,
+            'bulk_data': {'count': args.bulk_create, 'prefix': 'bench_', 'start_num': 1, 'trafficLimitBytes': 0,
+                          'is_onhold': False, 'expire_days_count': 30, 'hwidDeviceLimit': None,
+                          'internal_squads': [], 'external_squad': None, 'banner_type': 'sub'},
+        })
+    except Exception as e:
+        e.items = len(env.panel.data.users) - before  # users created before the failure still count
+        raise
+    return len(env.panel.data.users) - before
+
+FLOWS = {
+    'get_all_users': flow_get_all_users,
+    'bulk_update': flow_bulk_update,
+    'cleanup': flow_cleanup,
+    'activity_report': flow_activity_report,
+    'bulk_create': flow_bulk_create,
+}
+# flows that add or delete users get a fresh dataset before every run
+MUTATING_FLOWS = {'cleanup', 'bulk_create'}
+# bulk_create waits on flood control for seconds per run, so it only runs when asked for
+DEFAULT_FLOWS = [name for name in FLOWS if name != 'bulk_create']
+
+
+async def run(args) -> int:
+    panel = FakePanel(args.users, args.latency, args.jitter, args.error_rate, args.rate_limit)
+    telegram = FakeTelegram(args.chat_rate, global_rate=args.global_rate)
+    panel_url, telegram_url = await panel.start(), await telegram.start()
+    workdir = tempfile.mkdtemp(prefix='remna_bench_')
+    bot = import_bot(panel_url, telegram_url, workdir)
+    recorder = ApiRecorder(bot)
+    from telegram import Bot
+    env = types.SimpleNamespace(panel=panel, telegram=telegram,
+                                telegram_bot=Bot('0:bench', **bot.bot_api_urls(bot.config.data)))
+    await env.telegram_bot.initialize()
+
+    results = {}
+    try:
+        for name in args.flows:
+            durations, calls, latencies, errors, items, sent, retries = [], [], [], 0, 0, [], []
+            for run_index in range(args.warmup + args.repeat):
+                if name in MUTATING_FLOWS:
+                    panel.reset_dataset()
+                telegram.reset_state()
+                recorder.calls, recorder.errors = [], 0
+                started = time.perf_counter()
+                try:
+                    items = await FLOWS[name](bot, env, args)
+                except Exception as e:
+                    print(f"{name}: run failed: {e}", file=sys.stderr)
+                    items = getattr(e, 'items', 0)
+                    errors += 1
+                if run_index < args.warmup:
+                    continue
+                durations.append(time.perf_counter() - started)
+                calls.append(len(recorder.calls))
+                latencies.extend(recorder.calls)
+                errors += recorder.errors
+                telegram_summary = telegram.summary()
+                sent.append(telegram_summary['delivered'])
+                retries.append(telegram_summary['retry_after'])
+            results[name] = {
+                'p50': percentile(durations, 50), 'p99': percentile(durations, 99),
+                'calls': round(sum(calls) / len(calls), 1),
+                'api_p50_ms': percentile(latencies, 50) * 1000, 'api_p99_ms': percentile(latencies, 99) * 1000,
+                'users_per_s': items / max(percentile(durations, 50), 1e-9), 'errors': errors,
+                'tg_sent': round(sum(sent) / len(sent), 1), 'tg_429': round(sum(retries) / len(retries), 1),
+            }
+    finally:
+        await env.telegram_bot.shutdown()
+        # prefetches cancelled by a flow may still be running in worker threads
+        await asyncio.get_running_loop().shutdown_default_executor()
+        await panel.stop()
+        await telegram.stop()
+
+    print(f"\n{args.users} users, {args.repeat} run(s) per flow, panel latency {args.latency} ms")
+    print(f"{'flow':<17}{'p50 s':>9}{'p99 s':>9}{'calls':>8}{'api p50':>10}{'api p99':>10}{'users/s':>11}{'errors':>8}"
+          f"{'tg sent':>9}{'tg 429':>8}")
+    for name, r in results.items():
+        print(f"{name:<17}{r['p50']:>9.3f}{r['p99']:>9.3f}{r['calls']:>8}{r['api_p50_ms']:>8.1f}ms{r['api_p99_ms']:>8.1f}ms"
+              f"{r['users_per_s']:>11.0f}{r['errors']:>8}{r['tg_sent']:>9}{r['tg_429']:>8}")
+
+    return compare_baseline(results, args)
+
+
+def compare_baseline(results: dict, args) -> int:
+    try:
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        baseline = {}
+    key = lambda name: f"{name}@{args.users}"
+
+    if args.save_baseline:
+        baseline.update({key(name): {'p50': r['p50'], 'p99': r['p99'], 'calls': r['calls']} for name, r in results.items()})
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {BASELINE_PATH}")
+        return 0
+
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(key(name))
+        if not base: continue
+        for metric in ('p50', 'p99'):
+            if r[metric] > base[metric] * (1 + args.tolerance):
+                regressions.append(f"{name} {metric} {base[metric]:.3f}s -> {r[metric]:.3f}s")
+        if r['calls'] > base['calls']:
+            regressions.append(f"{name} panel calls {base['calls']} -> {r['calls']}")
+    if not baseline:
+        print("\nNo baseline yet; run with --save-baseline to record one.")
+    elif regressions:
+        print("\nREGRESSIONS:\n  " + "\n  ".join(regressions))
+        return 1
+    else:
+        print(f"\nNo regressions (tolerance {args.tolerance:.0%}).")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the bot's panel-facing flows against a fake panel.")
+    parser.add_argument('--users', type=int, default=1000, help="dataset size, e.g. 1000, 10000 or 100000")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1, help="unmeasured runs before each flow")
+    parser.add_argument('--flows', nargs='+', choices=list(FLOWS), default=DEFAULT_FLOWS)
+    parser.add_argument('--bulk-limit', type=int, default=1000, help="users edited by the bulk_update flow (one PATCH each)")
+    parser.add_argument('--bulk-create', type=int, default=10, help="users created by the bulk_create flow")
+    parser.add_argument('--chat-rate', type=float, default=1.0, help="fake Telegram: messages per second to one chat")
+    parser.add_argument('--global-rate', type=float, default=30, help="fake Telegram: messages per second overall")
+    parser.add_argument('--latency', type=float, default=0, help="panel latency per request, ms")
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--rate-limit', type=float, default=0, help="share of panel requests answered with 429")
+    parser.add_argument('--tolerance', type=float, default=0.3, help="allowed slowdown against the baseline")
+    parser.add_argument('--save-baseline', action='store_true')
+    sys.exit(asyncio.run(run(parser.parse_args())))
@@ -0,0 +1,187 @@
+# bench/fake_docker.py
+# Stand-in for the Docker Engine API on a Unix socket, enough of it for
+# docker_api.DockerClient: container inspect/restart/logs and exec. Exec runs
+# the command on this machine and answers with the multiplexed stdout/stderr
+# stream a TTY-less exec gets, cut into frames of --frame-bytes and written to
+# the socket --write-bytes at a time, so frame headers and payloads arrive split.
+#
+#   python bench/fake_docker.py --socket /tmp/fake_docker.sock --frame-bytes 5 --write-bytes 3
+#   python bench/fake_docker.py --check    # checks demux_stream and DockerClient against it, exits 1 on a mismatch
+import argparse, asyncio, os, struct, sys, tempfile, time, uuid
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from docker_api import DockerAPIError, DockerClient, DOCKER_API_VERSION, demux_stream, iter_frames
+
+
+def frame(stream_type: int, payload: bytes) -> bytes:
+    return struct.pack(">BxxxL", stream_type, len(payload)) + payload
+
+
+def multiplex(chunks, frame_bytes: int = 0) -> bytes:
+    """chunks: (stream_type, bytes) in output order; each is cut into frames of at most frame_bytes (0: one frame)."""
+    out = bytearray()
+    for stream_type, data in chunks:
+        step = frame_bytes or len(data) or 1
+        for offset in range(0, len(data), step):
+            out += frame(stream_type, data[offset:offset + step])
+    return bytes(out)
+
+
+class FakeDocker:
+    def __init__(self, frame_bytes: int = 0, write_bytes: int = 0):
+        self.frame_bytes, self.write_bytes = frame_bytes, write_bytes
+        self.containers = {'remnanode': {'status': 'running', 'logs': [], 'restarts': 0}}
+        self.execs = {}
+        self.app = web.Application()
+        r = self.app.router
+        prefix = f"/{DOCKER_API_VERSION}"
+        r.add_get(prefix + '/containers/{name}/json', self.inspect)
+        r.add_post(prefix + '/containers/{name}/restart', self.restart)
+        r.add_get(prefix + '/containers/{name}/logs', self.logs)
+        r.add_post(prefix + '/containers/{name}/exec', self.exec_create)
+        r.add_post(prefix + '/exec/{id}/start', self.exec_start)
+        r.add_get(prefix + '/exec/{id}/json', self.exec_inspect)
+        self.runner = None
+
+    async def start(self, socket_path: str) -> str:
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.UnixSite(self.runner, socket_path).start()
+        return socket_path
+
+    async def stop(self):
+        if self.runner: await self.runner.cleanup()
+
+    def container(self, request) -> dict:
+        container = self.containers.get(request.match_info['name'])
+        if container is None:
+            raise web.HTTPNotFound(text='{"message": "No such container"}', content_type='application/json')
+        return container
+
+    async def send_stream(self, request, data: bytes) -> web.StreamResponse:
+        response = web.StreamResponse(headers={'Content-Type': 'application/vnd.docker.raw-stream'})
+        await response.prepare(request)
+        step = self.write_bytes or len(data) or 1
+        for offset in range(0, len(data), step):
+            await response.write(data[offset:offset + step])
+        await response.write_eof()
+        return response
+
+    async def inspect(self, request):
+        container = self.container(request)
+        return web.json_response({'Name': '/' + request.match_info['name'], 'State': {'Status': container['status']}})
+
+    async def restart(self, request):
+        container = self.container(request)
+        container['restarts'] += 1
+        container['status'] = 'running'
+        return web.Response(status=204)
+
+    async def logs(self, request):
+        container = self.container(request)
+        tail = request.query.get('tail', 'all')
+        lines = container['logs'][-int(tail):] if tail.isdigit() and int(tail) else container['logs']
+        return await self.send_stream(request, multiplex(lines, self.frame_bytes))
+
+    async def exec_create(self, request):
+        self.container(request)
+        exec_id = uuid.uuid4().hex
+        self.execs[exec_id] = {'Cmd': (await request.json())['Cmd'], 'ExitCode': None, 'Running': False}
+        return web.json_response({'Id': exec_id}, status=201)
+
+    async def exec_start(self, request):
+        state = self.execs.get(request.match_info['id'])
+        if state is None:
+            raise web.HTTPNotFound(text='{"message": "No such exec instance"}', content_type='application/json')
+        state['Running'] = True
+        proc = await asyncio.create_subprocess_exec(*state['Cmd'], stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await proc.communicate()
+        state['Running'], state['ExitCode'] = False, proc.returncode
+        # stdout before stderr: the order within each stream is what matters
+        return await self.send_stream(request, multiplex([(1, stdout), (2, stderr)], self.frame_bytes))
+
+    async def exec_inspect(self, request):
+        state = self.execs.get(request.match_info['id'])
+        if state is None:
+            raise web.HTTPNotFound(text='{"message": "No such exec instance"}', content_type='application/json')
+        return web.json_response(state)
+
+
+# --- --check ---
+
+def check_frames(failures: list):
+    def expect(name, got, want):
+        if got != want: failures.append(f"{name}: got {got!r}, want {want!r}")
+
+    out, err = b"line one\nline two\n" * 50, b"warning: \0\0\0 not a header\n"
+    interleaved = [(1, out[:100]), (2, err[:7]), (1, out[100:]), (2, err[7:])]
+    for frame_bytes in (0, 1, 3, 8, 64):
+        expect(f"split frames of {frame_bytes or 'any'} bytes", demux_stream(multiplex(interleaved, frame_bytes)), (out, err))
+    expect("empty frames", demux_stream(frame(1, b"") + frame(2, b"e") + frame(1, b"")), (b"", b"e"))
+    expect("only stderr", demux_stream(frame(2, err)), (b"", err))
+    expect("no output", demux_stream(b""), (b"", b""))
+    expect("TTY output is stdout", demux_stream(b"plain text from a tty\n"), (b"plain text from a tty\n", b""))
+    expect("short TTY output", demux_stream(b"ok\n"), (b"ok\n", b""))
+    data = multiplex([(1, b"abcdef"), (2, b"ghij")])
+    expect("last payload cut short", demux_stream(data[:-2]), (b"abcdef", b"gh"))
+    expect("last header cut short", demux_stream(data[:14 + 5]), (b"abcdef", b""))
+    expect("frames from iter_frames", list(iter_frames(multiplex(interleaved, 60)))[:2], [(1, out[:60]), (1, out[60:100])])
+
+
+async def check_client(failures: list, frame_bytes: int, write_bytes: int):
+    def expect(name, got, want):
+        if got != want: failures.append(f"{name} (frames of {frame_bytes}, writes of {write_bytes}): got {got!r:.200}, want {want!r:.200}")
+
+    fake = FakeDocker(frame_bytes, write_bytes)
+    fake.containers['remnanode']['logs'] = [(1, b"started\n"), (2, b"error: boom\n"), (1, b"ready\n")]
+    socket_path = os.path.join(tempfile.mkdtemp(prefix='fake_docker_'), 'docker.sock')
+    await fake.start(socket_path)
+    client = DockerClient(socket_path)
+    try:
+        expect("exec", await client.exec_run('remnanode', ['sh', '-c', 'printf out; printf err >&2; exit 3']), (3, b"out", b"err"))
+        big = await client.exec_run('remnanode', ['sh', '-c', 'seq 1 20000; seq 1 500 >&2'])
+        expect("large exec", (big[0], big[1].count(b"\n"), big[2].count(b"\n")), (0, 20000, 500))
+        expect("logs", await client.container_logs('remnanode', tail=2), "error: boom\nready\n")
+        expect("state", await client.container_state('remnanode'), 'running')
+        expect("missing container", await client.container_state('nope'), 'missing')
+        try:
+            await client.exec_run('nope', ['true'])
+            failures.append("exec in a missing container did not raise")
+        except DockerAPIError as e:
+            expect("missing container error", (e.status_code, str(e)), (404, "No such container"))
+    finally:
+        await client.close()
+        await fake.stop()
+
+
+async def check(args) -> int:
+    failures = []
+    check_frames(failures)
+    started = time.perf_counter()
+    for frame_bytes, write_bytes in ((0, 0), (args.frame_bytes or 5, args.write_bytes or 3), (4096, 1000)):
+        await check_client(failures, frame_bytes, write_bytes)
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    print(f"{'ok' if not failures else f'{len(failures)} failure(s)'} in {time.perf_counter() - started:.1f}s")
+    return 1 if failures else 0
+
+
+async def serve(args):
+    fake = FakeDocker(args.frame_bytes, args.write_bytes)
+    await fake.start(args.socket)
+    print(f"Fake Docker API listening on {args.socket} (pass it as DockerClient(socket_path=...))")
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fake Docker Engine API on a Unix socket, for docker_api.py.")
+    parser.add_argument('--socket', default='/tmp/fake_docker.sock')
+    parser.add_argument('--frame-bytes', type=int, default=0, help="cut output into frames of this size (0: one frame per stream)")
+    parser.add_argument('--write-bytes', type=int, default=0, help="write responses to the socket this many bytes at a time")
+    parser.add_argument('--check', action='store_true', help="check demux_stream and DockerClient, then exit")
+    args = parser.parse_args()
+    try:
+        sys.exit(asyncio.run(check(args)) if args.check else asyncio.run(serve(args)))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,265 @@
+# bench/fake_panel.py
+# Stand-in for the Remnawave panel API with a synthetic user base, so the bot's
+# panel-facing flows can be measured without touching a real panel.
+#
+#   python bench/fake_panel.py --users 10000 --latency 20 --error-rate 0.01 --rate-limit 0.02
+#
+# Latency is added to every request; --error-rate answers that share of requests
+# with 500 and --rate-limit with 429. GET /_stats returns per-endpoint request
+# counts, POST /_reset clears them and restores the dataset.
+import argparse, asyncio, random, uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from aiohttp import web
+
+STATUSES = ('ACTIVE', 'ACTIVE', 'ACTIVE', 'ACTIVE', 'DISABLED', 'EXPIRED', 'LIMITED')
+GB = 1024 ** 3
+
+
+def iso(dt: datetime) -> str:
+    return dt.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+class PanelDataset:
+    """Deterministic synthetic panel data: users, squads, HWID devices and subscription request history."""
+
+    def __init__(self, users: int, history_per_user: float = 3.0, seed: int = 1):
+        rng = random.Random(seed)
+        self.uuid = lambda: str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        now = datetime.now(timezone.utc)
+        self.internal_squads = [{'uuid': self.uuid(), 'name': f"squad-{i}", 'info': {'membersCount': 0, 'inboundsCount': 3}}
+                                for i in range(4)]
+        self.external_squads = [{'uuid': self.uuid(), 'name': f"reseller-{i}"} for i in range(3)]
+        self.users = {}
+        for i in range(users):
+            user = self.make_user(rng, f"user{i:06d}", now - timedelta(days=rng.uniform(0, 365)), now)
+            self.users[user['id']] = user
+        self.by_username = {u['username']: u for u in self.users.values()}
+
+        ids = list(self.users)
+        records = []
+        for _ in range(int(users * history_per_user)):
+            user_id = rng.choice(ids)
+            records.append({'id': len(records) + 1, 'userId': user_id,
+                            'requestAt': iso(now - timedelta(hours=rng.expovariate(1 / 72))),
+                            'requestIp': f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}",
+                            'userAgent': rng.choice(('Happ/3.1', 'v2rayNG/1.9', 'Streisand/1.6', 'Hiddify/2.5'))})
+        records.sort(key=lambda r: r['requestAt'], reverse=True)  # newest first, like the panel
+        self.history = records
+        self.devices = {user_id: [{'hwid': self.uuid(), 'platform': 'android', 'deviceModel': 'Pixel', 'createdAt': iso(now)}
+                                  for _ in range(rng.randrange(3))] for user_id in ids[:min(users, 5000)]}
+
+    def make_user(self, rng, username: str, created: datetime, now: datetime) -> dict:
+        user_id = self.uuid()
+        expire = created + timedelta(days=rng.choice((30, 60, 90, 365)))
+        status = 'EXPIRED' if expire < now else rng.choice(STATUSES)
+        limit = rng.choice((0, 50, 100, 200)) * GB
+        return {
+            'id': user_id, 'uuid': user_id, 'shortUuid': user_id[:16], 'username': username,
+            'status': status, 'trafficLimitBytes': limit, 'trafficLimitStrategy': 'MONTH',
+            'expireAt': iso(expire), 'createdAt': iso(created), 'updatedAt': iso(created),
+            'telegramId': None, 'email': None, 'description': '', 'tag': None,
+            'hwidDeviceLimit': rng.choice((None, 1, 2, 3)),
+            'subLastUserAgent': 'Happ/3.1', 'subLastOpenedAt': iso(now - timedelta(hours=rng.uniform(0, 500))),
+            'onlineAt': iso(now - timedelta(hours=rng.uniform(0, 500))), 'firstConnectedAt': iso(created + timedelta(hours=1)),
+            'lastTriggeredThreshold': 0, 'lastTrafficResetAt': None,
+            'subscriptionUrl': f"https://sub.example.com/{user_id[:16]}",
+            'externalSquadUuid': rng.choice([None, None] + [s['uuid'] for s in self.external_squads]),
+            'activeInternalSquads': [{'uuid': s['uuid'], 'name': s['name']} for s in rng.sample(self.internal_squads, 1)],
+            'userTraffic': {'usedTrafficBytes': int(limit * rng.random()), 'lifetimeUsedTrafficBytes': int(limit * 3 * rng.random()),
+                            'onlineAt': None, 'firstConnectedAt': None, 'lastConnectedNodeUuid': None},
+        }
+
+
+class FakePanel:
+    def __init__(self, users: int = 1000, latency_ms: float = 0, jitter_ms: float = 0,
+                 error_rate: float = 0, rate_limit: float = 0, seed: int = 1):
+        self.users_count, self.seed = users, seed
+        self.latency_ms, self.jitter_ms = latency_ms, jitter_ms
+        self.error_rate, self.rate_limit = error_rate, rate_limit
+        self.rng = random.Random(seed + 1)
+        self.requests = Counter()
+        self.data = PanelDataset(users, seed=seed)
+        self.app = web.Application(middlewares=[self.middleware])
+        r = self.app.router
+        r.add_get('/_stats', self.stats)
+        r.add_post('/_reset', self.reset)
+        r.add_get('/api/users', self.list_users)
+        r.add_post('/api/users', self.create_user)
+        r.add_patch('/api/users', self.update_user)
+        r.add_post('/api/users/bulk/delete', self.bulk_delete)
+        r.add_post('/api/users/bulk/update', self.bulk_update)
+        r.add_get('/api/users/by-username/{username}', self.get_by_username)
+        r.add_delete('/api/users/{id}', self.delete_user)
+        r.add_post('/api/users/{id}/actions/{action}', self.user_action)
+        r.add_get('/api/subscriptions/by-username/{username}', self.subscription)
+        r.add_get('/api/subscription-request-history', self.sub_history)
+        r.add_get('/api/hwid/devices/{id}', self.hwid_devices)
+        r.add_post('/api/hwid/devices/delete', self.hwid_delete)
+        r.add_post('/api/hwid/devices/delete-all', self.hwid_delete_all)
+        r.add_get('/api/internal-squads', self.internal_squads)
+        r.add_get('/api/external-squads', self.external_squads)
+        self.runner = None
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        if request.path.startswith('/_'):
+            return await handler(request)
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        self.requests[f"{request.method} {route}"] += 1
+        if self.latency_ms or self.jitter_ms:
+            await asyncio.sleep(max(0.0, self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+        roll = self.rng.random()
+        if roll < self.rate_limit:
+            return web.json_response({'message': 'Too many requests'}, status=429, headers={'Retry-After': '1'})
+        if roll < self.rate_limit + self.error_rate:
+            return web.json_response({'message': 'Internal server error'}, status=500)
+        return await handler(request)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        return f"http://{host}:{site._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        if self.runner: await self.runner.cleanup()
+
+    def reset_dataset(self):
+        self.data = PanelDataset(self.users_count, seed=self.seed)
+        self.requests.clear()
+
+    # --- service endpoints ---
+    async def stats(self, request):
+        return web.json_response({'requests': self.requests, 'users': len(self.data.users)})
+
+    async def reset(self, request):
+        self.reset_dataset()
+        return web.json_response({'ok': True})
+
+    # --- users ---
+    async def list_users(self, request):
+        start = int(request.query.get('start', 0))
+        size = int(request.query.get('size', 25))
+        users = list(self.data.users.values())[start:start + size]
+        return web.json_response({'response': {'users': users, 'total': len(self.data.users)}})
+
+    async def get_by_username(self, request):
+        user = self.data.by_username.get(request.match_info['username'])
+        if not user:
+            return web.json_response({'message': 'User not found'}, status=404)
+        return web.json_response({'response': user})
+
+    async def create_user(self, request):
+        body = await request.json()
+        if body.get('username') in self.data.by_username:
+            return web.json_response({'message': 'User already exists'}, status=400)
+        now = datetime.now(timezone.utc)
+        user = self.data.make_user(self.rng, body['username'], now, now)
+        user.update({k: v for k, v in body.items() if k in user})
+        self.data.users[user['id']] = self.data.by_username[user['username']] = user
+        return web.json_response({'response': user}, status=201)
+
+    async def update_user(self, request):
+        body = await request.json()
+        user = self.data.users.get(body.get('id') or body.get('uuid'))
+        if not user:
+            return web.json_response({'message': 'User not found'}, status=404)
+        user.update({k: v for k, v in body.items() if k not in ('id', 'uuid')})
+        return web.json_response({'response': user})
+
+    async def delete_user(self, request):
+        user = self.data.users.pop(request.match_info['id'], None)
+        if not user:
+            return web.json_response({'message': 'User not found'}, status=404)
+        self.data.by_username.pop(user['username'], None)
+        return web.json_response({'response': {'isDeleted': True}})
+
+    async def user_action(self, request):
+        user = self.data.users.get(request.match_info['id'])
+        if not user:
+            return web.json_response({'message': 'User not found'}, status=404)
+        action = request.match_info['action']
+        if action in ('enable', 'disable'):
+            user['status'] = 'ACTIVE' if action == 'enable' else 'DISABLED'
+        elif action == 'reset-traffic':
+            user['userTraffic']['usedTrafficBytes'] = 0
+        return web.json_response({'response': user})
+
+    async def bulk_delete(self, request):
+        body = await request.json()
+        deleted = 0
+        for user_id in body.get('userIds', []):
+            user = self.data.users.pop(user_id, None)
+            if user:
+                self.data.by_username.pop(user['username'], None)
+                deleted += 1
+        return web.json_response({'response': {'affectedRows': deleted}})
+
+    async def bulk_update(self, request):
+        body = await request.json()
+        fields, updated = body.get('fields', {}), 0
+        for user_id in body.get('userIds', []):
+            if user_id in self.data.users:
+                self.data.users[user_id].update(fields)
+                updated += 1
+        return web.json_response({'response': {'affectedRows': updated}})
+
+    async def subscription(self, request):
+        user = self.data.by_username.get(request.match_info['username'])
+        if not user:
+            return web.json_response({'message': 'User not found'}, status=404)
+        links = [f"vless://{user['id']}@node{i}.example.com:443?security=reality#node{i}" for i in range(5)]
+        return web.json_response({'response': {'subscriptionUrl': user['subscriptionUrl'], 'links': links, 'user': user}})
+
+    async def sub_history(self, request):
+        start = int(request.query.get('start', 0))
+        size = int(request.query.get('size', 25))
+        return web.json_response({'response': {'records': self.data.history[start:start + size], 'total': len(self.data.history)}})
+
+    # --- HWID devices ---
+    async def hwid_devices(self, request):
+        devices = self.data.devices.get(request.match_info['id'], [])
+        return web.json_response({'response': {'devices': devices, 'total': len(devices)}})
+
+    async def hwid_delete(self, request):
+        body = await request.json()
+        devices = self.data.devices.get(body.get('userUuid'), [])
+        devices[:] = [d for d in devices if d['hwid'] != body.get('hwid')]
+        return web.json_response({'response': {'devices': devices, 'total': len(devices)}})
+
+    async def hwid_delete_all(self, request):
+        body = await request.json()
+        self.data.devices[body.get('userUuid')] = []
+        return web.json_response({'response': {'devices': [], 'total': 0}})
+
+    # --- squads ---
+    async def internal_squads(self, request):
+        return web.json_response({'response': {'total': len(self.data.internal_squads), 'internalSquads': self.data.internal_squads}})
+
+    async def external_squads(self, request):
+        return web.json_response({'response': {'total': len(self.data.external_squads), 'externalSquads': self.data.external_squads}})
+
+
+async def serve(args):
+    panel = FakePanel(args.users, args.latency, args.jitter, args.error_rate, args.rate_limit, args.seed)
+    url = await panel.start(args.host, args.port)
+    print(f"Fake panel with {args.users} users listening on {url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fake Remnawave panel API for benchmarks.")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0, help="added latency per request, ms")
+    parser.add_argument('--jitter', type=float, default=0, help="latency jitter, ms")
+    parser.add_argument('--error-rate', type=float, default=0, help="share of requests answered with 500")
+    parser.add_argument('--rate-limit', type=float, default=0, help="share of requests answered with 429")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
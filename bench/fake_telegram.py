@@ -0,0 +1,285 @@
+# bench/fake_telegram.py
+# Stand-in for the Telegram Bot API with Telegram-like flood control, so message
+# delivery (bulk creation banners, reports, menus) can be measured offline.
+#
+#   python bench/fake_telegram.py --port 8081 --chat-rate 1 --global-rate 30
+#   python config_manager.py set TELEGRAM_API_BASE_URL http://127.0.0.1:8081
+#
+# Sending methods take tokens from a per-chat and a global bucket; when either
+# is empty the call is answered with 429 and parameters.retry_after, which the
+# bot sees as telegram.error.RetryAfter. Every call is timed. GET /_stats
+# returns the summary, POST /_reset clears it, POST /_updates queues an update
+# for getUpdates.
+import argparse, asyncio, json, math, time
+from collections import defaultdict
+from aiohttp import web
+
+# methods that deliver or change a message and count against flood control
+LIMITED_METHODS = {'sendMessage', 'sendPhoto', 'sendDocument', 'sendMediaGroup', 'editMessageText',
+                   'editMessageCaption', 'editMessageReplyMarkup', 'editMessageMedia', 'copyMessage', 'forwardMessage'}
+BOT_USER = {'id': 100000, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot',
+            'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+
+
+def percentile(values: list, p: float) -> float:
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered) + 0.5) - 1))]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate, self.burst = rate, burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, count: int = 1) -> float:
+        """Takes `count` tokens and returns 0, or returns the seconds until they would be available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= count:
+            self.tokens -= count
+            return 0.0
+        return (count - self.tokens) / self.rate
+
+
+class FakeTelegram:
+    """
+    Bot API server for any token. Private chats (positive ids) get chat_rate
+    messages per second, groups (negative ids) group_rate per minute, and all
+    chats together global_rate per second, each with a small burst allowance.
+    """
+
+    def __init__(self, chat_rate: float = 1.0, chat_burst: float = 3, group_rate: float = 20,
+                 global_rate: float = 30, latency_ms: float = 0):
+        self.chat_rate, self.chat_burst, self.group_rate = chat_rate, chat_burst, group_rate
+        self.global_rate, self.latency_ms = global_rate, latency_ms
+        self.app = web.Application(client_max_size=60 * 1024 * 1024)
+        self.app.router.add_get('/_stats', self.stats)
+        self.app.router.add_post('/_reset', self.reset)
+        self.app.router.add_post('/_updates', self.queue_update)
+        self.app.router.add_route('*', '/bot{token}/{method}', self.dispatch)
+        self.runner = None
+        self.updates_changed = asyncio.Condition()
+        self.reset_state()
+
+    def reset_state(self):
+        self.global_bucket = TokenBucket(self.global_rate, self.global_rate)
+        self.chat_buckets = {}
+        self.calls = []  # (method, chat_id, status, started, seconds, bytes)
+        self.messages = defaultdict(dict)  # chat_id -> message_id -> message
+        self.last_message_id = 0
+        self.updates = []
+        self.last_update_id = 0
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        return f"http://{host}:{site._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        if self.runner: await self.runner.cleanup()
+
+    # --- flood control ---
+    def chat_bucket(self, chat_id: int) -> TokenBucket:
+        if chat_id not in self.chat_buckets:
+            if chat_id < 0:
+                self.chat_buckets[chat_id] = TokenBucket(self.group_rate / 60, self.chat_burst)
+            else:
+                self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return self.chat_buckets[chat_id]
+
+    def retry_after(self, chat_id: int, count: int) -> int:
+        """Seconds the caller has to wait, or 0 when the call may go through now."""
+        wait = self.chat_bucket(chat_id).take(count)
+        if wait:
+            return max(1, math.ceil(wait))
+        wait = self.global_bucket.take(count)
+        if wait:
+            self.chat_bucket(chat_id).tokens += count  # not sent, give the chat its tokens back
+            return max(1, math.ceil(wait))
+        return 0
+
+    # --- requests ---
+    async def dispatch(self, request):
+        started = time.perf_counter()
+        method = request.match_info['method']
+        form = await request.post()
+        params = {}
+        for key, value in form.items():
+            if isinstance(value, str):
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    params[key] = value
+            else:
+                params[key] = value  # uploaded file
+        chat_id = params.get('chat_id')
+        chat_id = int(chat_id) if isinstance(chat_id, (int, str)) and str(chat_id).lstrip('-').isdigit() else 0
+
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        if method == 'getUpdates':
+            status, body = 200, await self.get_updates(params)
+        elif method in LIMITED_METHODS and (wait := self.retry_after(chat_id, len(params.get('media') or [1]))):
+            status, body = 429, {'ok': False, 'error_code': 429, 'description': f"Too Many Requests: retry after {wait}",
+                                 'parameters': {'retry_after': wait}}
+        else:
+            status, body = self.handle(method, chat_id, params)
+        self.calls.append((method, chat_id, status, started, time.perf_counter() - started, request.content_length or 0))
+        return web.json_response(body, status=status)
+
+    def handle(self, method: str, chat_id: int, params: dict):
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': BOT_USER}
+        if method in ('sendMessage', 'sendPhoto', 'sendDocument', 'copyMessage', 'forwardMessage'):
+            return 200, {'ok': True, 'result': self.new_message(chat_id, method, params)}
+        if method == 'sendMediaGroup':
+            media = params.get('media') or []
+            return 200, {'ok': True, 'result': [self.new_message(chat_id, 'sendPhoto', item) for item in media]}
+        if method in ('editMessageText', 'editMessageCaption', 'editMessageReplyMarkup', 'editMessageMedia'):
+            message = self.messages[chat_id].get(int(params.get('message_id', 0)))
+            if message is None:
+                return 400, {'ok': False, 'error_code': 400, 'description': "Bad Request: message to edit not found"}
+            if method == 'editMessageText' and 'text' not in message:
+                return 400, {'ok': False, 'error_code': 400, 'description': "Bad Request: there is no text in the message to edit"}
+            field = {'editMessageText': 'text', 'editMessageCaption': 'caption'}.get(method)
+            edited = {**message, 'edit_date': int(time.time())}
+            if field: edited[field] = params.get(field, '')
+            if method == 'editMessageMedia':
+                media = params.get('media') or {}
+                edited.pop('text', None)
+                edited['caption'] = media.get('caption')
+                edited['photo'] = [{'file_id': f"photo-{edited['message_id']}-{edited['edit_date']}",
+                                    'file_unique_id': f"photo-{edited['message_id']}", 'width': 512, 'height': 512}]
+            if 'reply_markup' in params or field or method == 'editMessageMedia':
+                edited['reply_markup'] = params.get('reply_markup')
+            edited = {k: v for k, v in edited.items() if v is not None}
+            if {k: v for k, v in edited.items() if k != 'edit_date'} == {k: v for k, v in message.items() if k != 'edit_date'}:
+                return 400, {'ok': False, 'error_code': 400, 'description':
+                             "Bad Request: message is not modified: specified new message content and reply markup "
+                             "are exactly the same as a current content and reply markup of the message"}
+            self.messages[chat_id][edited['message_id']] = edited
+            return 200, {'ok': True, 'result': edited}
+        if method == 'deleteMessage':
+            if self.messages[chat_id].pop(int(params.get('message_id', 0)), None) is None:
+                return 400, {'ok': False, 'error_code': 400, 'description': "Bad Request: message to delete not found"}
+            return 200, {'ok': True, 'result': True}
+        # answerCallbackQuery, deleteWebhook, setMyCommands, sendChatAction, ...
+        return 200, {'ok': True, 'result': True}
+
+    def new_message(self, chat_id: int, method: str, params: dict) -> dict:
+        self.last_message_id += 1
+        message = {'message_id': self.last_message_id, 'date': int(time.time()), 'from': BOT_USER,
+                   'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup', 'first_name': 'Admin'}}
+        if method == 'sendMessage':
+            message['text'] = params.get('text', '')
+        elif method == 'sendPhoto':
+            file_id = f"photo-{self.last_message_id}"
+            message['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 512, 'height': 512}]
+        elif method == 'sendDocument':
+            document = params.get('document')
+            file_id = f"doc-{self.last_message_id}"
+            message['document'] = {'file_id': file_id, 'file_unique_id': file_id,
+                                   'file_name': getattr(document, 'filename', None) or 'file',
+                                   'file_size': len(document.file.read()) if hasattr(document, 'file') else 0}
+        if params.get('caption'):
+            message['caption'] = params['caption']
+        if params.get('reply_markup'):
+            message['reply_markup'] = params['reply_markup']
+        self.messages[chat_id][self.last_message_id] = message
+        return message
+
+    # --- updates ---
+    def incoming_text(self, chat_id: int, user: dict, text: str) -> dict:
+        """An update for a message the user typed; it is stored, so the bot can delete it."""
+        self.last_message_id += 1
+        message = {'message_id': self.last_message_id, 'date': int(time.time()), 'from': user, 'text': text,
+                   'chat': {'id': chat_id, 'type': 'private', 'first_name': user.get('first_name', '')}}
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        self.messages[chat_id][message['message_id']] = message
+        return {'message': message}
+
+    def incoming_click(self, chat_id: int, user: dict, data: str) -> dict:
+        """An update for pressing the button with callback data `data` on the newest message that has it."""
+        for message in reversed(self.messages[chat_id].values()):
+            buttons = [b for row in (message.get('reply_markup') or {}).get('inline_keyboard', []) for b in row]
+            if any(b.get('callback_data') == data for b in buttons):
+                self.last_update_id += 1
+                return {'callback_query': {'id': str(self.last_update_id), 'from': user, 'chat_instance': str(chat_id),
+                                           'data': data, 'message': message}}
+        raise LookupError(f"No message in chat {chat_id} has a '{data}' button")
+
+    async def add_update(self, update: dict) -> dict:
+        """Queues an update (a dict without update_id) for getUpdates and returns it."""
+        self.last_update_id += 1
+        update = {**update, 'update_id': self.last_update_id}
+        async with self.updates_changed:
+            self.updates.append(update)
+            self.updates_changed.notify_all()
+        return update
+
+    async def get_updates(self, params: dict) -> dict:
+        offset = int(params.get('offset') or 0)
+        self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates and params.get('timeout'):
+            async with self.updates_changed:
+                try:
+                    await asyncio.wait_for(self.updates_changed.wait(), float(params['timeout']))
+                except asyncio.TimeoutError:
+                    pass
+        return {'ok': True, 'result': self.updates[:int(params.get('limit') or 100)]}
+
+    # --- reporting ---
+    def summary(self) -> dict:
+        """Per-method counts, 429s and handling times, plus the delivery rate of successful sends."""
+        methods = {}
+        for method in sorted({c[0] for c in self.calls}):
+            calls = [c for c in self.calls if c[0] == method]
+            seconds = [c[4] for c in calls]
+            methods[method] = {'calls': len(calls), 'ok': sum(c[2] == 200 for c in calls),
+                               'retry_after': sum(c[2] == 429 for c in calls), 'bytes': sum(c[5] for c in calls),
+                               'p50_ms': percentile(seconds, 50) * 1000, 'p99_ms': percentile(seconds, 99) * 1000}
+        delivered = [c for c in self.calls if c[0] in LIMITED_METHODS and c[2] == 200]
+        span = delivered[-1][3] - delivered[0][3] if len(delivered) > 1 else 0
+        return {'methods': methods, 'delivered': len(delivered),
+                'retry_after': sum(c[2] == 429 for c in self.calls),
+                'messages_per_s': (len(delivered) - 1) / span if span else 0.0}
+
+    async def stats(self, request):
+        return web.json_response(self.summary())
+
+    async def reset(self, request):
+        self.reset_state()
+        return web.json_response({'ok': True})
+
+    async def queue_update(self, request):
+        return web.json_response(await self.add_update(await request.json()))
+
+
+async def serve(args):
+    telegram = FakeTelegram(args.chat_rate, args.chat_burst, args.group_rate, args.global_rate, args.latency)
+    url = await telegram.start(args.host, args.port)
+    print(f"Fake Bot API listening on {url} (set TELEGRAM_API_BASE_URL to this)")
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API with flood control, for benchmarks.")
+    parser.add_argument('--chat-rate', type=float, default=1.0, help="messages per second to one private chat")
+    parser.add_argument('--chat-burst', type=float, default=3, help="messages a chat may receive back to back")
+    parser.add_argument('--group-rate', type=float, default=20, help="messages per minute to one group")
+    parser.add_argument('--global-rate', type=float, default=30, help="messages per second across all chats")
+    parser.add_argument('--latency', type=float, default=0, help="added latency per request, ms")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,206 @@
+# bench/replay.py
+# Replays scripted admin sessions through the bot's real Application and
+# ConversationHandler, against bench/fake_panel.py and bench/fake_telegram.py,
+# and reports for every step how long it took and how many panel and Bot API
+# calls it made.
+#
+#   python bench/replay.py                                  # all sessions
+#   python bench/replay.py --sessions manage_user_qr --repeat 5
+#   python bench/replay.py --sessions bulk_create --bulk-count 200
+#   python bench/replay.py --save-baseline    # record the call counts per step
+#   python bench/replay.py                    # exits 1 if a step makes more calls than recorded
+#
+# Updates are built the way Telegram would send them (a click presses a button
+# that is really on the newest message carrying it) and handed to
+# Application.process_update, so a step's time is the handler's time. Work a
+# handler leaves running in the background (bulk creation) is waited for and
+# shown separately as "done". The per-chat flood control budget is refilled
+# before each step, as a human pause would, unless --no-pause is given.
+import argparse, asyncio, json, os, sys, tempfile, time, warnings
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BENCH_DIR, 'replay_baseline.json')
+sys.path.insert(0, BENCH_DIR)
+
+from fake_panel import FakePanel
+from fake_telegram import FakeTelegram
+from bench import import_bot, percentile
+
+ADMIN = {'id': 1, 'is_bot': False, 'first_name': 'Admin', 'language_code': 'en'}
+CHAT_ID = 1
+
+
+def session_steps(args) -> dict:
+    """Session name -> list of ('text', value) or ('click', callback_data) steps."""
+    return {
+        'manage_user_qr': [
+            ('text', '/start'), ('click', 'go_manage_user'), ('text', 'user000001'),
+            ('click', 'show_qr'), ('click', 'back_to_user_info'), ('click', 'back_to_main'),
+        ],
+        'user_refresh': [
+            ('text', '/start'), ('click', 'go_manage_user'), ('text', 'user000002'),
+            ('click', 'refresh'), ('click', 'back_to_main'),
+        ],
+        'expiring_users': [
+            ('text', '/start'), ('click', 'go_expiring_users'), ('click', 'expiring_1'),
+            ('click', 'go_expiring_users'), ('click', 'back_to_main'),
+        ],
+        'activity_report': [
+            ('text', '/start'), ('click', 'go_updated_users'), ('text', '24'),
+        ],
+        'bulk_create': [
+            ('text', '/start'), ('click', 'go_bulk_create'), ('text', str(args.bulk_count)),
+            ('text', 'replay(1)'), ('text', '10'), ('text', '30'), ('click', 'bulk_internal_done'),
+            ('click', 'extsq_none'), ('click', 'bulk_hwid_disable'), ('click', 'bulk_banner_sub'),
+        ],
+    }
+
+
+class Replay:
+    def __init__(self, bot, application, panel: FakePanel, telegram: FakeTelegram, pause: bool = True):
+        self.bot, self.application = bot, application
+        self.panel, self.telegram = panel, telegram
+        self.pause = pause
+
+    async def step(self, kind: str, value: str) -> dict:
+        if kind == 'text':
+            data = self.telegram.incoming_text(CHAT_ID, ADMIN, value)
+        else:
+            data = self.telegram.incoming_click(CHAT_ID, ADMIN, value)
+        update = self.bot.Update.de_json(await self.telegram.add_update(data), self.application.bot)
+
+        if self.pause:
+            self.telegram.chat_buckets.clear()  # the admin reads the screen before the next click
+        panel_before, telegram_before = sum(self.panel.requests.values()), len(self.telegram.calls)
+        tasks_before = asyncio.all_tasks()
+        started = time.perf_counter()
+        await self.application.process_update(update)
+        handled = time.perf_counter() - started
+        background = asyncio.all_tasks() - tasks_before
+        if background:
+            await asyncio.wait(background)
+        done = time.perf_counter() - started
+        failures = [repr(task.exception()) for task in background if not task.cancelled() and task.exception()]
+
+        bot_api = self.telegram.calls[telegram_before:]
+        return {'handler': handled, 'done': done, 'panel_calls': sum(self.panel.requests.values()) - panel_before,
+                'bot_api_calls': len(bot_api), 'retry_after': sum(c[2] == 429 for c in bot_api),
+                'methods': Counter(c[0] for c in bot_api if c[0] != 'answerCallbackQuery'), 'failures': failures}
+
+    async def run_session(self, steps: list) -> list:
+        self.panel.reset_dataset()
+        self.telegram.reset_state()
+        return [await self.step(kind, value) for kind, value in steps]
+
+
+def short_methods(methods: Counter) -> str:
+    names = {'sendMessage': 'send', 'sendPhoto': 'photo', 'sendDocument': 'doc', 'editMessageText': 'edit',
+             'editMessageMedia': 'media', 'editMessageReplyMarkup': 'markup', 'deleteMessage': 'del'}
+    return ' '.join(f"{names.get(m, m)}x{n}" for m, n in sorted(methods.items()))
+
+
+async def run(args) -> int:
+    panel = FakePanel(args.users, args.latency)
+    telegram = FakeTelegram(args.chat_rate, global_rate=args.global_rate, latency_ms=args.telegram_latency)
+    panel_url, telegram_url = await panel.start(), await telegram.start()
+    bot = import_bot(panel_url, telegram_url, tempfile.mkdtemp(prefix='remna_replay_'))
+    application = bot.build_application()
+    await application.initialize()
+    replay = Replay(bot, application, panel, telegram, pause=not args.no_pause)
+
+    sessions = session_steps(args)
+    results = {}
+    try:
+        for name in args.sessions:
+            runs = []
+            for _ in range(args.repeat):
+                try:
+                    runs.append(await replay.run_session(sessions[name]))
+                except LookupError as e:
+                    print(f"{name}: {e}", file=sys.stderr)
+                    break
+            results[name] = runs
+    finally:
+        await application.shutdown()
+        await asyncio.get_running_loop().shutdown_default_executor()
+        await panel.stop()
+        await telegram.stop()
+
+    print(f"\n{args.users} users, {args.repeat} run(s) per session, panel latency {args.latency} ms, "
+          f"Bot API latency {args.telegram_latency} ms")
+    counts = {}
+    for name, runs in results.items():
+        if not runs: continue
+        print(f"\n{name}")
+        print(f"  {'step':<28}{'p50 ms':>9}{'p99 ms':>9}{'done ms':>10}{'panel':>7}{'bot api':>9}{'429':>5}  methods")
+        counts[name] = []
+        for index, (kind, value) in enumerate(sessions[name][:len(runs[0])]):
+            step_runs = [run[index] for run in runs]
+            last = step_runs[-1]
+            handler_ms = [r['handler'] * 1000 for r in step_runs]
+            label = value if kind == 'text' else f"[{value}]"
+            print(f"  {label[:27]:<28}{percentile(handler_ms, 50):>9.1f}{percentile(handler_ms, 99):>9.1f}"
+                  f"{percentile([r['done'] * 1000 for r in step_runs], 50):>10.1f}{last['panel_calls']:>7}"
+                  f"{last['bot_api_calls']:>9}{last['retry_after']:>5}  {short_methods(last['methods'])}")
+            for failure in sorted({f for r in step_runs for f in r['failures']}):
+                print(f"    ! background task failed: {failure}")
+            counts[name].append({'step': label, 'panel_calls': last['panel_calls'],
+                                 'bot_api_calls': last['bot_api_calls'] - last['retry_after']})
+        total = [sum(r['handler'] for r in run) * 1000 for run in runs]
+        print(f"  {'total':<28}{percentile(total, 50):>9.1f}{percentile(total, 99):>9.1f}")
+
+    return compare_baseline(counts, args)
+
+
+def compare_baseline(counts: dict, args) -> int:
+    """Call counts are deterministic, so any increase over the recorded ones is a regression."""
+    try:
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        baseline = {}
+    key = lambda name: f"{name}@{args.users}" + (f"/{args.bulk_count}" if name == 'bulk_create' else '')
+
+    if args.save_baseline:
+        baseline.update({key(name): steps for name, steps in counts.items()})
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {BASELINE_PATH}")
+        return 0
+
+    regressions = []
+    for name, steps in counts.items():
+        recorded = baseline.get(key(name))
+        if not recorded: continue
+        for step, base in zip(steps, recorded):
+            for metric in ('panel_calls', 'bot_api_calls'):
+                if step[metric] > base[metric]:
+                    regressions.append(f"{name} {step['step']}: {metric} {base[metric]} -> {step[metric]}")
+    if not baseline:
+        print("\nNo baseline yet; run with --save-baseline to record one.")
+    elif regressions:
+        print("\nMORE ROUND TRIPS THAN THE BASELINE:\n  " + "\n  ".join(regressions))
+        return 1
+    else:
+        print("\nNo step makes more calls than the baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    # the conversation mixes message and callback handlers on purpose
+    warnings.filterwarnings('ignore', message="If 'per_message=False'")
+    parser = argparse.ArgumentParser(description="Replay admin sessions through the bot against the fake panel and Bot API.")
+    parser.add_argument('--sessions', nargs='+', choices=list(session_steps(argparse.Namespace(bulk_count=0))),
+                        default=['manage_user_qr', 'user_refresh', 'expiring_users', 'activity_report', 'bulk_create'])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--bulk-count', type=int, default=10, help="users created by the bulk_create session")
+    parser.add_argument('--latency', type=float, default=0, help="panel latency per request, ms")
+    parser.add_argument('--telegram-latency', type=float, default=0, help="Bot API latency per request, ms")
+    parser.add_argument('--chat-rate', type=float, default=1.0, help="fake Telegram: messages per second to one chat")
+    parser.add_argument('--global-rate', type=float, default=30, help="fake Telegram: messages per second overall")
+    parser.add_argument('--no-pause', action='store_true',
+                        help="keep per-chat flood control across steps instead of assuming the admin pauses between them")
+    parser.add_argument('--save-baseline', action='store_true')
+    sys.exit(asyncio.run(run(parser.parse_args())))
@@ -1,22 +1,35 @@
 # bot.py
 
-import logging, requests, json, subprocess, html, io, uuid, random, string, re, asyncio
+import time
+# (label, perf_counter) after each startup phase, reported by /startup
+startup_marks = [('start', time.perf_counter())]
+import logging, json, html, io, os, uuid, random, string, re, asyncio, contextlib, marshal, sys
+import httpx
+from collections import deque
 from itertools import zip_longest
 from urllib.parse import urlparse
 from datetime import datetime, timezone, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, InputMediaPhoto
 from telegram.ext import (
-    Application, CommandHandler, ConversationHandler,
+    Application, CommandHandler, ConversationHandler, TypeHandler,
     CallbackQueryHandler, MessageHandler, filters, ContextTypes
 )
 from telegram.constants import ParseMode
 from telegram.error import BadRequest, RetryAfter
-import qrcode
-import config
+startup_marks.append(('python-telegram-bot, httpx, stdlib', time.perf_counter()))
+from config_store import Config, RESTART_KEYS as CONFIG_RESTART_KEYS, bot_api_urls
+from docker_api import docker
+from send_file import SOCKET_PATH as IPC_SOCKET_PATH, send_document
+from hyperloglog import HyperLogLog, DEFAULT_PRECISION as HLL_PRECISION
+from metrics import metrics, InstrumentedRequest, start_metrics_server
+from loop_watchdog import LoopWatchdog
+from handler_timing import handler_timings
+from bulk_targets import BulkTarget, BulkTargets, INVALID_DATE, epoch_ms_to_datetime
 import re
-from base64 import b64encode
-from Crypto.PublicKey import RSA
-from Crypto.Cipher import PKCS1_v1_5
+from base64 import b64encode, b64decode
+startup_marks.append(('config, local modules', time.perf_counter()))
+# qrcode (with PIL), pycryptodome and requests are imported on first use
+DEFERRED_MODULES = ('qrcode', 'PIL', 'Crypto', 'requests')
 
 class HappCrypto:
     _v4_public_key = None
@@ -70,6 +83,8 @@ class HappCrypto:
 
     @classmethod
     def encrypt_link(cls, raw_url: str) -> str:
+        from Crypto.PublicKey import RSA
+        from Crypto.Cipher import PKCS1_v1_5
         pub_key_str = cls.get_public_key()
         key = RSA.import_key(pub_key_str)
         cipher = PKCS1_v1_5.new(key)
@@ -85,16 +100,46 @@ class HappCrypto:
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# config.json is watched and reloaded in place; config_manager.py also asks for a reload over the IPC socket
+config = Config()
+CONFIG_WATCH_INTERVAL = 5
+
+LOCALES_PATH = 'locales.json'
+LOCALES_CACHE_PATH = 'locales.cache'
+
+def load_locales() -> dict:
+    """
+    Loads locales.json through a marshal cache, which is rebuilt whenever the
+    modification time or size of locales.json changes.
+    """
+    stat = os.stat(LOCALES_PATH)
+    key = [stat.st_mtime_ns, stat.st_size]
+    try:
+        with open(LOCALES_CACHE_PATH, 'rb') as f:
+            cached_key, languages = marshal.load(f)
+        if cached_key == key:
+            return languages
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    with open(LOCALES_PATH, 'r', encoding='utf-8') as f:
+        languages = json.load(f)
+    with contextlib.suppress(OSError):
+        with open(LOCALES_CACHE_PATH + '.tmp', 'wb') as f:
+            marshal.dump([key, languages], f)
+        os.replace(LOCALES_CACHE_PATH + '.tmp', LOCALES_CACHE_PATH)
+    return languages
+
 try:
-    with open('locales.json', 'r', encoding='utf-8') as f:
-        LANGUAGES = json.load(f)
+    LANGUAGES = load_locales()
 except FileNotFoundError: logger.critical("locales.json not found!"); exit()
 except json.JSONDecodeError: logger.critical("locales.json is not a valid JSON file."); exit()
+startup_marks.append(('locales', time.perf_counter()))
 
 
 COMMANDS = {'en': [BotCommand("start", "Show Main Menu")], 'fa': [BotCommand("start", "نمایش منوی اصلی")], 'ru': [BotCommand("start", "Показать главное меню")]}
 
 # STATE CONSTANTS
+names_before_states = set(globals())
 (
     MAIN_MENU, SELECTING_LANGUAGE, AWAITING_USERNAME, USER_MENU, AWAITING_LIMIT,
     AWAITING_EXPIRE, NODE_LIST, VIEWING_LOGS, QR_VIEW, SELECT_NODE_RESTART,
@@ -110,6 +155,10 @@ COMMANDS = {'en': [BotCommand("start", "Show Main Menu")], 'fa': [BotCommand("st
     SELECTING_BULK_HWID_OPTION, AWAITING_BULK_HWID_VALUE_STEP, SELECTING_BULK_BANNER,
     SELECT_EXT_SQUAD_FOR_EDIT, SELECT_ACTION_FOR_EXT_SQUAD, CONFIRM_EXT_SQUAD_ACTION, SELECT_USER_SQUADS_EDIT
 ) = range(44)
+# state value -> name for the /handlers report: exactly the names the tuple above bound
+STATE_NAMES = {globals()[name]: name for name in globals().keys() - names_before_states - {'names_before_states'}}
+assert len(STATE_NAMES) == 44, "a state name was already defined before the state tuple"
+del names_before_states
 
 
 def get_settings() -> dict:
@@ -180,6 +229,25 @@ def parse_iso_date(date_string: str | None):
     try: return datetime.fromisoformat(date_string.replace('Z', '+00:00'))
     except (ValueError, TypeError): return None
 
+MESSAGE_TEXT_LIMIT = 4000
+
+def join_lines_within(lines: list, tail: list = (), limit: int = MESSAGE_TEXT_LIMIT) -> str:
+    """
+    Joins lines, dropping whole lines from the end (before `tail`, which is always
+    kept) until the text fits in a message. A fixed cut could split an HTML tag or
+    entity, and Telegram then rejects the whole message.
+    """
+    tail = list(tail)
+    text = "\n".join(list(lines) + tail)
+    if len(text) <= limit: return text
+    budget = limit - len("\n".join(tail)) - len("\n...") - 1
+    kept, size = [], 0
+    for line in lines:
+        size += len(line) + 1
+        if size > budget: break
+        kept.append(line)
+    return "\n".join(kept + ["..."] + tail)
+
 def human_readable_timediff(dt: datetime, context: ContextTypes.DEFAULT_TYPE):
     if not dt: return t('not_updated_yet', context)
     now = datetime.now(timezone.utc); diff = now - dt; seconds = diff.total_seconds()
@@ -192,9 +260,12 @@ def human_readable_timediff(dt: datetime, context: ContextTypes.DEFAULT_TYPE):
     return t('days_ago', context, days=days)
 
 def api_request(method: str, endpoint: str, payload: dict = None, params: dict = None):
+    import requests
     url = f"{config.PANEL_URL}{endpoint}"; headers = {'Authorization': f'Bearer {config.PANEL_API_TOKEN}', 'Accept': 'application/json', 'Content-Type': 'application/json'}
+    started, status, response = time.perf_counter(), 'error', None
     try:
         response = requests.request(method.upper(), url, headers=headers, json=payload, params=params, timeout=15)
+        status = response.status_code
         response.raise_for_status()
         return response.json() if response.status_code != 204 else {}, None
     except requests.exceptions.HTTPError as errh:
@@ -207,13 +278,20 @@ def api_request(method: str, endpoint: str, payload: dict = None, params: dict =
         if errh.response.status_code == 404: return None, "Endpoint or User not found"
         logger.error(f"Http Error: {errh} - Response: {error_details}"); return None, f"HTTP Error {errh.response.status_code}: {error_details}"
     except Exception as e:
+        if response is None: status = type(e).__name__
         logger.error(f"An unexpected error occurred: {e}"); return None, "Unknown error"
+    finally:
+        metrics.record_panel(method, endpoint, time.perf_counter() - started, status,
+                             len(response.request.body or b'') if response is not None else 0,
+                             len(response.content) if response is not None else 0)
 
-async def api_request_get_all_users():
+async def api_request_get_all_users(project=None, all_users=None):
     """
     Fetches all users from the API by handling pagination using 'size' and 'start' parameters.
+    project, if given, is applied to each user as its page arrives, so only one page of full
+    user dicts is alive at a time; the results are appended to all_users (a new list by default).
     """
-    all_users = []
+    all_users = [] if all_users is None else all_users
     start = 0
     size = 100
     
@@ -231,7 +309,7 @@ async def api_request_get_all_users():
         if not users_on_page:
             break
             
-        all_users.extend(users_on_page)
+        all_users.extend(map(project, users_on_page) if project else users_on_page)
         
         if len(users_on_page) < size:
             break
@@ -247,6 +325,37 @@ async def api_request_get_sub_history(start=0, size=100):
     data, error = await asyncio.to_thread(api_request, 'GET', '/api/subscription-request-history', params=params)
     return data, error
 
+async def iter_sub_history_pages(size=100, prefetch=2):
+    """
+    Yields subscription history pages (newest first) while keeping up to `prefetch`
+    further pages in flight, so parsing one page overlaps with fetching the next.
+    Speculative fetches still pending when the consumer stops are cancelled;
+    use it with contextlib.aclosing() so that happens on an early break too.
+    """
+    start = 0
+    in_flight = deque()
+    try:
+        while True:
+            while len(in_flight) <= prefetch:
+                in_flight.append(asyncio.create_task(api_request_get_sub_history(start=start, size=size)))
+                start += size
+
+            data, error = await in_flight.popleft()
+            if error or not data or 'response' not in data:
+                break
+
+            records = data['response'].get('records', [])
+            if not records:
+                break
+
+            yield records
+
+            if len(records) < size:
+                break
+    finally:
+        for task in in_flight:
+            task.cancel()
+
 async def get_user_latest_sub_history(user_id: str):
     """
     پیدا کردن آخرین لاگ آپدیت برای یک کاربر خاص.
@@ -272,6 +381,7 @@ async def get_user_latest_sub_history(user_id: str):
 
 def generate_qr_code(data: str):
     if not data: return None
+    import qrcode
     qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)
     qr.add_data(data); qr.make(fit=True)
     img = qr.make_image(fill_color="black", back_color="white"); buf = io.BytesIO()
@@ -335,31 +445,582 @@ def build_user_info_message(user_data: dict, context: ContextTypes.DEFAULT_TYPE)
             f"{t('subscription_link', context)}\n"
             f"<code>{safe_sub_url}</code>")
 
-def get_logs_from_node(node_name: str):
+XRAY_LOG_PATH = "/var/log/supervisor/xray.out.log"
+
+# Live follow mode for node logs
+LOG_WINDOW_LINES = 30
+LOG_FOLLOW_CHUNK_BYTES = 64 * 1024
+LOG_FOLLOW_POLL_INTERVAL = 3
+LOG_FOLLOW_MIN_EDIT_INTERVAL = 2
+LOG_FOLLOW_MAX_DURATION = 600
+LOG_STREAM_READ_TIMEOUT = 45
+LOG_STREAM_RECONNECT_MAX = 30
+LOG_STREAM_LISTENER_SIZE = 500
+NODE_STATUS_TIMEOUT = 8
+NODE_RESTART_TIMEOUT = 90
+NODE_HEALTH_CHECK_TIMEOUT = 60
+NODE_HEALTH_CHECK_INTERVAL = 3
+ROLLING_RESTART_DEFAULT_PARALLELISM = 2
+ROLLING_RESTART_MIN_EDIT_INTERVAL = 2
+NODE_STATS_TOP = 10
+SHARING_IP_THRESHOLD = 5
+SHARING_REPORT_LIMIT = 30
+LOG_SEARCH_PAGE_SIZE = 15
+
+# Prints "<size> <start>" and then the bytes of the file between <start> and <size>.
+# If the file shrank (rotation/truncation) it restarts from the beginning, and if
+# too much was written since the cursor it skips ahead to the last chunk.
+LOG_DELTA_SCRIPT = (
+    'f="$0"; start="$1"; size=$(wc -c < "$f") || exit 1; '
+    '[ "$start" -gt "$size" ] && start=0; '
+    '[ $((size - start)) -gt "$2" ] && start=$((size - $2)); '
+    'echo "$size $start"; tail -c +$((start + 1)) "$f" | head -c $((size - start))'
+)
+
+def parse_log_delta(output: bytes, cursor: int):
+    """
+    Parses the output of LOG_DELTA_SCRIPT. Returns (text, new_cursor, reset) where
+    `reset` means the text does not continue from `cursor` and replaces the window.
+    The cursor only advances to the end of the last complete line.
+    """
+    header, _, chunk = output.partition(b"\n")
+    size, start = (int(v) for v in header.split())
+    reset = start != cursor
+
+    end = chunk.rfind(b"\n") + 1
+    if end == 0 and len(chunk) < LOG_FOLLOW_CHUNK_BYTES:
+        return "", start, reset
+    if end == 0:
+        end = len(chunk)
+    data = chunk[:end]
+    if reset and start > 0:
+        # ابتدای این بخش احتمالاً وسط یک خط است
+        data = data.partition(b"\n")[2]
+    return data.decode('utf-8', errors='replace'), start + end, reset
+
+async def exec_in_node_container(command: list) -> bytes:
+    """Runs a command in the local remnanode container through the Docker API and returns its stdout."""
+    exit_code, stdout, stderr = await docker.exec_run("remnanode", command)
+    if exit_code != 0:
+        raise RuntimeError(stderr.decode('utf-8', errors='replace').strip() or f"exit code {exit_code}")
+    return stdout
+
+async def get_log_delta_from_node(node_name: str, cursor: int):
+    """Returns (text, new_cursor, reset, error) with only the log lines written after `cursor`."""
+    node_config = config.NODES.get(node_name)
+    if not node_config: return None, cursor, False, "Node not found in config."
+    if node_config['type'] == 'local':
+        command = ["sh", "-c", LOG_DELTA_SCRIPT, XRAY_LOG_PATH, str(cursor), str(LOG_FOLLOW_CHUNK_BYTES)]
+        try:
+            output = await exec_in_node_container(command)
+            text, new_cursor, reset = parse_log_delta(output, cursor)
+            return text, new_cursor, reset, None
+        except Exception as e: return None, cursor, False, str(e) or type(e).__name__
+    elif node_config['type'] == 'remote':
+        try:
+            import requests
+            headers = {'Authorization': f"Bearer {node_config['token']}"}
+            response = await asyncio.to_thread(requests.get, node_config['url'], headers=headers, params={'since': cursor}, timeout=10)
+            response.raise_for_status()
+            data = response.json()
+            if 'cursor' not in data:
+                # نود قدیمی از since پشتیبانی نمی‌کند؛ کل پنجره جایگزین می‌شود
+                return data.get('logs') or "", cursor, True, None
+            return data.get('logs') or "", data['cursor'], bool(data.get('reset')), None
+        except Exception as e: return None, cursor, False, str(e)
+    return None, cursor, False, "Invalid node type in config."
+
+async def get_logs_from_node(node_name: str):
     node_config = config.NODES.get(node_name)
     if not node_config: return None, "Node not found in config."
     if node_config['type'] == 'local':
-        command = ["docker", "exec", "remnanode", "tail", "-n30", "/var/log/supervisor/xray.out.log"]
         try:
-            result = subprocess.run(command, capture_output=True, text=True, check=True, encoding='utf-8')
-            return result.stdout.strip(), None
-        except Exception as e: return None, str(e)
+            output = await exec_in_node_container(["tail", f"-n{LOG_WINDOW_LINES}", XRAY_LOG_PATH])
+            return output.decode('utf-8', errors='replace').strip(), None
+        except Exception as e: return None, str(e) or type(e).__name__
     elif node_config['type'] == 'remote':
         try:
+            import requests
             headers = {'Authorization': f"Bearer {node_config['token']}"}
-            response = requests.get(node_config['url'], headers=headers, timeout=10)
+            response = await asyncio.to_thread(requests.get, node_config['url'], headers=headers, timeout=10)
             response.raise_for_status()
             return response.json().get('logs'), None
         except Exception as e: return None, str(e)
     return None, "Invalid node type in config."
 
+def node_agent_url(node_config: dict, path: str) -> str:
+    """Builds the URL of another endpoint of a remote node agent from its configured /logs URL."""
+    return urlparse(node_config.get('url', ''))._replace(path=path, query='').geturl()
+
+class NodeStreamListener:
+    """Events of a NodeEventStream for one consumer, bounded so a slow consumer only loses old lines."""
+
+    def __init__(self, maxlen: int = LOG_STREAM_LISTENER_SIZE):
+        self.events = deque()
+        self.maxlen = maxlen
+        self.wakeup = asyncio.Event()
+
+    def push(self, event: tuple):
+        if len(self.events) >= self.maxlen:
+            self.events.popleft()
+        self.events.append(event)
+        self.wakeup.set()
+
+    def drain(self) -> list:
+        events = list(self.events)
+        self.events.clear()
+        self.wakeup.clear()
+        return events
+
+class NodeEventStream:
+    """
+    Keeps one server-sent events connection to a remote node agent's /events
+    endpoint while at least one listener is attached. Reconnects with backoff
+    and resumes from the last received line id, so no lines are missed.
+    Listeners receive (kind, payload) tuples: 'log' (list of lines), 'reset',
+    'dropped' (number of lines the agent skipped because this connection read
+    too slowly), 'status' (agent follower state), 'connected', 'error' and 'unsupported'.
+    """
+
+    def __init__(self, node_name: str):
+        self.node_name = node_name
+        self.listeners = set()
+        self.window = deque(maxlen=LOG_WINDOW_LINES)
+        self.cursor = 0
+        self.task = None
+
+    def subscribe(self) -> NodeStreamListener:
+        listener = NodeStreamListener()
+        if self.window:
+            listener.push(('reset', None))
+            listener.push(('log', list(self.window)))
+        self.listeners.add(listener)
+        if not self.task or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        return listener
+
+    def unsubscribe(self, listener: NodeStreamListener):
+        self.listeners.discard(listener)
+        if not self.listeners:
+            if self.task: self.task.cancel()
+            node_streams.pop(self.node_name, None)
+
+    def dispatch(self, kind: str, payload=None):
+        if kind == 'reset': self.window.clear()
+        elif kind == 'log': self.window.extend(payload)
+        for listener in self.listeners:
+            listener.push((kind, payload))
+
+    async def run(self):
+        delay = 1
+        while self.listeners:
+            node_config = config.NODES.get(self.node_name)
+            if not node_config or node_config.get('type') != 'remote':
+                self.dispatch('error', "Node not found in config.")
+                return
+            headers = {'Authorization': f"Bearer {node_config['token']}"}
+            params = {'since': self.cursor, 'limit': LOG_WINDOW_LINES}
+            try:
+                timeout = httpx.Timeout(10, read=LOG_STREAM_READ_TIMEOUT)
+                async with httpx.AsyncClient(timeout=timeout) as client:
+                    async with client.stream('GET', node_agent_url(node_config, '/events'), headers=headers, params=params) as response:
+                        if response.status_code == 404:
+                            self.dispatch('unsupported')
+                            return
+                        response.raise_for_status()
+                        delay = 1
+                        self.dispatch('connected')
+                        await self.consume(response)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.dispatch('error', str(e) or type(e).__name__)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LOG_STREAM_RECONNECT_MAX)
+
+    async def consume(self, response: httpx.Response):
+        event, data, event_id = None, [], None
+        async for line in response.aiter_lines():
+            if line.startswith(':'):
+                continue
+            if line:
+                field, _, value = line.partition(':')
+                if value.startswith(' '): value = value[1:]
+                if field == 'event': event = value
+                elif field == 'data': data.append(value)
+                elif field == 'id': event_id = value
+                continue
+
+            if event == 'log':
+                if event_id: self.cursor = int(event_id)
+                self.dispatch('log', data)
+            elif event == 'reset':
+                self.dispatch('reset')
+            elif event == 'dropped':
+                self.dispatch('dropped', int(data[0]) if data and data[0].isdigit() else 0)
+            elif event == 'status':
+                self.dispatch('status', json.loads("\n".join(data)))
+            event, data, event_id = None, [], None
+
+node_streams = {}
+
+def subscribe_node_stream(node_name: str):
+    stream = node_streams.get(node_name)
+    if not stream:
+        stream = node_streams[node_name] = NodeEventStream(node_name)
+    return stream, stream.subscribe()
+
+async def wait_for_any(events: list, timeout: float):
+    waiters = [asyncio.create_task(event.wait()) for event in events]
+    try:
+        await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for waiter in waiters: waiter.cancel()
+
+async def probe_node_status(node_name: str, client: httpx.AsyncClient) -> dict:
+    """Checks one node: reachability, round-trip latency, container state and last log line."""
+    status = {'name': node_name, 'reachable': False, 'latency_ms': None, 'container': None, 'last_line': None, 'error': None}
+    node_config = config.NODES.get(node_name) or {}
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        if node_config.get('type') == 'local':
+            status['container'] = await docker.container_state("remnanode")
+            status['latency_ms'] = int((loop.time() - started) * 1000)
+            status['reachable'] = True
+            if status['container'] == 'running':
+                with contextlib.suppress(Exception):
+                    output = await exec_in_node_container(["tail", "-n1", XRAY_LOG_PATH])
+                    status['last_line'] = output.decode('utf-8', errors='replace').strip() or None
+        elif node_config.get('type') == 'remote':
+            headers = {'Authorization': f"Bearer {node_config['token']}"}
+            response = await client.get(node_agent_url(node_config, '/status'), headers=headers)
+            status['latency_ms'] = int((loop.time() - started) * 1000)
+            if response.status_code == 404:
+                # نود قدیمی؛ فقط آخرین خط لاگ قابل دریافت است
+                response = await client.get(node_config['url'], headers=headers, params={'limit': 1})
+                response.raise_for_status()
+                status['last_line'] = (response.json().get('logs') or "").splitlines()[-1:] or None
+                status['last_line'] = status['last_line'][0] if status['last_line'] else None
+            else:
+                response.raise_for_status()
+                data = response.json()
+                status['container'] = data.get('container')
+                status['last_line'] = data.get('last_line')
+            status['reachable'] = True
+        else:
+            status['error'] = "Invalid node type in config."
+    except Exception as e:
+        status['error'] = str(e) or type(e).__name__
+    return status
+
+async def collect_nodes_status() -> list:
+    """Queries every configured node concurrently, each with its own timeout."""
+    async with httpx.AsyncClient(timeout=NODE_STATUS_TIMEOUT) as client:
+        async def probe(node_name):
+            try:
+                return await asyncio.wait_for(probe_node_status(node_name, client), timeout=NODE_STATUS_TIMEOUT)
+            except asyncio.TimeoutError:
+                return {'name': node_name, 'reachable': False, 'latency_ms': None, 'container': None, 'last_line': None, 'error': "Timeout"}
+        return await asyncio.gather(*(probe(node_name) for node_name in config.NODES.keys()))
+
+class FileSendQueue:
+    """
+    Uploads files to the admin one at a time over the bot's own connection.
+    Local tools (backup.py, send_file.py) submit them through the IPC socket, so
+    they need neither their own Bot nor a new TLS connection per upload.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self.run())
+
+    async def submit(self, path: str, caption: str) -> dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.queue.put_nowait((path, caption, future, loop.time()))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            path, caption, future, queued_at = await self.queue.get()
+            started = loop.time()
+            try:
+                document = await send_document(self.bot, config.ADMIN_USER_ID, path, caption)
+                result = {'ok': True, 'file_id': document.file_id, 'file_size': document.file_size,
+                          'queued_seconds': round(started - queued_at, 2), 'upload_seconds': round(loop.time() - started, 2)}
+            except Exception as e:
+                logger.error(f"Sending {path} failed: {e}")
+                result = {'ok': False, 'error': str(e) or type(e).__name__}
+            if not future.done():
+                future.set_result(result)
+
+file_send_queue = None
+ipc_server = None
+config_watcher = None
+metrics_server = None
+loop_watchdog = None
+profile_session = None  # the /profile run in progress, see profile_handler
+PROFILE_MAX_SECONDS = 600
+PROFILE_MAX_UPDATES = 1000
+PROFILE_UPDATE_GROUP = 99  # after every other handler, so an update is counted once it has been handled
+
+async def handle_ipc_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """One JSON request per connection: {"action": "send_file", "path", "caption"}, answered with one JSON line."""
+    try:
+        try:
+            request = json.loads(await reader.readline())
+            path = request.get('path') or ''
+            if request.get('action') == 'reload_config':
+                reply = {'ok': True, 'changed': reload_config(force=True)}
+            elif request.get('action') != 'send_file':
+                reply = {'ok': False, 'error': f"Unknown action: {request.get('action')}"}
+            elif not os.path.isfile(path):
+                reply = {'ok': False, 'error': f"File not found: {path}"}
+            else:
+                reply = await file_send_queue.submit(path, request.get('caption') or None)
+        except ConfigError as e:
+            reply = {'ok': False, 'error': f"Invalid config.json: {e}"}
+        except (ValueError, AttributeError):
+            reply = {'ok': False, 'error': "Invalid request"}
+        except Exception as e:
+            logger.exception("IPC request failed")
+            reply = {'ok': False, 'error': f"Internal error: {e}"}
+        writer.write(json.dumps(reply).encode() + b"\n")
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+class ConfigError(Exception):
+    pass
+
+def reload_config(force: bool = False) -> list:
+    """Applies config.json if it changed; the old configuration stays in use if the new one is invalid."""
+    old_nodes = config.NODES
+    try:
+        changed = config.reload(force)
+    except (OSError, ValueError) as e:
+        raise ConfigError(str(e)) from e
+    if changed:
+        logger.info(f"Configuration reloaded: {', '.join(changed)} changed.")
+        for key in changed:
+            if key in CONFIG_RESTART_KEYS:
+                logger.warning(f"{key} changed; restart the bot to apply it.")
+        for node_name, stream in list(node_streams.items()):
+            if config.NODES.get(node_name) != old_nodes.get(node_name) and stream.task:
+                # نود حذف یا آدرس/توکن آن عوض شده؛ اتصال با تنظیمات جدید از نو برقرار می‌شود
+                stream.task.cancel()
+                stream.task = asyncio.create_task(stream.run())
+    return changed
+
+async def watch_config():
+    while True:
+        await asyncio.sleep(CONFIG_WATCH_INTERVAL)
+        try:
+            reload_config()
+        except ConfigError as e:
+            logger.error(f"Ignoring invalid config.json: {e}")
+        except Exception:
+            logger.exception("Config reload failed")  # keep watching; the next change gets another try
+
+async def start_ipc_server(application: Application):
+    global file_send_queue, ipc_server
+    file_send_queue = FileSendQueue(application.bot)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(IPC_SOCKET_PATH)  # سوکت باقی‌مانده از اجرای قبلی
+    try:
+        ipc_server = await asyncio.start_unix_server(handle_ipc_client, path=IPC_SOCKET_PATH)
+        os.chmod(IPC_SOCKET_PATH, 0o600)
+    except OSError as e:
+        logger.error(f"Could not listen on {IPC_SOCKET_PATH}: {e}")
+
 async def post_init(application: Application):
+    global config_watcher, metrics_server, loop_watchdog
     lang = get_lang_from_file()
     await application.bot.set_my_commands(COMMANDS.get(lang, COMMANDS['en']))
+    await start_ipc_server(application)
+    config_watcher = asyncio.create_task(watch_config())
+    loop_watchdog = LoopWatchdog()
+    loop_watchdog.start()
+    if config.METRICS_PORT:
+        try:
+            metrics_server = await start_metrics_server(config.METRICS_PORT)
+            logger.info(f"Prometheus metrics on http://127.0.0.1:{config.METRICS_PORT}/metrics")
+        except OSError as e:
+            logger.error(f"Could not start the metrics endpoint on port {config.METRICS_PORT}: {e}")
+    startup_marks.append(('post_init (commands, IPC socket)', time.perf_counter()))
+
+first_update_at = None
+
+async def record_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    global first_update_at
+    if first_update_at is None:
+        first_update_at = time.perf_counter()
+
+def process_age() -> float | None:
+    """Seconds since this process was started, read from /proc (None where it is not available)."""
+    try:
+        with open('/proc/self/stat') as f:
+            fields = f.read().rpartition(')')[2].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def build_startup_report() -> str:
+    now = time.perf_counter()
+    started = startup_marks[0][1]
+    lines = []
+    age = process_age()
+    if age is not None:
+        # زمان بالا آمدن مفسر پایتون، قبل از اجرای اولین خط bot.py
+        lines.append(f"{'interpreter':<34}{max(age - (now - started), 0) * 1000:>8.0f} ms")
+    previous = started
+    for label, at in startup_marks[1:]:
+        lines.append(f"{label:<34}{(at - previous) * 1000:>8.0f} ms")
+        previous = at
+    lines.append(f"{'ready after':<34}{(previous - started) * 1000:>8.0f} ms")
+    if first_update_at is not None:
+        lines.append(f"{'first update after':<34}{(first_update_at - started) * 1000:>8.0f} ms")
+    loaded = ", ".join(f"{name} {'✓' if name in sys.modules else '–'}" for name in DEFERRED_MODULES)
+    lines.append(f"deferred imports: {loaded}")
+    return "\n".join(lines)
+
+async def startup_report_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update): return
+    text = f"<b>{t('startup_report_title', context)}</b>\n<pre>{html.escape(build_startup_report())}</pre>"
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+
+def pre_report(title: str, report: str) -> str:
+    """Bold title and the report in <pre>, trimmed by whole lines so the closing tag is never cut off."""
+    lines = [html.escape(line) for line in report.split("\n")]
+    return f"<b>{title}</b>\n<pre>{join_lines_within(lines, limit=4096 - len(title) - 20)}</pre>"
+
+async def api_stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats shows panel and Bot API call timings; /stats reset clears them."""
+    if not is_admin(update): return
+    if context.args and context.args[0] == 'reset':
+        metrics.reset()
+        await update.message.reply_text(t('api_stats_reset', context))
+        return
+    await update.message.reply_text(pre_report(t('api_stats_title', context), metrics.render_text()), parse_mode=ParseMode.HTML)
+
+async def lag_report_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/lag shows event loop lag and the stacks that blocked the loop longest; /lag reset clears them."""
+    if not is_admin(update) or loop_watchdog is None: return
+    if context.args and context.args[0] == 'reset':
+        loop_watchdog.reset()
+        await update.message.reply_text(t('lag_report_reset', context))
+        return
+    await update.message.reply_text(pre_report(t('lag_report_title', context), loop_watchdog.report()), parse_mode=ParseMode.HTML)
+
+async def handler_timings_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/handlers shows where each state and callback pattern spends its time; /handlers reset clears it."""
+    if not is_admin(update): return
+    if context.args and context.args[0] == 'reset':
+        handler_timings.reset()
+        await update.message.reply_text(t('handler_timings_reset', context))
+        return
+    await update.message.reply_text(pre_report(t('handler_timings_title', context), handler_timings.report()), parse_mode=ParseMode.HTML)
+
+async def profile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /profile 30 samples every thread for 30 seconds, /profile 50u for the next 50
+    updates; 'mem' also traces allocations. The sampler thread exists only while
+    a profile is being taken.
+    """
+    global profile_session
+    if not is_admin(update): return
+    args = [arg.lower() for arg in context.args or []]
+    if args[:1] == ['stop']:
+        if profile_session: await finish_profile(context.bot)
+        else: await update.message.reply_text(t('profile_not_running', context))
+        return
+    if profile_session:
+        await update.message.reply_text(t('profile_already_running', context))
+        return
+    spec = next((arg for arg in args if arg != 'mem'), '30')
+    try:
+        updates = min(int(spec[:-1]), PROFILE_MAX_UPDATES) if spec.endswith('u') else 0
+        seconds = 0 if updates else min(int(spec.rstrip('s')), PROFILE_MAX_SECONDS)
+    except ValueError:
+        updates = seconds = 0
+    if updates <= 0 and seconds <= 0:
+        await update.message.reply_text(t('profile_usage', context))
+        return
+
+    from profiler import SamplingProfiler
+    profiler = SamplingProfiler(memory='mem' in args)
+    profiler.start()
+    profile_session = {'profiler': profiler, 'chat_id': update.effective_chat.id, 'update_id': update.update_id,
+                       'updates_left': updates, 'timer': None}
+    # the update limit also ends after PROFILE_MAX_SECONDS, in case the updates never come
+    profile_session['timer'] = asyncio.create_task(stop_profile_later(context.bot, seconds or PROFILE_MAX_SECONDS))
+    what = (f"{updates}u" if updates else f"{seconds}s") + (" + tracemalloc" if profiler.memory else "")
+    await update.message.reply_text(t('profile_started', context, what=what))
+
+async def count_profiled_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    session = profile_session
+    if session is None or not session['updates_left'] or update.update_id == session['update_id']:
+        return
+    session['updates_left'] -= 1
+    if session['updates_left'] == 0:
+        await finish_profile(context.bot)
+
+async def stop_profile_later(bot, seconds: int):
+    await asyncio.sleep(seconds)
+    await finish_profile(bot)
+
+async def finish_profile(bot):
+    """Stops the running profile and sends its collapsed stacks, summary and allocations to the admin."""
+    global profile_session
+    session, profile_session = profile_session, None
+    if session is None: return
+    if session['timer'] is not asyncio.current_task():
+        session['timer'].cancel()
+    profiler = session['profiler']
+    await asyncio.to_thread(profiler.stop)
+    lang = get_lang_from_file()
+    texts = LANGUAGES.get(lang, LANGUAGES['en'])
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    try:
+        title = texts.get('profile_done_caption')
+        summary = [html.escape(line) for line in profiler.summary().split("\n")]
+        caption = f"{title}\n<pre>{join_lines_within(summary, limit=1024 - len(title) - 20)}</pre>"  # captions stop at 1024
+        await bot.send_document(chat_id=session['chat_id'], document=(profiler.collapsed() or "(no busy samples)\n").encode(),
+                                filename=f"profile-{stamp}.collapsed.txt", caption=caption, parse_mode=ParseMode.HTML)
+        if profiler.memory:
+            await bot.send_document(chat_id=session['chat_id'], document=profiler.top_allocations().encode(),
+                                    filename=f"allocations-{stamp}.txt")
+    except Exception as e:
+        logger.error(f"Could not send the profile: {e}")
+
+async def post_shutdown(application: Application):
+    if ipc_server:
+        ipc_server.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(IPC_SOCKET_PATH)
+    if file_send_queue:
+        file_send_queue.task.cancel()
+    if config_watcher:
+        config_watcher.cancel()
+    if metrics_server:
+        metrics_server.close()
+    if loop_watchdog:
+        loop_watchdog.stop()
+    if profile_session:
+        profile_session['profiler'].stop()
+    await docker.close()
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if not is_admin(update): return ConversationHandler.END
     
+    stop_log_follow(context)
     context.user_data.clear()
     get_lang(context)
     
@@ -402,8 +1063,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 
 async def show_node_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    stop_log_follow(context)
     buttons = [InlineKeyboardButton(node_name, callback_data=f"lognode_{node_name}") for node_name in config.NODES.keys()]
     keyboard = [[b] for b in buttons] if len(buttons) > 1 else [buttons]
+    if buttons:
+        keyboard.append([InlineKeyboardButton(t('nodes_status_btn', context), callback_data='nodes_status')])
+        keyboard.append([InlineKeyboardButton(t('shared_accounts_btn', context), callback_data=f'sharing_{SHARING_IP_THRESHOLD}_24')])
     keyboard.append([InlineKeyboardButton(t('back_to_main_menu_btn', context), callback_data='back_to_main')])
     reply_markup = InlineKeyboardMarkup(keyboard)
     message_text = t('select_node_prompt', context)
@@ -412,6 +1077,36 @@ async def show_node_list(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.message.edit_text(text=message_text, reply_markup=reply_markup)
     return NODE_LIST
 
+async def nodes_status_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query; await query.answer()
+    await query.message.edit_text(t('fetching_nodes_status', context))
+
+    results = await collect_nodes_status()
+
+    lines = [t('nodes_status_title', context, time=datetime.now().strftime('%H:%M:%S')), ""]
+    for status in results:
+        name = html.escape(status['name'])
+        if not status['reachable']:
+            lines.append(f"🔴 <b>{name}</b> — {html.escape(status['error'] or t('unknown', context))}")
+            continue
+        container = status['container'] or t('unknown', context)
+        icon = "🟢" if status['container'] in ('running', None) else "🟠"
+        lines.append(f"{icon} <b>{name}</b> — {status['latency_ms']} ms — {html.escape(container)}")
+        if status['last_line']:
+            last_line = status['last_line'] if len(status['last_line']) <= 120 else status['last_line'][:117] + "..."
+            lines.append(f"   └ <code>{html.escape(last_line)}</code>")
+
+    keyboard = [
+        [InlineKeyboardButton(t('refresh_btn', context), callback_data='nodes_status')],
+        [InlineKeyboardButton(t('back_to_nodes_btn', context), callback_data='go_view_logs')]
+    ]
+    message_text = join_lines_within(lines)
+    try:
+        await query.message.edit_text(message_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    except BadRequest as e:
+        if "Message is not modified" not in str(e): raise
+    return VIEWING_LOGS
+
 def get_creation_date(user: dict):
     created_at_str = user.get('createdAt')
     if not created_at_str or not isinstance(created_at_str, str):
@@ -501,7 +1196,9 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return await show_node_list(update, context)
     if action == 'go_restart_nodes':
         buttons = [InlineKeyboardButton(node_name, callback_data=f"restartnode_{node_name}") for node_name in config.NODES.keys()]
-        keyboard = [[b] for b in buttons] if len(buttons) > 1 else [buttons]; keyboard.append([InlineKeyboardButton(t('back_to_main_menu_btn', context), callback_data='back_to_main')])
+        keyboard = [[b] for b in buttons] if len(buttons) > 1 else [buttons]
+        if len(buttons) > 1: keyboard.append([InlineKeyboardButton(t('rolling_restart_btn', context), callback_data='rrmenu')])
+        keyboard.append([InlineKeyboardButton(t('back_to_main_menu_btn', context), callback_data='back_to_main')])
         await query.message.edit_text(t('select_node_restart_prompt', context), reply_markup=InlineKeyboardMarkup(keyboard)); return SELECT_NODE_RESTART
     if action == 'go_change_language':
         keyboard = [[InlineKeyboardButton("English 🇬🇧", callback_data='set_lang_en'), InlineKeyboardButton("Русский 🇷🇺", callback_data='set_lang_ru'), InlineKeyboardButton("فارسی 🇮🇷", callback_data='set_lang_fa')], [InlineKeyboardButton(t('back_to_main_menu_btn', context), callback_data='back_to_main')]]
@@ -594,9 +1291,17 @@ async def show_bulk_confirmation(update: Update, context: ContextTypes.DEFAULT_T
     
     await context.bot.edit_message_text(chat_id=chat_id, message_id=prompt_message_id, text=t('fetching_all_users', context))
 
-    users_data, error = await api_request_get_all_users()
+    previous = context.user_data.pop('bulk_users_list', None)
+    if previous: previous.close()
+    targets = BulkTargets()
+    try:
+        users_data, error = await api_request_get_all_users(project=BulkTarget.from_panel, all_users=targets)
+    except BaseException:
+        targets.close()
+        raise
 
     if error or 'response' not in users_data or 'users' not in users_data['response']:
+        targets.close()  # a fetch that failed part-way may already have spilled to disk
         await context.bot.edit_message_text(chat_id=chat_id, message_id=prompt_message_id, text=t('error_fetching_all_users', context, error=error))
         return ConversationHandler.END
         
@@ -672,14 +1377,19 @@ async def process_bulk_change_value(update: Update, context: ContextTypes.DEFAUL
 
 async def confirm_bulk_action_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
+    # the job owns the targets from here on; a second tap finds them gone
+    targets = context.user_data.pop('bulk_users_list', None)
+    if targets is None:
+        await query.answer(t('bulk_update_already_started', context))
+        return ConversationHandler.END
     await query.answer()
     
     if query.data == 'cancel_bulk_action':
+        targets.close()
         await query.message.edit_text(t('bulk_update_cancelled', context))
         return await start(query, context)
 
-    user_count = len(context.user_data.get('bulk_users_list', []))
-    await query.message.edit_text(t('bulk_update_started', context, user_count=user_count), parse_mode=ParseMode.HTML)
+    await query.message.edit_text(t('bulk_update_started', context, user_count=len(targets)), parse_mode=ParseMode.HTML)
     
     background_task_data = {
         'bot': context.bot,
@@ -687,7 +1397,7 @@ async def confirm_bulk_action_handler(update: Update, context: ContextTypes.DEFA
         'message_id_to_delete': query.message.message_id,
         'lang': get_lang(context),
         'languages_dict': LANGUAGES,
-        'bulk_users_list': context.user_data['bulk_users_list'],
+        'bulk_users_list': targets,
         'bulk_edit_type': context.user_data['bulk_edit_type'],
         'bulk_change_value': context.user_data['bulk_change_value']
     }
@@ -717,8 +1427,8 @@ async def run_bulk_update_background(task_data: dict):
         skipped_count = 0
         
         for user in users:
-            user_id = user.get('id')
-            username = user.get('username', 'N/A')
+            user_id = user.id
+            username = user.username
             
             if not user_id:
                 failed_count += 1
@@ -728,7 +1438,7 @@ async def run_bulk_update_background(task_data: dict):
             should_update = False
             
             if edit_type == 'volume':
-                current_limit = user.get('trafficLimitBytes')
+                current_limit = user.traffic_limit
                 if current_limit is None or current_limit == 0:
                     skipped_count += 1
                     continue
@@ -739,16 +1449,14 @@ async def run_bulk_update_background(task_data: dict):
                 should_update = True
             
             elif edit_type == 'date':
-                current_expire_str = user.get('expireAt')
-                if not current_expire_str:
+                if user.expire is None:
                     skipped_count += 1
                     continue
-
-                current_expire_dt = parse_iso_date(current_expire_str)
-                if not current_expire_dt:
+                if user.expire == INVALID_DATE:
                     failed_count += 1
                     continue
-                
+
+                current_expire_dt = epoch_ms_to_datetime(user.expire)
                 new_expire_dt = current_expire_dt + timedelta(days=int(change_value))
                 payload['expireAt'] = new_expire_dt.isoformat().replace('+00:00', 'Z')
                 should_update = True
@@ -792,6 +1500,7 @@ async def run_bulk_update_background(task_data: dict):
         await bot.send_message(chat_id=chat_id, text=error_message, parse_mode=ParseMode.MARKDOWN)
     
     finally:
+        task_data['bulk_users_list'].close()
         try:
             await bot.delete_message(chat_id=chat_id, message_id=task_data['message_id_to_delete'])
         except Exception as e:
@@ -831,38 +1540,31 @@ async def process_hours_and_fetch_users(update: Update, context: ContextTypes.DE
     time_threshold = now_utc - timedelta(hours=hours)
     
     active_uuids = set()
-    start = 0
-    size = 100
     fetch_more = True
 
     # ۳. جستجو در لاگ‌های سابسکریپشن تا رسیدن به زمان مشخص شده
-    while fetch_more:
-        history_data, h_error = await api_request_get_sub_history(start=start, size=size)
-        if h_error or not history_data or 'response' not in history_data:
-            break
-            
-        records = history_data['response'].get('records', [])
-        if not records:
-            break
+    # صفحات بعدی همزمان با پردازش صفحه فعلی از قبل دریافت می‌شوند
+    async with contextlib.aclosing(iter_sub_history_pages(size=100, prefetch=2)) as pages:
+        async for records in pages:
+            for rec in records:
+                req_at_str = rec.get('requestAt')
+                if not req_at_str: continue
+                
+                req_dt = parse_iso_date(req_at_str)
+                if not req_dt: continue
+                
+                # اگر زمان درخواست جدیدتر از حد مشخص شده (N ساعت) است
+                if req_dt >= time_threshold:
+                    user_id = rec.get('userId')
+                    if user_id:
+                        active_uuids.add(user_id)
+                else:
+                    # چون لاگ‌ها نزولی مرتب شده‌اند، وقتی به دیتای قدیمی‌تر رسیدیم جستجو را متوقف می‌کنیم
+                    fetch_more = False
+                    break
 
-        for rec in records:
-            req_at_str = rec.get('requestAt')
-            if not req_at_str: continue
-            
-            req_dt = parse_iso_date(req_at_str)
-            if not req_dt: continue
-            
-            # اگر زمان درخواست جدیدتر از حد مشخص شده (N ساعت) است
-            if req_dt >= time_threshold:
-                user_id = rec.get('userId')
-                if user_id:
-                    active_uuids.add(user_id)
-            else:
-                # چون لاگ‌ها نزولی مرتب شده‌اند، وقتی به دیتای قدیمی‌تر رسیدیم جستجو را متوقف می‌کنیم
-                fetch_more = False
+            if not fetch_more:
                 break
-                
-        start += size
 
     # ۴. دسته‌بندی نهایی کاربران
     updated_users = []
@@ -1393,7 +2095,8 @@ async def show_user_card(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             InlineKeyboardButton(t('user_links_btn', context), callback_data='show_all_links:0')
         ],
         [
-            InlineKeyboardButton(t('edit_squads_btn', context), callback_data='edit_squads')
+            InlineKeyboardButton(t('edit_squads_btn', context), callback_data='edit_squads'),
+            InlineKeyboardButton(t('search_user_logs_btn', context), callback_data='search_user_logs')
         ],
         [
             InlineKeyboardButton(t('back_to_main_menu_btn', context), callback_data='back_to_main')
@@ -1484,6 +2187,9 @@ async def user_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
     if action == 'edit_hwid':
         return await show_hwid_menu(update, context)
+
+    if action in ('search_user_logs', 'search_user_logs_next'):
+        return await search_user_logs(update, context, next_page=action == 'search_user_logs_next')
         
     if action == 'return_to_user_card':
         await query.message.delete()
@@ -1917,56 +2623,403 @@ async def edit_user_squads_handler(update: Update, context: ContextTypes.DEFAULT
         return SELECT_USER_SQUADS_EDIT
 
 
+def build_logs_view(node_name: str, logs: str, context: ContextTypes.DEFAULT_TYPE, following: bool = False, status: str = ""):
+    MAX_LOG_LENGTH = 3800
+    if logs and len(logs) > MAX_LOG_LENGTH: logs = f"...\n{logs[-MAX_LOG_LENGTH:]}"
+    safe_logs = html.escape(logs or t('logs_empty', context))
+    message_text = f"{t('logs_title', context, node_name=node_name)}\n"
+    if status: message_text += f"{status}\n"
+    message_text += f"\n<pre><code>{safe_logs}</code></pre>"
+    if following:
+        keyboard = [[InlineKeyboardButton(t('stop_follow_logs_btn', context), callback_data=f'logstop_{node_name}')]]
+    else:
+        keyboard = [[InlineKeyboardButton(t('refresh_logs_btn', context), callback_data=f'lognode_{node_name}'),
+                     InlineKeyboardButton(t('follow_logs_btn', context), callback_data=f'logfollow_{node_name}')]]
+        if (config.NODES.get(node_name) or {}).get('type') == 'remote':
+            keyboard.append([InlineKeyboardButton(t('node_stats_btn', context), callback_data=f'logstats_1_{node_name}')])
+    keyboard.append([InlineKeyboardButton(t('back_to_nodes_btn', context), callback_data='go_view_logs')])
+    return message_text, InlineKeyboardMarkup(keyboard)
+
+def sparkline(values: list) -> str:
+    bars = "▁▂▃▄▅▆▇█"
+    peak = max(values, default=0)
+    if not peak: return bars[0] * len(values)
+    return "".join(bars[min(int(v * len(bars) / (peak + 1)), len(bars) - 1)] if v else " " for v in values)
+
+async def get_node_stats(node_name: str, hours: int):
+    """Fetches the access log summary of a remote node. Returns (stats, error)."""
+    node_config = config.NODES.get(node_name) or {}
+    if node_config.get('type') != 'remote':
+        return None, "Stats are only available for remote nodes."
+    try:
+        headers = {'Authorization': f"Bearer {node_config['token']}"}
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.get(node_agent_url(node_config, '/stats'), headers=headers, params={'hours': hours, 'top': NODE_STATS_TOP})
+        if response.status_code == 404:
+            return None, "The log server on this node is outdated; update it from the installer."
+        response.raise_for_status()
+        return response.json(), None
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+
+async def node_stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query; await query.answer()
+    _, hours, node_name = query.data.split('_', 2)
+    hours = int(hours)
+    stop_log_follow(context)
+
+    stats, error = await get_node_stats(node_name, hours)
+    keyboard = [
+        [InlineKeyboardButton(f"{'• ' if h == hours else ''}{h}h", callback_data=f'logstats_{h}_{node_name}') for h in (1, 6, 24)],
+        [InlineKeyboardButton(t('back_to_logs_btn', context), callback_data=f'lognode_{node_name}')]
+    ]
+    if error:
+        message_text = t('error_fetching_node_stats', context, node_name=html.escape(node_name), details=html.escape(error))
+    else:
+        as_of = datetime.fromtimestamp(stats['as_of'], tz=timezone.utc).strftime('%Y-%m-%d %H:%M') if stats['as_of'] else "-"
+        lines = [
+            t('node_stats_title', context, node_name=html.escape(node_name), hours=stats['hours'], as_of=as_of),
+            t('node_stats_totals', context, total=f"{stats['total']:,}", rejected=f"{stats['rejected']:,}", users=stats['unique_users']),
+            "", t('node_stats_top_users', context)
+        ]
+        lines += [f"{i}. <code>{html.escape(email)}</code> — {count:,}" for i, (email, count) in enumerate(stats['users'], 1)] or ["-"]
+        lines += ["", t('node_stats_top_destinations', context)]
+        lines += [f"{i}. <code>{html.escape(dest)}</code> — {count:,}" for i, (dest, count) in enumerate(stats['destinations'], 1)] or ["-"]
+        per_minute = stats.get('per_minute') or []
+        tail = ["", t('node_stats_per_minute', context, peak=max(per_minute, default=0)), f"<code>{sparkline(per_minute)}</code>"]
+        message_text = join_lines_within(lines, tail)
+    try:
+        await query.message.edit_text(message_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    except BadRequest as e:
+        if "Message is not modified" not in str(e): raise
+    return VIEWING_LOGS
+
+async def collect_ip_sketches(hours: int):
+    """
+    Fetches the per-user IP sketches of every remote node concurrently and merges
+    them per user. Returns (sketches, nodes_per_user, errors); errors maps node names
+    that could not be queried to the reason.
+    """
+    remote_nodes = {name: cfg for name, cfg in config.NODES.items() if cfg.get('type') == 'remote'}
+    merged, nodes_per_user, errors = {}, {}, {}
+
+    async def fetch(client, node_name, node_config):
+        headers = {'Authorization': f"Bearer {node_config['token']}"}
+        response = await client.get(node_agent_url(node_config, '/hll'), headers=headers, params={'hours': hours, 'sparse': 1})
+        if response.status_code == 404:
+            raise RuntimeError("log server outdated")
+        response.raise_for_status()
+        return response.json()
+
+    async with httpx.AsyncClient(timeout=20) as client:
+        results = await asyncio.gather(*(fetch(client, name, cfg) for name, cfg in remote_nodes.items()), return_exceptions=True)
+
+    for node_name, result in zip(remote_nodes, results):
+        if isinstance(result, Exception):
+            errors[node_name] = str(result) or type(result).__name__
+            continue
+        if result.get('precision') != HLL_PRECISION:
+            errors[node_name] = f"sketch precision {result.get('precision')} != {HLL_PRECISION}"
+            continue
+        # agents that know 'sparse' send small sketches as (index, rank) pairs, older ones send all of them dense
+        sketches = [(email, HyperLogLog.from_bytes(b64decode(data))) for email, data in result.get('sketches', {}).items()]
+        sketches += [(email, HyperLogLog.from_sparse(b64decode(data))) for email, data in result.get('sparse', {}).items()]
+        for email, sketch in sketches:
+            if email in merged: merged[email].merge(sketch)
+            else: merged[email] = sketch
+            nodes_per_user[email] = nodes_per_user.get(email, 0) + 1
+    return merged, nodes_per_user, errors
+
+async def shared_accounts_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query; await query.answer()
+    _, threshold, hours = query.data.split('_')
+    threshold, hours = int(threshold), int(hours)
+    stop_log_follow(context)
+    await query.message.edit_text(t('fetching_shared_accounts', context))
+
+    sketches, nodes_per_user, errors = await collect_ip_sketches(hours)
+    counts = sorted(((sketch.count(), email) for email, sketch in sketches.items()), reverse=True)
+    flagged = [(count, email) for count, email in counts if count >= threshold]
+
+    lines = [t('shared_accounts_title', context, threshold=threshold, hours=hours, users=len(sketches)), ""]
+    if not flagged:
+        lines.append(t('shared_accounts_none', context))
+    for count, email in flagged[:SHARING_REPORT_LIMIT]:
+        lines.append(t('shared_accounts_row', context, email=html.escape(email), count=count, nodes=nodes_per_user[email]))
+    tail = []
+    if len(flagged) > SHARING_REPORT_LIMIT:
+        tail.append(t('and_more_users', context, count=len(flagged) - SHARING_REPORT_LIMIT))
+    if errors:
+        tail += ["", t('shared_accounts_node_errors', context)]
+        tail += [f"• {html.escape(name)}: <code>{html.escape(reason)}</code>" for name, reason in errors.items()]
+    if any(cfg.get('type') == 'local' for cfg in config.NODES.values()):
+        tail += ["", t('shared_accounts_local_note', context)]
+
+    keyboard = [
+        [InlineKeyboardButton(f"{'• ' if n == threshold else ''}≥{n} IP", callback_data=f'sharing_{n}_{hours}') for n in (3, 5, 10)],
+        [InlineKeyboardButton(f"{'• ' if h == hours else ''}{h}h", callback_data=f'sharing_{threshold}_{h}') for h in (4, 24)],
+        [InlineKeyboardButton(t('back_to_nodes_btn', context), callback_data='go_view_logs')]
+    ]
+    message_text = join_lines_within(lines, tail)
+    try:
+        await query.message.edit_text(message_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    except BadRequest as e:
+        if "Message is not modified" not in str(e): raise
+    return VIEWING_LOGS
+
+async def search_node_logs(client: httpx.AsyncClient, node_name: str, term: str, cursor: str | None):
+    node_config = config.NODES[node_name]
+    params = {'q': term, 'limit': LOG_SEARCH_PAGE_SIZE}
+    if cursor: params['cursor'] = cursor
+    response = await client.get(node_agent_url(node_config, '/search'), params=params,
+                                headers={'Authorization': f"Bearer {node_config['token']}"})
+    if response.status_code == 404:
+        raise RuntimeError("log server outdated")
+    response.raise_for_status()
+    return response.json()
+
+async def search_user_logs(update: Update, context: ContextTypes.DEFAULT_TYPE, next_page: bool = False) -> int:
+    """
+    Searches the indexed log segments of every remote node for the user's lines,
+    newest first. Each node keeps its own cursor, so "next page" continues only
+    the nodes that still have results.
+    """
+    query = update.callback_query
+    username = context.user_data.get('username', '')
+    search = context.user_data.get('log_search')
+    if not next_page or not search or search.get('term') != username:
+        remote_nodes = [name for name, cfg in config.NODES.items() if cfg.get('type') == 'remote']
+        search = context.user_data['log_search'] = {'term': username, 'cursors': {name: None for name in remote_nodes}, 'page': 0}
+    search['page'] += 1
+    await query.message.edit_text(t('searching_user_logs', context, username=html.escape(username)), parse_mode=ParseMode.HTML)
+
+    nodes = list(search['cursors'])
+    async with httpx.AsyncClient(timeout=30) as client:
+        results = await asyncio.gather(*(search_node_logs(client, name, username, search['cursors'][name]) for name in nodes), return_exceptions=True)
+
+    hits, errors = [], {}
+    for node_name, result in zip(nodes, results):
+        if isinstance(result, Exception):
+            errors[node_name] = str(result) or type(result).__name__
+            search['cursors'].pop(node_name)
+            continue
+        hits += [(hit['ts'], node_name, hit['line'], hit.get('cursor')) for hit in result.get('hits', [])]
+        if result.get('next'): search['cursors'][node_name] = result['next']
+        else: search['cursors'].pop(node_name)
+    hits.sort(key=lambda hit: hit[0], reverse=True)
+
+    header = [t('user_logs_title', context, username=html.escape(username), page=search['page']), ""]
+    footer = []
+    if errors:
+        footer += ["", t('shared_accounts_node_errors', context)]
+        footer += [f"• {html.escape(name)}: <code>{html.escape(reason)}</code>" for name, reason in errors.items()]
+    hit_lines = []
+    for ts, node_name, line, _ in hits:
+        line = line if len(line) <= 200 else line[:197] + "..."
+        hit_lines.append(f"<b>{html.escape(node_name)}</b> <code>{html.escape(line)}</code>")
+    # show as many whole hits as fit; the next page starts each node at its first hit left out
+    budget = MESSAGE_TEXT_LIMIT - len("\n".join(header + footer)) - 1
+    shown, size = 0, 0
+    while shown < len(hit_lines) and size + len(hit_lines[shown]) + 1 <= budget:
+        size += len(hit_lines[shown]) + 1
+        shown += 1
+    # the sort is stable, so each node's hits left out are the end of its own page
+    resumed, lost = set(), False
+    for ts, node_name, line, cursor in hits[shown:]:
+        if node_name in resumed: continue
+        resumed.add(node_name)
+        if cursor: search['cursors'][node_name] = cursor
+        else: lost = True  # agents from before per-hit cursors cannot continue mid page
+    lines = header + (hit_lines[:shown] or [t('user_logs_no_results', context)]) + (["..."] if lost else []) + footer
+    message_text = "\n".join(lines)
+
+    keyboard = []
+    if search['cursors']:
+        keyboard.append([InlineKeyboardButton(t('next_page_btn', context), callback_data='search_user_logs_next')])
+    keyboard.append([InlineKeyboardButton(t('back_to_user_info_btn', context), callback_data='return_to_user_card')])
+    await query.message.edit_text(message_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    return USER_MENU
+
+def stop_log_follow(context: ContextTypes.DEFAULT_TYPE, keep_message: bool = False):
+    """Stops the live log follow of this admin. With keep_message the task renders its last view itself."""
+    follow = context.user_data.pop('log_follow', None) if context and context.user_data is not None else None
+    if not follow or follow['task'].done(): return
+    if keep_message: follow['stop'].set()
+    else: follow['task'].cancel()
+
 async def logs_node_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query; await query.answer();
     node_name = query.data.split('_')[1]
+    stop_log_follow(context)
     
     await query.message.edit_text(text=t('fetching_logs', context, node_name=node_name), parse_mode=ParseMode.HTML)
     
-    logs, error = await asyncio.to_thread(get_logs_from_node, node_name)
-    MAX_LOG_LENGTH = 3800
-    if logs and len(logs) > MAX_LOG_LENGTH: logs = f"...\n{logs[-MAX_LOG_LENGTH:]}"
+    logs, error = await get_logs_from_node(node_name)
     if error:
         message_text = t('error_fetching_logs', context, node_name=node_name, details=html.escape(str(error or "")))
-        keyboard = [[InlineKeyboardButton(t('back_to_nodes_btn', context), callback_data='go_view_logs')]]
+        reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton(t('back_to_nodes_btn', context), callback_data='go_view_logs')]])
     else:
-        safe_logs = html.escape(logs or t('logs_empty', context))
-        message_text = f"{t('logs_title', context, node_name=node_name)}\n\n<pre><code>{safe_logs}</code></pre>"
-        keyboard = [[InlineKeyboardButton(t('refresh_logs_btn', context), callback_data=f'lognode_{node_name}')], [InlineKeyboardButton(t('back_to_nodes_btn', context), callback_data='go_view_logs')]]
+        message_text, reply_markup = build_logs_view(node_name, logs, context)
     
-    await query.message.edit_text(text=message_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    await query.message.edit_text(text=message_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+    return VIEWING_LOGS
+
+async def follow_logs_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query; await query.answer()
+    node_name = query.data.split('_', 1)[1]
+    stop_log_follow(context)
+    stop_event = asyncio.Event()
+    task = asyncio.create_task(run_log_follow(context, query.message.chat_id, query.message.message_id, node_name, stop_event))
+    context.user_data['log_follow'] = {'task': task, 'stop': stop_event}
     return VIEWING_LOGS
 
+async def stop_follow_logs_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query; await query.answer()
+    stop_log_follow(context, keep_message=True)
+    return VIEWING_LOGS
+
+async def run_log_follow(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int, node_name: str, stop_event: asyncio.Event):
+    """
+    Keeps a rolling window of the newest log lines of a node in the log message.
+    Remote agents push new lines over their /events stream; local nodes and
+    older agents are polled for the lines written after the last cursor.
+    Edits are throttled to stay within Telegram's limits and only happen when
+    something actually changed. Cancelling the task leaves the message alone
+    (the admin navigated away); setting `stop_event` or reaching the time
+    limit renders the final view.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + LOG_FOLLOW_MAX_DURATION
+    window = deque(maxlen=LOG_WINDOW_LINES)
+    cursor = 0
+    error = None
+    shown_error = None
+    changed = True
+    last_edit = 0.0
+
+    stream = listener = None
+    if (config.NODES.get(node_name) or {}).get('type') == 'remote':
+        stream, listener = subscribe_node_stream(node_name)
+
+    async def render(following: bool, status: str):
+        message_text, reply_markup = build_logs_view(node_name, "\n".join(window), context, following=following, status=status)
+        try:
+            await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=message_text,
+                                                reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        except BadRequest as e:
+            if "Message is not modified" not in str(e): raise
+
+    try:
+        while not stop_event.is_set() and loop.time() < deadline:
+            if listener:
+                for kind, payload in listener.drain():
+                    if kind == 'reset':
+                        window.clear(); changed = True
+                    elif kind == 'log':
+                        window.extend(payload); changed = True
+                    elif kind == 'dropped':
+                        window.append(t('logs_follow_gap', context, count=payload)); changed = True
+                    elif kind == 'connected':
+                        error = None
+                    elif kind == 'error':
+                        error = payload
+                    elif kind == 'status':
+                        error = None if payload.get('state') == 'up' else f"log follower {payload.get('state')} {payload.get('details', '')}".strip()
+                    elif kind == 'unsupported':
+                        stream.unsubscribe(listener)
+                        stream = listener = None
+                        break
+            else:
+                text, cursor, reset, error = await get_log_delta_from_node(node_name, cursor)
+                if not error:
+                    if reset: window.clear()
+                    lines = text.splitlines()
+                    if reset or lines:
+                        window.extend(lines)
+                        changed = True
+
+            if error != shown_error:
+                changed = True
+
+            if changed and loop.time() - last_edit >= LOG_FOLLOW_MIN_EDIT_INTERVAL:
+                if error: status = t('logs_follow_error', context, details=html.escape(str(error)))
+                else: status = t('logs_follow_live', context, time=datetime.now().strftime('%H:%M:%S'))
+                try:
+                    await render(True, status)
+                    last_edit = loop.time()
+                    changed = False
+                    shown_error = error
+                except RetryAfter as e:
+                    last_edit = loop.time() + e.retry_after
+
+            if listener:
+                timeout = max(LOG_FOLLOW_MIN_EDIT_INTERVAL - (loop.time() - last_edit), 0.2) if changed else LOG_FOLLOW_POLL_INTERVAL
+                await wait_for_any([stop_event, listener.wakeup], timeout)
+            else:
+                await wait_for_any([stop_event], LOG_FOLLOW_POLL_INTERVAL)
+
+        await render(False, t('logs_follow_stopped', context))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"Log follow for node {node_name} stopped: {e}")
+    finally:
+        if listener: stream.unsubscribe(listener)
+        follow = context.user_data.get('log_follow')
+        if follow and follow['task'] is asyncio.current_task():
+            context.user_data.pop('log_follow', None)
+
+async def restart_node(node_name: str):
+    """Restarts one node without blocking the event loop. Returns (output, error)."""
+    node_config = config.NODES.get(node_name)
+    if not node_config:
+        return "", "Node not found in config"
+
+    if node_config['type'] == 'local':
+        try:
+            restarted_at = int(datetime.now().timestamp())
+            await asyncio.wait_for(docker.restart_container("remnanode"), timeout=NODE_RESTART_TIMEOUT)
+            await asyncio.sleep(5)
+            return (await docker.container_logs("remnanode", tail=20, since=restarted_at)).strip(), ""
+        except Exception as e:
+            return "", str(e) or type(e).__name__
+    elif node_config['type'] == 'remote':
+        try:
+            headers = {'Authorization': f"Bearer {node_config['token']}"}
+            async with httpx.AsyncClient(timeout=NODE_RESTART_TIMEOUT) as client:
+                response = await client.post(node_agent_url(node_config, '/restart'), headers=headers)
+            response.raise_for_status()
+            data = response.json()
+            if data.get('status') != 'success':
+                return "", data.get('details', 'Unknown remote error')
+            return data.get('logs') or "", ""
+        except Exception as e:
+            return "", str(e) or type(e).__name__
+    return "", "Invalid node type in config."
+
+async def wait_node_healthy(node_name: str) -> str:
+    """Polls a restarted node until its container runs again. Returns an error message, or "" when healthy."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + NODE_HEALTH_CHECK_TIMEOUT
+    status = {}
+    async with httpx.AsyncClient(timeout=NODE_STATUS_TIMEOUT) as client:
+        while loop.time() < deadline:
+            try:
+                status = await asyncio.wait_for(probe_node_status(node_name, client), timeout=NODE_STATUS_TIMEOUT)
+            except asyncio.TimeoutError:
+                status = {'error': "Timeout"}
+            # نودهای قدیمی وضعیت کانتینر را گزارش نمی‌کنند؛ در دسترس بودن کافی است
+            if status.get('reachable') and status.get('container') in ('running', None):
+                return ""
+            await asyncio.sleep(NODE_HEALTH_CHECK_INTERVAL)
+    return status.get('error') or f"container {status.get('container') or 'unknown'}"
+
 async def restart_node_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query; await query.answer()
-    node_name = query.data.split('_')[1]
+    node_name = query.data.split('_', 1)[1]
     await query.message.edit_text(t('restarting_node', context, node_name=node_name), parse_mode=ParseMode.HTML)
-    
-    def run_restart():
-        node_config = config.NODES.get(node_name)
-        output, error = "", ""
-        if not node_config:
-            return "", "Node not found in config"
-            
-        if node_config['type'] == 'local':
-            command = "cd /opt/remnanode && docker compose down && docker compose up -d && sleep 5 && docker compose logs --tail=20"
-            try:
-                result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True, encoding='utf-8')
-                output = result.stdout.strip()
-            except subprocess.CalledProcessError as e: error = e.stderr.strip()
-        elif node_config['type'] == 'remote':
-            try:
-                parsed_url = urlparse(node_config.get('url', '')); ip = parsed_url.hostname
-                if ip:
-                    restart_url = f"http://{ip}:5555/restart"; headers = {'Authorization': f"Bearer {node_config['token']}"}
-                    response = requests.post(restart_url, headers=headers, timeout=90); response.raise_for_status()
-                    data = response.json(); output = data.get('logs')
-                    if data.get('status') != 'success': error = data.get('details', 'Unknown remote error')
-                else: error = "Could not parse IP from node URL."
-            except Exception as e: error = str(e)
-        return output, error
-
-    output, error = await asyncio.to_thread(run_restart)
+
+    output, error = await restart_node(node_name)
 
     if error: message_text = f"{t('node_restart_failed', context, node_name=node_name)}\n\n<pre><code>{html.escape(error)}</code></pre>"
     else: message_text = f"{t('node_restart_success', context, node_name=node_name)}\n\n<b>{t('logs_title', context, node_name=node_name)}</b>\n<pre><code>{html.escape(output)}</code></pre>"
@@ -1974,6 +3027,146 @@ async def restart_node_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.message.edit_text(message_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
     return MAIN_MENU
 
+# --- Rolling Restart ---
+def build_rolling_restart_view(context: ContextTypes.DEFAULT_TYPE):
+    state = context.user_data.setdefault('rolling_restart', {'selected': [], 'parallelism': ROLLING_RESTART_DEFAULT_PARALLELISM})
+    keyboard = []
+    for node_name in config.NODES.keys():
+        mark = "✅" if node_name in state['selected'] else "▫️"
+        keyboard.append([InlineKeyboardButton(f"{mark} {node_name}", callback_data=f"rrtoggle_{node_name}")])
+    keyboard.append([InlineKeyboardButton(t('select_all_btn', context), callback_data='rrall')])
+    keyboard.append([InlineKeyboardButton(f"{'• ' if n == state['parallelism'] else ''}{n}", callback_data=f"rrpar_{n}") for n in (1, 2, 3, 4)])
+    if state['selected']:
+        keyboard.append([InlineKeyboardButton(t('start_rolling_restart_btn', context, count=len(state['selected'])), callback_data='rrstart')])
+    keyboard.append([InlineKeyboardButton(t('back_to_restart_list_btn', context), callback_data='go_restart_nodes')])
+    message_text = t('rolling_restart_prompt', context, parallelism=state['parallelism'])
+    return message_text, InlineKeyboardMarkup(keyboard)
+
+async def rolling_restart_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    state = context.user_data.setdefault('rolling_restart', {'selected': [], 'parallelism': ROLLING_RESTART_DEFAULT_PARALLELISM})
+    if state.get('task') and not state['task'].done():
+        await query.answer(t('rolling_restart_in_progress', context), show_alert=True)
+        return SELECT_NODE_RESTART
+    await query.answer()
+
+    data = query.data
+    if data.startswith('rrtoggle_'):
+        node_name = data.split('_', 1)[1]
+        if node_name in state['selected']: state['selected'].remove(node_name)
+        elif node_name in config.NODES: state['selected'].append(node_name)
+    elif data == 'rrall':
+        state['selected'] = [] if len(state['selected']) == len(config.NODES) else list(config.NODES.keys())
+    elif data.startswith('rrpar_'):
+        state['parallelism'] = int(data.split('_', 1)[1])
+    # ترتیب ری‌استارت همان ترتیب نودها در کانفیگ است
+    state['selected'] = [n for n in config.NODES.keys() if n in state['selected']]
+
+    message_text, reply_markup = build_rolling_restart_view(context)
+    try:
+        await query.message.edit_text(message_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+    except BadRequest as e:
+        if "Message is not modified" not in str(e): raise
+    return SELECT_NODE_RESTART
+
+async def start_rolling_restart_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    state = context.user_data.get('rolling_restart') or {}
+    if not state.get('selected') or (state.get('task') and not state['task'].done()):
+        return await rolling_restart_menu_handler(update, context)
+    await query.answer()
+
+    nodes = list(state['selected'])
+    state['selected'] = []
+    state['task'] = context.application.create_task(
+        run_rolling_restart(context, query.message.chat_id, query.message.message_id, nodes, state['parallelism'])
+    )
+    return MAIN_MENU
+
+async def run_rolling_restart(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int, nodes: list, parallelism: int):
+    """
+    Restarts `nodes` in config order, at most `parallelism` at a time. A node
+    counts as done only after it passes a health check; the first failure stops
+    the rollout and the nodes not started yet are skipped, so a bad config push
+    cannot take the whole fleet down.
+    """
+    loop = asyncio.get_running_loop()
+    progress = {node_name: ('pending', "") for node_name in nodes}
+    queue = deque(nodes)
+    aborted = asyncio.Event()
+    changed = asyncio.Event()
+    started = loop.time()
+    icons = {'pending': "⏳", 'restarting': "🔄", 'checking': "🩺", 'done': "✅", 'failed': "❌", 'skipped': "⏭"}
+
+    def set_state(node_name, node_state, details=""):
+        progress[node_name] = (node_state, details)
+        changed.set()
+
+    def render_text(finished: bool) -> str:
+        done = sum(1 for node_state, _ in progress.values() if node_state == 'done')
+        if not finished: title = t('rolling_restart_running', context, done=done, total=len(nodes), parallelism=parallelism)
+        elif aborted.is_set(): title = t('rolling_restart_aborted', context, done=done, total=len(nodes))
+        else: title = t('rolling_restart_finished', context, total=len(nodes), seconds=int(loop.time() - started))
+        lines = [title, ""]
+        for node_name in nodes:
+            node_state, details = progress[node_name]
+            lines.append(f"{icons[node_state]} <b>{html.escape(node_name)}</b> — {t(f'rolling_state_{node_state}', context)}")
+            if details:
+                lines.append(f"   └ <code>{html.escape(details[-300:])}</code>")
+        return join_lines_within(lines)
+
+    async def worker():
+        while queue and not aborted.is_set():
+            node_name = queue.popleft()
+            set_state(node_name, 'restarting')
+            output, error = await restart_node(node_name)
+            if not error:
+                set_state(node_name, 'checking')
+                error = await wait_node_healthy(node_name)
+            if error:
+                set_state(node_name, 'failed', error)
+                aborted.set()
+            else:
+                set_state(node_name, 'done')
+
+    async def reporter():
+        last_edit = 0.0
+        while True:
+            await changed.wait()
+            await asyncio.sleep(max(ROLLING_RESTART_MIN_EDIT_INTERVAL - (loop.time() - last_edit), 0))
+            changed.clear()
+            try:
+                await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=render_text(False), parse_mode=ParseMode.HTML)
+                last_edit = loop.time()
+            except RetryAfter as e:
+                changed.set()
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                if "Message is not modified" not in str(e): logger.warning(f"Rolling restart progress edit failed: {e}")
+
+    changed.set()
+    reporter_task = asyncio.create_task(reporter())
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, min(parallelism, len(nodes))))))
+    finally:
+        reporter_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await reporter_task
+    for node_name in queue:
+        progress[node_name] = ('skipped', "")
+
+    keyboard = [[InlineKeyboardButton(t('back_to_restart_list_btn', context), callback_data='go_restart_nodes')]]
+    for attempt in range(3):
+        try:
+            await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=render_text(True),
+                                                reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+            break
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except BadRequest as e:
+            logger.warning(f"Rolling restart result edit failed: {e}")
+            break
+
 # --- Start of Expiring Users Feature ---
 async def show_expiring_users_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
@@ -2484,6 +3677,17 @@ async def start_bulk_creation_process(update: Update, context: ContextTypes.DEFA
     asyncio.create_task(run_bulk_creation_background(task_data))
     return ConversationHandler.END
 
+async def send_waiting_out_flood(send, attempts: int = 5, **kwargs):
+    """Calls a Bot API send method, sleeping through flood control; the last RetryAfter is raised."""
+    for attempt in range(attempts):
+        try:
+            return await send(**kwargs)
+        except RetryAfter as e:
+            if attempt == attempts - 1:
+                raise
+            logger.warning(f"Telegram Flood limit hit. Sleeping for {e.retry_after} seconds.")
+            await asyncio.sleep(e.retry_after)
+
 async def run_bulk_creation_background(task_data: dict):
     bot = task_data['bot']
     chat_id = task_data['chat_id']
@@ -2566,25 +3770,17 @@ async def run_bulk_creation_background(task_data: dict):
 
         try:
             if qr_bytes:
-                await bot.send_photo(chat_id=chat_id, photo=qr_bytes, caption=caption, parse_mode=ParseMode.HTML)
-            else:
-                await bot.send_message(chat_id=chat_id, text=caption, parse_mode=ParseMode.HTML)
-                
-        except RetryAfter as e:
-            logger.warning(f"Telegram Flood limit hit. Sleeping for {e.retry_after} seconds.")
-            await asyncio.sleep(e.retry_after)
-            if qr_bytes:
-                await bot.send_photo(chat_id=chat_id, photo=qr_bytes, caption=caption, parse_mode=ParseMode.HTML)
+                await send_waiting_out_flood(bot.send_photo, chat_id=chat_id, photo=qr_bytes, caption=caption, parse_mode=ParseMode.HTML)
             else:
-                await bot.send_message(chat_id=chat_id, text=caption, parse_mode=ParseMode.HTML)
-                
+                await send_waiting_out_flood(bot.send_message, chat_id=chat_id, text=caption, parse_mode=ParseMode.HTML)
         except Exception as e:
             logger.error(f"Failed to send banner for {username}: {e}")
             
         await asyncio.sleep(0.5)
 
     keyboard = [[InlineKeyboardButton(job_t('back_to_main_menu_btn'), callback_data='back_to_main')]]
-    await bot.send_message(
+    await send_waiting_out_flood(
+        bot.send_message,
         chat_id=chat_id, 
         text=job_t('bulk_creation_finished', success=success_count, failed=failed_count), 
         reply_markup=InlineKeyboardMarkup(keyboard)
@@ -2742,8 +3938,14 @@ async def confirm_ext_squad_action_handler(update: Update, context: ContextTypes
 # --- End of Edit By External Squad Feature ---
 # --- End of Bulk Create Feature ---
 
-def main() -> None:
-    application = Application.builder().token(config.TELEGRAM_BOT_TOKEN).post_init(post_init).build()
+def build_application() -> Application:
+    """Builds the Application with all handlers registered; main() runs it, bench/replay.py drives it directly."""
+    builder = Application.builder().token(config.TELEGRAM_BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown)
+    builder = builder.request(InstrumentedRequest()).get_updates_request(InstrumentedRequest(connection_pool_size=1))
+    api_urls = bot_api_urls(config.data)
+    if api_urls:
+        builder = builder.base_url(api_urls['base_url']).base_file_url(api_urls['base_file_url'])
+    application = builder.build()
     
     conv_handler = ConversationHandler(
         entry_points=[
@@ -2762,12 +3964,26 @@ def main() -> None:
             AWAITING_LIMIT: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_new_value)],
             AWAITING_EXPIRE: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_new_value)],
             AWAITING_HWID_EDIT: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_new_value)],
-            NODE_LIST: [CallbackQueryHandler(logs_node_handler, pattern='^lognode_')],
+            NODE_LIST: [
+                CallbackQueryHandler(logs_node_handler, pattern='^lognode_'),
+                CallbackQueryHandler(nodes_status_handler, pattern='^nodes_status$'),
+                CallbackQueryHandler(shared_accounts_handler, pattern='^sharing_')
+            ],
             VIEWING_LOGS: [
+                CallbackQueryHandler(nodes_status_handler, pattern='^nodes_status$'),
                 CallbackQueryHandler(logs_node_handler, pattern='^lognode_'),
+                CallbackQueryHandler(follow_logs_handler, pattern='^logfollow_'),
+                CallbackQueryHandler(stop_follow_logs_handler, pattern='^logstop_'),
+                CallbackQueryHandler(node_stats_handler, pattern='^logstats_'),
+                CallbackQueryHandler(shared_accounts_handler, pattern='^sharing_'),
                 CallbackQueryHandler(show_node_list, pattern='^go_view_logs$')
             ],
-            SELECT_NODE_RESTART: [CallbackQueryHandler(restart_node_handler, pattern='^restartnode_')],
+            SELECT_NODE_RESTART: [
+                CallbackQueryHandler(restart_node_handler, pattern='^restartnode_'),
+                CallbackQueryHandler(rolling_restart_menu_handler, pattern='^(rrmenu|rrall|rrtoggle_.+|rrpar_\\d)$'),
+                CallbackQueryHandler(start_rolling_restart_handler, pattern='^rrstart$'),
+                CallbackQueryHandler(main_menu_handler, pattern='^go_restart_nodes$')
+            ],
             CONFIRM_DELETE: [CallbackQueryHandler(delete_user_confirmation_handler)],
             
             AWAITING_NEW_USERNAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_new_username)],
@@ -2836,6 +4052,19 @@ def main() -> None:
     )
     
     application.add_handler(conv_handler)
+    application.add_handler(CommandHandler('startup', startup_report_handler))
+    application.add_handler(CommandHandler('stats', api_stats_handler))
+    application.add_handler(CommandHandler('profile', profile_handler))
+    application.add_handler(CommandHandler('lag', lag_report_handler))
+    application.add_handler(CommandHandler('handlers', handler_timings_handler))
+    application.add_handler(TypeHandler(Update, count_profiled_update), group=PROFILE_UPDATE_GROUP)
+    application.add_handler(TypeHandler(Update, record_first_update), group=-1)
+    handler_timings.instrument_application(application, STATE_NAMES)
+    startup_marks.append(('application, handlers', time.perf_counter()))
+    return application
+
+def main() -> None:
+    application = build_application()
     
     if application.job_queue:
         application.job_queue.run_repeating(onhold_monitor_job, interval=180, first=10)
@@ -0,0 +1,101 @@
+# bulk_targets.py
+# The users a bulk edit applies to, kept as small records holding only what the
+# job reads instead of the panel's full user dicts. Records are taken from each
+# page of /api/users as it arrives, and past SPILL_AFTER of them they go to an
+# anonymous temporary file in chunks, so a bulk edit on a 40k-user panel costs
+# about as much memory as one on a 4k-user panel.
+import marshal
+import tempfile
+from datetime import datetime, timezone, timedelta
+
+SPILL_AFTER = 5000  # records kept in memory; the rest is written to disk in chunks of this size
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# expireAt that could not be parsed. A string, so it can never equal a real
+# instant (every int is one) and still goes through marshal with the rest.
+INVALID_DATE = 'invalid'
+
+
+def iso_to_epoch_ms(date_string: str | None) -> int | str | None:
+    """Epoch milliseconds of an ISO date, None for no date, INVALID_DATE if it cannot be read. Naive dates are UTC."""
+    if not date_string: return None
+    try:
+        dt = datetime.fromisoformat(date_string.replace('Z', '+00:00'))
+    except (ValueError, TypeError, AttributeError):
+        return INVALID_DATE
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - EPOCH) // timedelta(milliseconds=1)
+
+
+def epoch_ms_to_datetime(epoch_ms: int) -> datetime:
+    return EPOCH + timedelta(milliseconds=epoch_ms)
+
+
+class BulkTarget:
+    """
+    One user as a bulk edit sees it. expire is epoch milliseconds, None when the
+    user never expires, INVALID_DATE when the panel sent a date it could not read.
+    """
+
+    __slots__ = ('id', 'username', 'traffic_limit', 'expire', 'hwid_limit')
+
+    def __init__(self, id, username, traffic_limit, expire, hwid_limit):
+        self.id, self.username = id, username
+        self.traffic_limit, self.expire, self.hwid_limit = traffic_limit, expire, hwid_limit
+
+    @classmethod
+    def from_panel(cls, user: dict) -> 'BulkTarget':
+        return cls(user.get('id'), user.get('username', 'N/A'), user.get('trafficLimitBytes'),
+                   iso_to_epoch_ms(user.get('expireAt')), user.get('hwidDeviceLimit'))
+
+    def as_tuple(self) -> tuple:
+        return (self.id, self.username, self.traffic_limit, self.expire, self.hwid_limit)
+
+
+class BulkTargets:
+    """
+    Append-only collection of BulkTarget with a len() and any number of passes
+    over it in order. Full chunks are marshalled to a temporary file that is
+    removed by close(), or by the OS when the object is garbage collected.
+    """
+
+    def __init__(self, spill_after: int = SPILL_AFTER):
+        self.spill_after = spill_after
+        self.records = []
+        self.spill_file = None
+        self.spill_size = 0
+        self.spilled = 0
+
+    def append(self, target: BulkTarget):
+        self.records.append(target)
+        if len(self.records) >= self.spill_after:
+            if self.spill_file is None:
+                self.spill_file = tempfile.TemporaryFile(prefix='remna_bulk_')
+            self.spill_file.seek(self.spill_size)
+            marshal.dump([record.as_tuple() for record in self.records], self.spill_file)
+            self.spill_size = self.spill_file.tell()
+            self.spilled += len(self.records)
+            self.records = []
+
+    def extend(self, targets):
+        for target in targets:
+            self.append(target)
+
+    def __len__(self) -> int:
+        return self.spilled + len(self.records)
+
+    def __iter__(self):
+        position = 0
+        while self.spill_file is not None and position < self.spill_size:
+            self.spill_file.seek(position)  # appends or another pass may have moved it since the last chunk
+            chunk = marshal.load(self.spill_file)
+            position = self.spill_file.tell()
+            for row in chunk:
+                yield BulkTarget(*row)
+        yield from list(self.records)
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+        self.records, self.spill_size, self.spilled = [], 0, 0
@@ -1,47 +1,38 @@
 import sys
-import os
-from importlib.machinery import SourceFileLoader
-
-CONFIG_PATH = '/opt/remna_bot/config.py'
-
-def format_value(value):
-    if isinstance(value, str):
-        return f"'{value}'"
-    if value is None:
-        return "None"
-    return value
+import asyncio
+from config_store import read_config, write_config, migrate_legacy_config, RESTART_KEYS
+from send_file import bot_request
 
 def load_config():
-    if not os.path.exists(CONFIG_PATH):
-        print("Error: config.py not found!", file=sys.stderr)
+    try:
+        return read_config()
+    except FileNotFoundError:
+        print("Error: config.json not found!", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as e:
+        print(f"Error: config.json is invalid: {e}", file=sys.stderr)
         sys.exit(1)
-    return SourceFileLoader("remna_config_module", CONFIG_PATH).load_module()
-
-def rewrite_config(config_module):
-    content = f"""# config.py
-
-# botfather API token:
-TELEGRAM_BOT_TOKEN = {format_value(getattr(config_module, 'TELEGRAM_BOT_TOKEN', ''))}
-
-# panel url
-PANEL_URL = {format_value(getattr(config_module, 'PANEL_URL', ''))}
-
-# remnawave API token
-PANEL_API_TOKEN = {format_value(getattr(config_module, 'PANEL_API_TOKEN', ''))}
-
-# telegram user ID
-ADMIN_USER_ID = {getattr(config_module, 'ADMIN_USER_ID', 0)}
 
-# node list
-NODES = {getattr(config_module, 'NODES', {})}
-"""
-    with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-        f.write(content)
-    os.chmod(CONFIG_PATH, 0o660)
+def save_config(config: dict):
+    """Writes the configuration and asks the running bot to apply it."""
+    write_config(config)
+    try:
+        reply = asyncio.run(bot_request({'action': 'reload_config'}))
+    except OSError:
+        print("The bot is not running; the change applies when it starts.")
+        return
+    except RuntimeError as e:
+        print(f"Warning: the bot could not reload its configuration: {e}", file=sys.stderr)
+        return
+    changed = reply.get('changed') or []
+    if any(key in RESTART_KEYS for key in changed):
+        print(f"Applied live, except {', '.join(k for k in changed if k in RESTART_KEYS)} which needs a bot restart.")
+    else:
+        print("Applied to the running bot.")
 
 def list_nodes():
     config = load_config()
-    nodes = getattr(config, 'NODES', {})
+    nodes = config['NODES']
     if not nodes:
         print("No nodes are currently configured.")
         return
@@ -51,41 +42,55 @@ def list_nodes():
 
 def add_local_node(name):
     config = load_config()
-    nodes = getattr(config, 'NODES', {})
+    nodes = config['NODES']
     if name in nodes:
         print(f"Error: Node '{name}' already exists.", file=sys.stderr)
         return
     nodes[name] = {"type": "local"}
-    config.NODES = nodes
-    rewrite_config(config)
     print(f"Successfully added local node '{name}'.")
+    save_config(config)
 
 def add_remote_node(name, ip, token):
     config = load_config()
-    nodes = getattr(config, 'NODES', {})
+    nodes = config['NODES']
     if name in nodes:
         print(f"Error: Node '{name}' already exists.", file=sys.stderr)
         return
     url = f"http://{ip}:5555/logs"
     nodes[name] = {"type": "remote", "url": url, "token": token}
-    config.NODES = nodes
-    rewrite_config(config)
     print(f"Successfully added remote node '{name}'.")
+    save_config(config)
 
 def remove_node(name):
     config = load_config()
-    nodes = getattr(config, 'NODES', {})
+    nodes = config['NODES']
     if name not in nodes:
         print(f"Error: Node '{name}' not found.", file=sys.stderr)
         return
     del nodes[name]
-    config.NODES = nodes
-    rewrite_config(config)
     print(f"Successfully removed node '{name}'.")
+    save_config(config)
+
+def set_value(key, value):
+    config = load_config()
+    if key not in ('TELEGRAM_BOT_TOKEN', 'PANEL_URL', 'PANEL_API_TOKEN', 'ADMIN_USER_ID', 'TELEGRAM_API_BASE_URL', 'METRICS_PORT'):
+        print(f"Error: Unknown setting '{key}'.", file=sys.stderr)
+        return
+    config[key] = int(value) if key in ('ADMIN_USER_ID', 'METRICS_PORT') else value
+    print(f"Successfully updated {key}.")
+    save_config(config)
+
+def init_config(bot_token, admin_id, panel_url, panel_api_token):
+    if not bot_token or not admin_id.isdigit():
+        print("Error: a bot token and a numeric admin user ID are required.", file=sys.stderr)
+        sys.exit(1)
+    write_config({'TELEGRAM_BOT_TOKEN': bot_token, 'PANEL_URL': panel_url, 'PANEL_API_TOKEN': panel_api_token,
+                  'ADMIN_USER_ID': int(admin_id), 'NODES': {}})
+    print("Configuration file created.")
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: python config_manager.py [list|add_local|add_remote|remove] [args...]", file=sys.stderr)
+        print("Usage: python config_manager.py [list|add_local|add_remote|remove|set|init|migrate] [args...]", file=sys.stderr)
         sys.exit(1)
 
     command = sys.argv[1]
@@ -98,6 +103,13 @@ if __name__ == "__main__":
         add_remote_node(sys.argv[2], sys.argv[3], sys.argv[4])
     elif command == 'remove' and len(sys.argv) == 3:
         remove_node(sys.argv[2])
+    elif command == 'set' and len(sys.argv) == 4:
+        set_value(sys.argv[2], sys.argv[3])
+    elif command == 'init' and len(sys.argv) == 6:
+        init_config(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5])
+    elif command == 'migrate':
+        if migrate_legacy_config():
+            print("Converted config.py to config.json.")
     else:
         print(f"Invalid command or arguments for '{command}'.", file=sys.stderr)
         sys.exit(1)
@@ -0,0 +1,97 @@
+# config_store.py
+# The bot configuration, kept as JSON in config.json. Writes are atomic (a temp
+# file renamed over the old one), and the running bot reloads the file when it
+# changes, so adding or removing a node does not need a restart.
+import json
+import os
+from importlib.machinery import SourceFileLoader
+
+CONFIG_PATH = os.environ.get('REMNA_BOT_CONFIG', '/opt/remna_bot/config.json')
+LEGACY_CONFIG_PATH = '/opt/remna_bot/config.py'
+# TELEGRAM_API_BASE_URL: root of a self-hosted (or bench/fake_telegram.py) Bot API server; empty for api.telegram.org
+# METRICS_PORT: serve Prometheus metrics on 127.0.0.1:<port>/metrics; 0 turns the endpoint off
+DEFAULTS = {'TELEGRAM_BOT_TOKEN': '', 'PANEL_URL': '', 'PANEL_API_TOKEN': '', 'ADMIN_USER_ID': 0, 'NODES': {},
+            'TELEGRAM_API_BASE_URL': '', 'METRICS_PORT': 0}
+# Read once when the bot starts; changing them still needs a restart.
+RESTART_KEYS = ('TELEGRAM_BOT_TOKEN', 'TELEGRAM_API_BASE_URL', 'METRICS_PORT')
+
+def write_config(data: dict, path: str = CONFIG_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.chmod(tmp_path, 0o660)
+    os.replace(tmp_path, path)
+
+def migrate_legacy_config(path: str = CONFIG_PATH, legacy_path: str = LEGACY_CONFIG_PATH) -> bool:
+    """Converts an old config.py into config.json once. Returns True if it did."""
+    if os.path.exists(path) or not os.path.exists(legacy_path):
+        return False
+    module = SourceFileLoader("remna_config_module", legacy_path).load_module()
+    write_config({key: getattr(module, key, default) for key, default in DEFAULTS.items()}, path)
+    return True
+
+def read_config(path: str = CONFIG_PATH) -> dict:
+    """Reads and checks config.json (migrating config.py first if needed). Raises ValueError if it is invalid."""
+    migrate_legacy_config(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("config.json must contain an object")
+    data = {**DEFAULTS, **data}
+    if not isinstance(data['NODES'], dict):
+        raise ValueError("NODES must be an object")
+    for name, node in data['NODES'].items():
+        if not isinstance(node, dict):
+            raise ValueError(f"Node '{name}' must be an object")
+        if node.get('type') not in ('local', 'remote'):
+            raise ValueError(f"Node '{name}' has an invalid type")
+        if node['type'] == 'remote' and not (node.get('url') and node.get('token')):
+            raise ValueError(f"Remote node '{name}' needs a url and a token")
+    for key, value in (('ADMIN_USER_ID', data['ADMIN_USER_ID']), ('METRICS_PORT', data['METRICS_PORT'] or 0)):
+        try:
+            data[key] = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{key} must be a number") from None
+    return data
+
+def bot_api_urls(data: dict) -> dict:
+    """base_url/base_file_url for telegram.Bot when TELEGRAM_API_BASE_URL is set, otherwise {}."""
+    root = (data.get('TELEGRAM_API_BASE_URL') or '').rstrip('/')
+    if not root:
+        return {}
+    return {'base_url': f"{root}/bot", 'base_file_url': f"{root}/file/bot"}
+
+class Config:
+    """
+    Attribute access to the configuration (config.NODES, config.PANEL_URL, ...).
+    reload() swaps in the new values as a whole, so a reader never sees a mix
+    of old and new settings.
+    """
+
+    def __init__(self, path: str = CONFIG_PATH):
+        self.path = path
+        self.data = read_config(path)
+        self.stamp = self.file_stamp()
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['data'][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def file_stamp(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def reload(self, force: bool = False) -> list:
+        """Re-reads the file if it changed. Returns the keys whose values changed."""
+        stamp = self.file_stamp()
+        if stamp == self.stamp and not force:
+            return []
+        self.stamp = stamp  # an invalid file is reported once, not on every check
+        data = read_config(self.path)
+        changed = [key for key in data if data[key] != self.data.get(key)]
+        self.data = data
+        return changed
@@ -0,0 +1,109 @@
+# docker_api.py
+# Minimal async client for the Docker Engine API over its Unix socket, used for
+# local node operations instead of forking the `docker` CLI for every call.
+import struct
+import httpx
+
+DOCKER_SOCKET = "/var/run/docker.sock"
+DOCKER_API_VERSION = "v1.41"
+
+
+class DockerAPIError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def iter_frames(data: bytes):
+    """
+    Yields (stream_type, payload) from Docker's multiplexed stdout/stderr stream
+    (used when the container or exec has no TTY). Each frame is an 8-byte header
+    with the stream type (1 stdout, 2 stderr) and payload length, followed by the
+    payload. Output that does not look multiplexed is yielded as one stdout frame.
+    """
+    if len(data) < 8 or data[0] not in (0, 1, 2) or data[1:4] != b"\0\0\0":
+        if data: yield 1, data
+        return
+    offset = 0
+    while offset + 8 <= len(data):
+        stream_type, length = struct.unpack(">BxxxL", data[offset:offset + 8])
+        yield stream_type, data[offset + 8:offset + 8 + length]
+        offset += 8 + length
+
+
+def demux_stream(data: bytes):
+    """Splits a multiplexed stream into (stdout, stderr)."""
+    stdout, stderr = bytearray(), bytearray()
+    for stream_type, payload in iter_frames(data):
+        (stderr if stream_type == 2 else stdout).extend(payload)
+    return bytes(stdout), bytes(stderr)
+
+
+class DockerClient:
+    """
+    One keep-alive connection pool to the Docker daemon, shared by all calls.
+    `socket_path` can point at a fake daemon for testing.
+    """
+
+    def __init__(self, socket_path: str = DOCKER_SOCKET, api_version: str = DOCKER_API_VERSION):
+        self.socket_path = socket_path
+        self.api_version = api_version
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            transport = httpx.AsyncHTTPTransport(uds=self.socket_path)
+            self._client = httpx.AsyncClient(transport=transport, base_url=f"http://docker/{self.api_version}", timeout=30)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        response = await self.client.request(method, path, **kwargs)
+        if response.status_code >= 400:
+            try:
+                message = response.json().get('message') or response.text
+            except ValueError:
+                message = response.text
+            raise DockerAPIError(response.status_code, message.strip())
+        return response
+
+    async def inspect_container(self, name: str) -> dict:
+        response = await self.request("GET", f"/containers/{name}/json")
+        return response.json()
+
+    async def container_state(self, name: str) -> str:
+        """Returns the container status ('running', 'exited', ...) or 'missing'."""
+        try:
+            return (await self.inspect_container(name))['State']['Status']
+        except DockerAPIError as e:
+            if e.status_code == 404: return "missing"
+            raise
+
+    async def restart_container(self, name: str, stop_timeout: int = 10):
+        await self.request("POST", f"/containers/{name}/restart", params={'t': stop_timeout}, timeout=stop_timeout + 60)
+
+    async def container_logs(self, name: str, tail: int = 20, since: int | None = None) -> str:
+        """Returns the container's stdout/stderr, like `docker logs --tail N --since T`."""
+        params = {'stdout': 1, 'stderr': 1, 'tail': tail}
+        if since is not None: params['since'] = since
+        response = await self.request("GET", f"/containers/{name}/logs", params=params)
+        return b"".join(payload for _, payload in iter_frames(response.content)).decode('utf-8', errors='replace')
+
+    async def exec_run(self, name: str, cmd: list, timeout: float = 15):
+        """Runs a command inside a container, like `docker exec`. Returns (exit_code, stdout, stderr) as bytes."""
+        response = await self.request("POST", f"/containers/{name}/exec", json={
+            'AttachStdout': True, 'AttachStderr': True, 'Tty': False, 'Cmd': cmd
+        })
+        exec_id = response.json()['Id']
+        response = await self.request("POST", f"/exec/{exec_id}/start", json={'Detach': False, 'Tty': False}, timeout=timeout)
+        stdout, stderr = demux_stream(response.content)
+        response = await self.request("GET", f"/exec/{exec_id}/json")
+        return response.json().get('ExitCode'), stdout, stderr
+
+
+docker = DockerClient()
@@ -0,0 +1,139 @@
+# handler_timing.py
+# Times every handler the bot registers, per conversation state and trigger
+# (callback pattern, text or command). Each call records its wall time, the
+# part of it spent waiting on the panel and on the Bot API, and the event loop
+# CPU time the handler used itself. /handlers lists them by total time, so the
+# screens that cost the most are the ones worked on first.
+import functools
+import threading
+import time
+import types
+
+from telegram.ext import CallbackQueryHandler, CommandHandler, ConversationHandler, MessageHandler
+
+from metrics import Histogram, awaited
+
+PARTS = ('wall', 'panel', 'telegram', 'cpu')
+
+
+class HandlerStats:
+    __slots__ = ('wall', 'panel', 'telegram', 'cpu', 'errors')
+
+    def __init__(self):
+        self.wall, self.panel, self.telegram, self.cpu = Histogram(), Histogram(), Histogram(), Histogram()
+        self.errors = 0
+
+
+@types.coroutine
+def run_timed(coro, totals: dict):
+    """
+    Awaits coro one step at a time and adds the thread CPU time of each step to
+    totals['cpu']. Steps run on the loop thread, so time other tasks spend while
+    this one is suspended is not counted.
+    """
+    value, error = None, None
+    while True:
+        started = time.thread_time()
+        try:
+            yielded = coro.throw(error) if error is not None else coro.send(value)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            totals['cpu'] += time.thread_time() - started
+        try:
+            value, error = (yield yielded), None
+        except BaseException as e:  # cancellation and the like go on to the handler
+            value, error = None, e
+
+
+def trigger_label(handler) -> str:
+    if isinstance(handler, CallbackQueryHandler):
+        pattern = getattr(handler.pattern, 'pattern', handler.pattern)
+        return str(pattern) if pattern is not None else 'any button'
+    if isinstance(handler, CommandHandler):
+        return '/' + '|'.join(sorted(handler.commands))
+    if isinstance(handler, MessageHandler):
+        return 'text'
+    return type(handler).__name__
+
+
+class HandlerTimings:
+    """Statistics per handler label. Labels come from the registered handlers, so there is a fixed number of them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.state_names = {}
+        self.started = time.time()
+
+    def record(self, label: str, totals: dict, failed: bool):
+        with self.lock:
+            stats = self.stats.get(label)
+            if stats is None:
+                stats = self.stats[label] = HandlerStats()
+            for part in PARTS:
+                getattr(stats, part).observe(totals[part])
+            stats.errors += failed
+
+    def wrap(self, label: str, callback):
+        @functools.wraps(callback)
+        async def timed(update, context):
+            totals = dict.fromkeys(PARTS, 0.0)
+            token = awaited.set(totals)
+            started, failed = time.perf_counter(), True
+            try:
+                result = await run_timed(callback(update, context), totals)
+                failed = False
+                return result
+            finally:
+                awaited.reset(token)
+                totals['wall'] = time.perf_counter() - started
+                self.record(label, totals, failed)
+        return timed
+
+    def instrument(self, handler, state: str = None):
+        """Wraps the callback of handler (and of every handler inside it, for a ConversationHandler)."""
+        if isinstance(handler, ConversationHandler):
+            for inner in handler.entry_points:
+                self.instrument(inner, 'entry')
+            for value, inner_handlers in handler.states.items():
+                for inner in inner_handlers:
+                    self.instrument(inner, self.state_names.get(value, str(value)))
+            for inner in handler.fallbacks:
+                self.instrument(inner, 'fallback')
+            return
+        label = f"{trigger_label(handler)} -> {handler.callback.__name__}"
+        handler.callback = self.wrap(f"{state} {label}" if state else label, handler.callback)
+
+    def instrument_application(self, application, state_names: dict):
+        """state_names: conversation state value -> name, for the labels."""
+        self.state_names = state_names
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                self.instrument(handler)
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.started = time.time()
+
+    def report(self, limit: int = 12) -> str:
+        with self.lock:
+            items = sorted(self.stats.items(), key=lambda item: item[1].wall.total, reverse=True)
+            spent = sum(stats.wall.total for _, stats in items)
+            lines = [f"since {time.strftime('%Y-%m-%d %H:%M', time.localtime(self.started))}, "
+                     f"{sum(stats.wall.count for _, stats in items)} calls, {spent:.1f}s in handlers",
+                     "panel/tg add up calls made in parallel, so they can exceed the wall time (other is then 0)"]
+            for label, stats in items[:limit]:
+                n = stats.wall.count
+                avg = {part: getattr(stats, part).total / n * 1000 for part in PARTS}
+                other = max(0.0, avg['wall'] - avg['panel'] - avg['telegram'] - avg['cpu'])
+                lines.append(f"{label}\n  n={n} share={stats.wall.total / (spent or 1):.0%} avg={avg['wall']:.0f}ms "
+                             f"p90<={stats.wall.quantile(0.9) * 1000:.0f}ms panel={avg['panel']:.0f} tg={avg['telegram']:.0f} "
+                             f"cpu={avg['cpu']:.0f} other={other:.0f} err={stats.errors}")
+        if len(items) > limit:
+            lines.append(f"... {len(items) - limit} more")
+        return "\n".join(lines)
+
+
+handler_timings = HandlerTimings()
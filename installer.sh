@@ -14,11 +14,17 @@ BOT_SERVICE_NAME="remna_bot"
 LOG_SERVICE_NAME="remna_log_server"
 BOT_SERVICE_FILE="/etc/systemd/system/${BOT_SERVICE_NAME}.service"
 LOG_SERVICE_FILE="/etc/systemd/system/${LOG_SERVICE_NAME}.service"
-CONFIG_FILE="$INSTALL_DIR/config.py"
+CONFIG_FILE="$INSTALL_DIR/config.json"
 MANAGER_SCRIPT_PATH="$INSTALL_DIR/remna_bot_manager.sh"
 EXECUTABLE_PATH="/usr/local/bin/remna_bot"
 PYTHON_VENV_EXEC="$INSTALL_DIR/venv/bin/python"
 BACKUP_DIR="$INSTALL_DIR/backups"
+BACKUP_REPO_DIR="$BACKUP_DIR/repo"
+SNAPSHOT_RETENTION_DAYS=30
+# Instant backups: custom = pg_dump -Fc, restored in parallel with pg_restore; plain = SQL replayed through psql
+DUMP_FORMAT=custom
+# Auto snapshots stay plain: their chunking only deduplicates line-oriented SQL
+SNAPSHOT_DUMP_FORMAT=plain
 PANEL_COMPOSE_DIR="" # This will be set dynamically
 
 RED='\033[0;31m'
@@ -96,39 +102,40 @@ run_backup() {
     get_db_details
     
     local backup_type="$1"
-    local filename="${backup_type}_backup_$(date +%Y-%m-%d_%H-%M-%S).sql.gz"
-    local filepath="$BACKUP_DIR/$filename"
-    
-    echo "Creating database backup..."
-    docker exec remnawave-db pg_dump -U "$DB_USER" -d "$DB_NAME" | gzip > "$filepath"
+    local backup_path="$BACKUP_DIR/${backup_type}_backup_$(date +%Y-%m-%d_%H-%M-%S)"
+    local caption
+    if [ "$backup_type" == "instant" ]; then
+        caption="✅ Instant backup created on $(date +"%Y-%m-%d %H:%M:%S")"
+    else
+        caption="🗓 Automatic backup created on $(date +"%Y-%m-%d %H:%M:%S")"
+    fi
     
-    if [ $? -eq 0 ] && [ -s "$filepath" ]; then
-        echo -e "${GREEN}Backup created successfully at $filepath.${NC}"
-        echo "Sending backup to Telegram..."
-        local caption
-        if [ "$backup_type" == "instant" ]; then
-            caption="✅ Instant backup created on $(date +"%Y-%m-%d %H:%M:%S")"
-        else
-            caption="🗓 Automatic backup created on $(date +"%Y-%m-%d %H:%M:%S")"
+    if [ "$backup_type" != "instant" ]; then
+        # Auto backups go to the deduplicated repository: only new chunks are stored and sent.
+        echo "Creating incremental database snapshot and sending new data to Telegram..."
+        if "$PYTHON_VENV_EXEC" "$INSTALL_DIR/backup.py" snapshot "$BACKUP_REPO_DIR" "$(basename "$backup_path")" "$caption" "$DB_USER" "$DB_NAME" "$SNAPSHOT_DUMP_FORMAT"; then
+            "$PYTHON_VENV_EXEC" "$INSTALL_DIR/backup.py" prune "$BACKUP_REPO_DIR" "$SNAPSHOT_RETENTION_DAYS"
+            # Full auto backups from before the repository (.sql.gz files and split folders) still expire after 7 days.
+            find "$BACKUP_DIR" -maxdepth 1 -name "auto_backup_*" -mtime +7 -exec rm -rf {} + > /dev/null 2>&1
+            echo -e "${GREEN}Snapshot stored in $BACKUP_REPO_DIR and sent successfully.${NC}"
+            return 0
         fi
-        
-        "$PYTHON_VENV_EXEC" "$INSTALL_DIR/send_file.py" "$filepath" "$caption"
-        
-        if [ "$backup_type" == "instant" ]; then
-            read -p "Do you want to delete the local backup file after sending? (y/N): " choice
-            if [[ "$choice" =~ ^[Yy]$ ]]; then
-                rm "$filepath"
-                echo "Local backup file deleted."
-            fi
-        else
-            rm "$filepath"
-            find "$BACKUP_DIR" -name "auto_backup_*.sql.gz" -mtime +7 -delete > /dev/null 2>&1
+        echo -e "${RED}Backup creation failed.${NC}"
+        return 1
+    fi
+    
+    echo "Creating database backup and sending it to Telegram..."
+    if "$PYTHON_VENV_EXEC" "$INSTALL_DIR/backup.py" create "$backup_path" "$caption" "$DB_USER" "$DB_NAME" "$DUMP_FORMAT"; then
+        echo -e "${GREEN}Backup created and sent successfully ($backup_path).${NC}"
+        read -p "Do you want to delete the local backup files after sending? (y/N): " choice
+        if [[ "$choice" =~ ^[Yy]$ ]]; then
+            rm -rf "$backup_path"
+            echo "Local backup files deleted."
         fi
-        
         return 0
     else
         echo -e "${RED}Backup creation failed.${NC}"
-        rm -f "$filepath"
+        rm -rf "$backup_path"
         return 1
     fi
 }
@@ -198,9 +205,11 @@ restore_backup() {
     echo -e "${RED}WARNING: This action will completely overwrite your current database.${NC}"
     echo -e "${RED}It is STRONGLY recommended to take an 'Instant Backup' before proceeding.${NC}"
     echo
-    read -p "Please enter the full path to the backup file (e.g., /path/to/backup.sql.gz): " backup_file
+    echo "Auto backups are snapshots in $BACKUP_REPO_DIR/snapshots (*.snapshot.json)."
+    echo "For a backup downloaded from Telegram, put all its parts/packs and its manifest in one folder."
+    read -p "Please enter the path to the snapshot, manifest or backup folder (or an old .sql.gz file): " backup_file
     
-    if [ ! -f "$backup_file" ]; then
+    if [ ! -e "$backup_file" ]; then
         echo -e "${RED}Error: File not found at the specified path.${NC}"
         pause
         return
@@ -225,7 +234,7 @@ restore_backup() {
     docker exec remnawave-db createdb -U "$DB_USER" "$DB_NAME"
     
     echo "Restoring database... This may take a moment."
-    gunzip < "$backup_file" | docker exec -i remnawave-db psql -U "$DB_USER" -d "$DB_NAME"
+    "$PYTHON_VENV_EXEC" "$INSTALL_DIR/backup.py" restore "$backup_file" "$DB_USER" "$DB_NAME"
     
     if [ $? -eq 0 ]; then
         echo -e "${GREEN}Database restored successfully.${NC}"
@@ -261,11 +270,25 @@ backup_menu() {
     done
 }
 
+read_bot_config() {
+    echo -e "${YELLOW}Please provide your bot configuration:${NC}"
+    bot_token=""
+    while [ -z "$bot_token" ]; do
+        read -p "Enter your BotFather API Token: " bot_token
+    done
+    admin_id=""
+    while [[ ! "$admin_id" =~ ^[0-9]+$ ]]; do
+        read -p "Enter your admin Telegram User ID: " admin_id
+    done
+    read -p "Enter your Remna panel URL (e.g., https://panel.domain.com): " panel_url
+    read -p "Enter your Remna panel API Token: " panel_api_token
+}
+
 install_bot() {
     check_root
     if [ -d "$INSTALL_DIR" ]; then
         echo -e "${YELLOW}Existing installation found. Updating bot files and dependencies...${NC}"
-        "$INSTALL_DIR/venv/bin/pip" install "python-telegram-bot[ext]" requests "qrcode[pil]" flask "urllib3" pycryptodome >/dev/null 2>&1
+        "$INSTALL_DIR/venv/bin/pip" install "python-telegram-bot[ext]" requests "qrcode[pil]" flask "urllib3" pycryptodome zstandard >/dev/null 2>&1
     else
         echo -e "${GREEN}Starting Remna Bot installation...${NC}"
         apt-get update >/dev/null 2>&1
@@ -274,30 +297,45 @@ install_bot() {
         mkdir -p "$INSTALL_DIR"
         python3 -m venv "$INSTALL_DIR/venv"
         echo "Virtual environment created at $INSTALL_DIR/venv."
-        "$INSTALL_DIR/venv/bin/pip" install "python-telegram-bot[ext]" requests "qrcode[pil]" flask "urllib3" pycryptodome >/dev/null 2>&1
+        "$INSTALL_DIR/venv/bin/pip" install "python-telegram-bot[ext]" requests "qrcode[pil]" flask "urllib3" pycryptodome zstandard >/dev/null 2>&1
         echo "Python packages installed."
-        echo -e "${YELLOW}Please provide your bot configuration:${NC}"
-        read -p "Enter your BotFather API Token: " bot_token
-        read -p "Enter your admin Telegram User ID: " admin_id
-        read -p "Enter your Remna panel URL (e.g., https://panel.domain.com): " panel_url
-        read -p "Enter your Remna panel API Token: " panel_api_token
-        cat << EOF > "$CONFIG_FILE"
-# config.py
-TELEGRAM_BOT_TOKEN = '$bot_token'
-PANEL_URL = '$panel_url'
-PANEL_API_TOKEN = '$panel_api_token'
-ADMIN_USER_ID = $admin_id
-NODES = {}
-EOF
-        chmod 660 "$CONFIG_FILE"
-        echo "Configuration file created."
+        read_bot_config
     fi
 
     echo "Downloading bot files from GitHub..."
     curl -sL "${RAW_GITHUB_URL}/bot.py" -o "$INSTALL_DIR/bot.py"
     curl -sL "${RAW_GITHUB_URL}/locales.json" -o "$INSTALL_DIR/locales.json"
     curl -sL "${RAW_GITHUB_URL}/config_manager.py" -o "$INSTALL_DIR/config_manager.py"
+    curl -sL "${RAW_GITHUB_URL}/config_store.py" -o "$INSTALL_DIR/config_store.py"
     curl -sL "${RAW_GITHUB_URL}/send_file.py" -o "$INSTALL_DIR/send_file.py"
+    curl -sL "${RAW_GITHUB_URL}/backup.py" -o "$INSTALL_DIR/backup.py"
+    curl -sL "${RAW_GITHUB_URL}/docker_api.py" -o "$INSTALL_DIR/docker_api.py"
+    curl -sL "${RAW_GITHUB_URL}/hyperloglog.py" -o "$INSTALL_DIR/hyperloglog.py"
+    curl -sL "${RAW_GITHUB_URL}/metrics.py" -o "$INSTALL_DIR/metrics.py"
+    curl -sL "${RAW_GITHUB_URL}/profiler.py" -o "$INSTALL_DIR/profiler.py"
+    curl -sL "${RAW_GITHUB_URL}/loop_watchdog.py" -o "$INSTALL_DIR/loop_watchdog.py"
+    curl -sL "${RAW_GITHUB_URL}/handler_timing.py" -o "$INSTALL_DIR/handler_timing.py"
+    curl -sL "${RAW_GITHUB_URL}/bulk_targets.py" -o "$INSTALL_DIR/bulk_targets.py"
+    # Precompile so restarts load cached bytecode instead of compiling bot.py every time
+    "$PYTHON_VENV_EXEC" -m compileall -q "$INSTALL_DIR"/*.py
+
+    if [ ! -f "$CONFIG_FILE" ]; then
+        if [ -f "$INSTALL_DIR/config.py" ]; then
+            # Older installations kept the configuration as Python source
+            "$PYTHON_VENV_EXEC" "$INSTALL_DIR/config_manager.py" migrate
+        else
+            if [ -z "$bot_token" ]; then
+                # An update of a folder that never got a configuration (e.g. an install interrupted before this step)
+                echo -e "${YELLOW}No configuration found in $INSTALL_DIR.${NC}"
+                read_bot_config
+            fi
+            if ! "$PYTHON_VENV_EXEC" "$INSTALL_DIR/config_manager.py" init "$bot_token" "$admin_id" "$panel_url" "$panel_api_token"; then
+                echo -e "${RED}Could not create $CONFIG_FILE. Fix the values above and run the installer again.${NC}"
+                pause
+                return 1
+            fi
+        fi
+    fi
     
     cat << 'EOF' > "$INSTALL_DIR/settings.json"
 {"language": "en"}
@@ -312,13 +350,16 @@ After=network.target
 User=root
 Group=root
 WorkingDirectory=$INSTALL_DIR
-ExecStart=$PYTHON_VENV_EXEC $INSTALL_DIR/bot.py
+ExecStart=$PYTHON_VENV_EXEC -c "import bot; bot.main()"
 Restart=always
 RestartSec=10
 [Install]
 WantedBy=multi-user.target
 EOF
         echo "Systemd service file created."
+    else
+        # Older service files ran bot.py as a script, which is recompiled on every start
+        sed -i "s|^ExecStart=.*/bot.py$|ExecStart=$PYTHON_VENV_EXEC -c \"import bot; bot.main()\"|" "$BOT_SERVICE_FILE"
     fi
 
     echo "Reloading, enabling and restarting the bot service..."
@@ -367,11 +408,7 @@ update_api_token() {
         return
     fi
     
-    sed -i "s|^PANEL_API_TOKEN[[:space:]]*=.*|PANEL_API_TOKEN = '$new_api_token'|g" "$CONFIG_FILE"
-    
-    echo -e "${GREEN}API Token updated successfully.${NC}"
-    echo "Restarting bot to apply changes..."
-    systemctl restart "$BOT_SERVICE_NAME"
+    "$PYTHON_VENV_EXEC" "$INSTALL_DIR/config_manager.py" set PANEL_API_TOKEN "$new_api_token"
     pause
 }
 # ------------------------------------
@@ -411,8 +448,6 @@ add_local_node() {
         return
     fi
     "$PYTHON_VENV_EXEC" "$INSTALL_DIR/config_manager.py" add_local "$node_name"
-    echo "Restarting bot to apply changes..."
-    systemctl restart "$BOT_SERVICE_NAME"
     pause
 }
 
@@ -446,10 +481,10 @@ configure_remote_server() {
     check_root
     echo -e "${YELLOW}--- Configuring this server as a Remote Log/Restart Node ---${NC}"
     apt-get update >/dev/null 2>&1
-    apt-get install -y python3 python3-venv python3-pip openssl >/dev/null 2>&1
+    apt-get install -y python3 python3-venv python3-pip openssl curl >/dev/null 2>&1
     mkdir -p "$LOG_SERVER_DIR"
     python3 -m venv "$LOG_SERVER_DIR/venv"
-    "$LOG_SERVER_DIR/venv/bin/pip" install flask >/dev/null 2>&1
+    "$LOG_SERVER_DIR/venv/bin/pip" install aiohttp >/dev/null 2>&1
     echo "Environment created."
     if [ -f "$LOG_SERVER_DIR/config.json" ]; then
         SECRET_TOKEN=$(grep -oP '"SECRET_TOKEN": "\K[^"]+' "$LOG_SERVER_DIR/config.json")
@@ -457,45 +492,10 @@ configure_remote_server() {
         SECRET_TOKEN=$(openssl rand -hex 16)
         echo "{\"SECRET_TOKEN\": \"$SECRET_TOKEN\"}" > "$LOG_SERVER_DIR/config.json"
     fi
-    cat << EOF > "$LOG_SERVER_DIR/log_server.py"
-from flask import Flask, request, jsonify
-import subprocess, json
-app = Flask(__name__)
-with open('config.json', 'r') as f:
-    config = json.load(f)
-SECRET_TOKEN = config['SECRET_TOKEN']
-DOCKER_CONTAINER_NAME = "remnanode"
-LOG_PATH_IN_CONTAINER = "/var/log/supervisor/xray.out.log"
-LOG_LINES_TO_FETCH = 30
-NODE_DIR = "/opt/remnanode"
-def check_auth():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or auth_header != f"Bearer {SECRET_TOKEN}":
-        return False
-    return True
-@app.route('/logs', methods=['GET'])
-def get_xray_logs():
-    if not check_auth(): return jsonify({"error": "Unauthorized"}), 401
-    command = [ "docker", "exec", DOCKER_CONTAINER_NAME, "tail", f"-n{LOG_LINES_TO_FETCH}", LOG_PATH_IN_CONTAINER ]
-    try:
-        result = subprocess.run( command, capture_output=True, text=True, check=True, encoding='utf-8' )
-        return jsonify({"logs": result.stdout.strip()})
-    except Exception as e:
-        return jsonify({"error": "Failed to get logs from container.", "details": str(e)}), 500
-@app.route('/restart', methods=['POST'])
-def restart_node():
-    if not check_auth(): return jsonify({"error": "Unauthorized"}), 401
-    command = f"cd {NODE_DIR} && docker compose down && docker compose up -d && sleep 5 && docker compose logs --tail=20"
-    try:
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True, encoding='utf-8')
-        return jsonify({"status": "success", "logs": result.stdout.strip()})
-    except subprocess.CalledProcessError as e:
-        return jsonify({"status": "error", "details": e.stderr.strip()}), 500
-    except Exception as e:
-        return jsonify({"status": "error", "details": str(e)}), 500
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5555)
-EOF
+    curl -sL "${RAW_GITHUB_URL}/log_server.py" -o "$LOG_SERVER_DIR/log_server.py"
+    curl -sL "${RAW_GITHUB_URL}/access_log.py" -o "$LOG_SERVER_DIR/access_log.py"
+    curl -sL "${RAW_GITHUB_URL}/hyperloglog.py" -o "$LOG_SERVER_DIR/hyperloglog.py"
+    curl -sL "${RAW_GITHUB_URL}/log_segments.py" -o "$LOG_SERVER_DIR/log_segments.py"
     echo "Log server script created/updated."
     cat << EOF > "$LOG_SERVICE_FILE"
 [Unit]
@@ -536,8 +536,6 @@ add_remote_to_config() {
         return
     fi
     "$PYTHON_VENV_EXEC" "$INSTALL_DIR/config_manager.py" add_remote "$node_name" "$node_ip" "$node_token"
-    echo "Restarting bot to apply changes..."
-    systemctl restart "$BOT_SERVICE_NAME"
     pause
 }
 
@@ -553,8 +551,6 @@ remove_node() {
         return
     fi
     "$PYTHON_VENV_EXEC" "$INSTALL_DIR/config_manager.py" remove "$node_to_remove"
-    echo "Restarting bot to apply changes..."
-    systemctl restart "$BOT_SERVICE_NAME"
     pause
 }
 
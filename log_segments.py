@@ -0,0 +1,251 @@
+# log_segments.py
+# Keeps a searchable copy of the xray access log on the node: lines are appended
+# to segment files which are compressed and indexed when they are rotated, so a
+# search only has to open the segments that can contain the searched term.
+import base64, gzip, json, math, os, threading, time
+from hashlib import blake2b
+from access_log import parse_access_line
+
+SEGMENT_MAX_BYTES = 16 * 1024 * 1024
+SEGMENT_MAX_SECONDS = 3600
+SEGMENT_RETENTION_DAYS = 7
+SEGMENT_MAX_TOTAL_BYTES = 2 * 1024 * 1024 * 1024
+# Each closed segment's filter is sized for its own number of distinct terms:
+# a busy node can index 100k of them in one segment, a quiet one a few hundred.
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+BLOOM_MIN_BITS = 1 << 10
+
+
+class BloomFilter:
+    """Set membership with false positives but no false negatives, in a fixed number of bits."""
+
+    def __init__(self, bits: int, hashes: int, data: bytes | None = None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data) if data is not None else bytearray(math.ceil(bits / 8))
+
+    @classmethod
+    def for_terms(cls, count: int, rate: float = BLOOM_FALSE_POSITIVE_RATE) -> 'BloomFilter':
+        """The smallest filter that holds `count` terms at the given false-positive rate."""
+        bits = max(BLOOM_MIN_BITS, math.ceil(-count * math.log(rate) / math.log(2) ** 2))
+        bits = -(-bits // 8) * 8
+        return cls(bits, max(1, round(bits / max(count, 1) * math.log(2))))
+
+    def _positions(self, term: str):
+        digest = blake2b(term.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, term: str):
+        for pos in self._positions(term):
+            self.data[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, term: str) -> bool:
+        return all(self.data[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(term))
+
+
+def index_terms(entry: dict):
+    """Terms a line can be found by: the user's email, the client IP and the destination host."""
+    return (term for term in (entry['email'], entry['source'], entry['destination']) if term)
+
+
+class SegmentIndex:
+    """
+    Time range, line count and bloom filter of the terms of one segment. The open
+    segment is not indexed (bloom is None) and is always scanned; its index is
+    built when it is closed, once the number of distinct terms is known.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.first_ts = None
+        self.last_ts = None
+        self.lines = 0
+        self.terms = 0
+        self.bloom = None
+
+    def build(self, lines):
+        """Indexes the segment's lines: collects the distinct terms, then sizes the filter for them."""
+        terms = set()
+        for line in lines:
+            self.lines += 1
+            entry = parse_access_line(line)
+            if not entry:
+                continue
+            if self.first_ts is None: self.first_ts = entry['ts']
+            self.last_ts = entry['ts']
+            terms.update(index_terms(entry))
+        self.terms = len(terms)
+        self.bloom = BloomFilter.for_terms(len(terms))
+        for term in terms:
+            self.bloom.add(term)
+
+    def may_contain(self, term: str, start: int | None, end: int | None) -> bool:
+        if self.bloom is None:
+            return True
+        if self.first_ts is None:
+            return False
+        return ((start is None or self.last_ts >= start) and (end is None or self.first_ts <= end)
+                and term in self.bloom)
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'first_ts': self.first_ts, 'last_ts': self.last_ts, 'lines': self.lines,
+                'terms': self.terms, 'bloom_bits': self.bloom.bits, 'bloom_hashes': self.bloom.hashes,
+                'bloom': base64.b64encode(bytes(self.bloom.data)).decode()}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        index = cls(data['name'])
+        index.first_ts, index.last_ts, index.lines = data['first_ts'], data['last_ts'], data['lines']
+        index.terms = data.get('terms', 0)
+        index.bloom = BloomFilter(data['bloom_bits'], data['bloom_hashes'], base64.b64decode(data['bloom']))
+        return index
+
+
+class SegmentStore:
+    """
+    Segment files in `directory`: the open segment `<name>.log` and closed ones
+    `<name>.log.gz` with their index `<name>.idx.json`. Segment names are the
+    creation time, so sorting them by name sorts them by age.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.closed = {}
+        self.current = None
+        self.current_file = None
+        self.current_started = 0
+        self.lock = threading.Lock()
+        for filename in os.listdir(directory):
+            if filename.endswith('.idx.json'):
+                try:
+                    with open(os.path.join(directory, filename)) as f:
+                        index = SegmentIndex.from_dict(json.load(f))
+                    self.closed[index.name] = index
+                except (OSError, ValueError, KeyError):
+                    continue
+        for filename in os.listdir(directory):
+            if filename.endswith('.log'):
+                # بخش باز از اجرای قبلی؛ همان‌جا بسته و ایندکس می‌شود
+                self._close_segment(filename[:-4])
+
+    def path(self, name: str, suffix: str) -> str:
+        return os.path.join(self.directory, name + suffix)
+
+    def append(self, lines: list):
+        if not lines:
+            return
+        with self.lock:
+            self._append(lines)
+
+    def _append(self, lines: list):
+        if self.current is None:
+            name = time.strftime('%Y%m%d-%H%M%S', time.gmtime())
+            while name in self.closed: name += "_"
+            self.current = SegmentIndex(name)
+            self.current_file = open(self.path(name, '.log'), 'a', encoding='utf-8')
+            self.current_started = time.time()
+        self.current_file.write("".join(line + "\n" for line in lines))
+        self.current_file.flush()
+        if self.current_file.tell() >= SEGMENT_MAX_BYTES or time.time() - self.current_started >= SEGMENT_MAX_SECONDS:
+            self._rotate()
+
+    def rotate(self):
+        with self.lock:
+            self._rotate()
+
+    def _rotate(self):
+        """Closes the open segment: compresses it, writes its index and applies retention."""
+        if self.current is None:
+            return
+        self.current_file.close()
+        name = self.current.name
+        self.current = self.current_file = None
+        self._close_segment(name)
+        self.apply_retention()
+
+    def _close_segment(self, name: str):
+        raw_path = self.path(name, '.log')
+        index = SegmentIndex(name)
+        with open(raw_path, 'rb') as src, gzip.open(self.path(name, '.log.gz'), 'wb') as dst:
+            def lines():
+                for raw in src:
+                    dst.write(raw)
+                    yield raw.decode('utf-8', errors='replace').rstrip('\n')
+            index.build(lines())
+        tmp_path = self.path(name, '.idx.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(index.to_dict(), f)
+        os.replace(tmp_path, self.path(name, '.idx.json'))
+        os.remove(raw_path)
+        self.closed[name] = index
+
+    def apply_retention(self):
+        cutoff = time.strftime('%Y%m%d-%H%M%S', time.gmtime(time.time() - SEGMENT_RETENTION_DAYS * 86400))
+        names = sorted(self.closed)
+        total = sum(os.path.getsize(self.path(n, '.log.gz')) for n in names if os.path.exists(self.path(n, '.log.gz')))
+        for name in names:
+            if name >= cutoff and total <= SEGMENT_MAX_TOTAL_BYTES:
+                break
+            gz_path = self.path(name, '.log.gz')
+            if os.path.exists(gz_path):
+                total -= os.path.getsize(gz_path)
+                os.remove(gz_path)
+            if os.path.exists(self.path(name, '.idx.json')):
+                os.remove(self.path(name, '.idx.json'))
+            del self.closed[name]
+
+    def search(self, term: str, start: int | None = None, end: int | None = None, cursor: str | None = None, limit: int = 50) -> dict:
+        """
+        Returns the lines containing `term`, newest first. Closed segments whose time
+        range or bloom filter excludes the term are not opened. `cursor` continues a
+        previous search: "<segment>:<matches of that segment not returned yet>", counted
+        from the oldest line so that lines appended to the open segment do not shift it.
+        Every hit carries the cursor that starts a search at that hit, so a client
+        that shows only part of a page can continue from the first hit it left out.
+        """
+        cursor_segment, cursor_remaining = None, 0
+        if cursor:
+            cursor_segment, _, remaining = cursor.rpartition(':')
+            cursor_remaining = int(remaining)
+
+        with self.lock:
+            indexes = sorted(self.closed.values(), key=lambda i: i.name, reverse=True)
+            if self.current is not None:
+                indexes.insert(0, self.current)
+
+        hits, scanned, skipped = [], 0, 0
+        for index in indexes:
+            if cursor_segment and index.name > cursor_segment:
+                continue
+            if not index.may_contain(term, start, end):
+                skipped += 1
+                continue
+            scanned += 1
+            matches = self._scan(index, term, start, end)
+            remaining = min(cursor_remaining, len(matches)) if index.name == cursor_segment else len(matches)
+            for i in range(remaining - 1, -1, -1):
+                if len(hits) >= limit:
+                    return {'hits': hits, 'next': f"{index.name}:{i + 1}", 'scanned': scanned, 'skipped': skipped}
+                ts, line = matches[i]
+                hits.append({'ts': ts, 'line': line, 'cursor': f"{index.name}:{i + 1}"})
+        return {'hits': hits, 'next': None, 'scanned': scanned, 'skipped': skipped}
+
+    def _scan(self, index: SegmentIndex, term: str, start: int | None, end: int | None) -> list:
+        if index is self.current:
+            opener = lambda: open(self.path(index.name, '.log'), 'r', encoding='utf-8', errors='replace')
+        else:
+            opener = lambda: gzip.open(self.path(index.name, '.log.gz'), 'rt', encoding='utf-8', errors='replace')
+        matches = []
+        try:
+            with opener() as f:
+                for line in f:
+                    if term not in line: continue
+                    entry = parse_access_line(line.rstrip('\n'))
+                    if not entry or term not in index_terms(entry): continue
+                    if (start is not None and entry['ts'] < start) or (end is not None and entry['ts'] > end): continue
+                    matches.append((entry['ts'], line.rstrip('\n')))
+        except FileNotFoundError:
+            pass
+        return matches
@@ -0,0 +1,499 @@
+# log_server.py
+# Remote node agent: serves xray logs and node restarts to the bot.
+import asyncio, base64, json, logging, time
+from collections import deque
+from itertools import islice
+from aiohttp import web
+from access_log import AccessLogAggregator
+from hyperloglog import DEFAULT_PRECISION
+from log_segments import SegmentStore
+
+logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+logger = logging.getLogger("log_server")
+
+with open('config.json', 'r') as f:
+    config = json.load(f)
+
+SECRET_TOKEN = config['SECRET_TOKEN']
+DOCKER_CONTAINER_NAME = "remnanode"
+LOG_PATH_IN_CONTAINER = "/var/log/supervisor/xray.out.log"
+LOG_LINES_TO_FETCH = 30
+MAX_LINES_PER_RESPONSE = 1000
+RING_BUFFER_LINES = int(config.get('RING_BUFFER_LINES', 5000))
+FOLLOWER_BACKLOG_BYTES = RING_BUFFER_LINES * 300  # history read into the ring buffer at start
+FOLLOWER_ROTATION_CHECK_SECONDS = 5
+FOLLOWER_ROTATED = 3  # exit code of the follower script when the file was replaced or truncated
+FOLLOWER_MAX_LINE_BYTES = 1024 * 1024
+STREAM_QUEUE_SIZE = 2000
+STREAM_HEARTBEAT_SECONDS = 15
+ACCESS_LOG_PATH = config.get('ACCESS_LOG_PATH', LOG_PATH_IN_CONTAINER)
+ACCESS_STATE_FILE = "state.json"
+ACCESS_INITIAL_BACKFILL_BYTES = 8 * 1024 * 1024
+ACCESS_SNAPSHOT_SECONDS = 60
+SEGMENT_FLUSH_SECONDS = 1
+SEGMENT_FLUSH_LINES = 1000
+SEGMENTS_DIR = config.get('SEGMENTS_DIR', "segments")
+MAX_SEARCH_RESULTS = 200
+NODE_DIR = "/opt/remnanode"
+PORT = 5555
+
+
+class LogRingBuffer:
+    """
+    Keeps the newest log lines in memory, each with a sequential id that clients
+    use as a cursor. Ids start at the agent's start time in milliseconds, so a
+    cursor handed out by a previous run is always older than the current lines.
+    """
+
+    def __init__(self, maxlen: int):
+        self.lines = deque(maxlen=maxlen)
+        self.next_id = int(time.time() * 1000)
+
+    @property
+    def last_id(self) -> int:
+        return self.next_id - 1
+
+    def append(self, line: str):
+        self.lines.append((self.next_id, line))
+        self.next_id += 1
+
+    def tail(self, limit: int) -> list:
+        return [line for _, line in islice(self.lines, max(len(self.lines) - limit, 0), None)]
+
+    def since(self, cursor: int, limit: int):
+        """
+        Returns (lines, reset) with the lines written after `cursor`. `reset` is True
+        when the result does not continue from the cursor (unknown or too old
+        cursor, or more than `limit` new lines), and then holds the newest lines.
+        """
+        if not self.lines:
+            return [], cursor != self.last_id
+        first_id = self.lines[0][0]
+        if cursor < first_id - 1 or cursor > self.last_id or self.last_id - cursor > limit:
+            return self.tail(limit), True
+        return [line for _, line in islice(self.lines, cursor - first_id + 1, None)], False
+
+
+class StreamSubscriber:
+    """
+    Pending events of one /events client. The queue is bounded: when a client
+    reads slower than the log is written, the oldest events are dropped and the
+    client is told how many it missed instead of the agent buffering without limit.
+    """
+
+    def __init__(self, maxlen: int):
+        self.items = deque()
+        self.maxlen = maxlen
+        self.dropped = 0
+        self.wakeup = asyncio.Event()
+
+    def push(self, item: tuple):
+        if len(self.items) >= self.maxlen:
+            self.items.popleft()
+            self.dropped += 1
+        self.items.append(item)
+        self.wakeup.set()
+
+
+buffer = LogRingBuffer(RING_BUFFER_LINES)
+aggregator = AccessLogAggregator(ACCESS_STATE_FILE)
+segments = SegmentStore(SEGMENTS_DIR)
+subscribers = set()
+follower_status = {"state": "starting", "since": int(time.time())}
+
+
+def publish_line(line: str):
+    buffer.append(line)
+    for sub in subscribers:
+        sub.push(('log', buffer.last_id, line))
+
+
+def publish_status(state: str, details: str = ""):
+    follower_status.update({"state": state, "since": int(time.time()), "details": details})
+    for sub in subscribers:
+        sub.push(('status', None, dict(follower_status)))
+
+
+# Runs in the container as the single `docker exec` behind a follower. It picks
+# where to start from the requested byte offset and inode (a negative offset means
+# "no saved offset": start <backfill> bytes before the end; an empty inode, as in
+# state saved by older agents, trusts the offset unless the file is shorter), prints
+# "<inode> <start> <from>" and streams the file from <from>, which is <backlog>
+# bytes before <start> so the ring buffer gets some history. It exits with
+# FOLLOWER_ROTATED when the file is replaced (new inode) or shrinks, so the
+# follower is restarted at the right place in the new file. tail's own messages
+# go into the stream in order: GNU tail says "file truncated" right before it
+# reads the file again from the start, which tells the agent where that is.
+FOLLOW_SCRIPT = (
+    'f="$0"; start="$1"; inode="$2"; backlog="$3"; backfill="$4"; '
+    'st=$(stat -c "%i %s" "$f") || exit 1; cur=${st% *}; size=${st#* }; '
+    'if [ "$start" -lt 0 ]; then start=$((size > backfill ? size - backfill : 0)); '
+    'elif { [ -n "$inode" ] && [ "$cur" != "$inode" ]; } || [ "$start" -gt "$size" ]; then start=0; fi; '
+    'from=$((start > backlog ? start - backlog : 0)); '
+    'echo "$cur $start $from"; '
+    'tail -c +$((from + 1)) -f "$f" & tail_pid=$!; trap \'kill $tail_pid 2>/dev/null\' EXIT; '
+    f'last=$size; while sleep {FOLLOWER_ROTATION_CHECK_SECONDS}; do '
+    'st=$(stat -c "%i %s" "$f" 2>/dev/null) || st=""; '
+    f'[ "${{st% *}}" = "$cur" ] && [ "${{st#* }}" -ge "$last" ] || exit {FOLLOWER_ROTATED}; last=${{st#* }}; '
+    'kill -0 $tail_pid 2>/dev/null || exit 1; done'
+)
+
+
+async def read_log_line(stream: asyncio.StreamReader):
+    """
+    Reads one line from the follower. Returns (line, bytes read); line is None
+    for a line longer than FOLLOWER_MAX_LINE_BYTES, which is skipped whole so
+    the byte position stays exact. At EOF returns the unterminated rest, or b"".
+    """
+    skipped = 0
+    while True:
+        try:
+            raw = await stream.readuntil(b"\n")
+            return (None if skipped else raw), skipped + len(raw)
+        except asyncio.LimitOverrunError as e:
+            skipped += len(await stream.readexactly(e.consumed))
+        except asyncio.IncompleteReadError as e:
+            return (None if skipped else e.partial), skipped + len(e.partial)
+
+
+async def follow_log(path: str, publish: bool, aggregate: bool):
+    """
+    Keeps one follower process on `path` open for the whole lifetime of the agent
+    and hands every line to the ring buffer (publish) and to the access log
+    aggregator and segment index (aggregate). The follower starts at a byte
+    offset chosen here, so the position of every line is known: aggregation
+    resumes exactly at the saved offset after an agent restart, and a follower
+    restarted because the container was recreated or the log was rotated
+    neither repeats nor skips lines.
+    """
+    position, inode = None, None  # where this process got to in the file, for restarts
+    while True:
+        if position is None:
+            requested = aggregator.offset if aggregate and aggregator.offset is not None else -1
+            inode, backlog = aggregator.inode if aggregate else None, FOLLOWER_BACKLOG_BYTES if publish else 0
+        else:
+            requested, backlog = position, 0
+        backfill = ACCESS_INITIAL_BACKFILL_BYTES if aggregate else 0
+        proc, pending, truncated = None, [], False
+
+        async def flush():
+            batch = pending[:]
+            pending.clear()
+            await asyncio.to_thread(segments.append, batch)
+
+        async def watch_diagnostics():
+            """tail reports on stderr; after 'file truncated' the positions counted here no longer match the file."""
+            nonlocal truncated
+            async for message in proc.stderr:
+                message = message.decode('utf-8', errors='replace').strip()
+                logger.warning(f"Follower of {path}: {message}")
+                if 'truncated' in message:
+                    truncated = True
+
+        diagnostics = None
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "docker", "exec", DOCKER_CONTAINER_NAME, "sh", "-c", FOLLOW_SCRIPT, path,
+                str(requested), inode or "", str(backlog), str(backfill),
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, limit=FOLLOWER_MAX_LINE_BYTES
+            )
+            diagnostics = asyncio.create_task(watch_diagnostics())
+            header = (await proc.stdout.readline()).split()
+            if len(header) == 3:
+                inode, start, pos = header[0].decode(), int(header[1]), int(header[2])
+                if publish: publish_status("up")
+                # only a saved offset is known to be at the start of a line
+                partial = pos > 0 and not (pos == start == requested)
+                while True:
+                    read = read_log_line(proc.stdout)
+                    try:
+                        raw, size = await (asyncio.wait_for(read, SEGMENT_FLUSH_SECONDS) if pending else read)
+                    except asyncio.TimeoutError:
+                        await flush()
+                        continue
+                    if not size or truncated: break
+                    line_start, pos = pos, pos + size
+                    position = pos
+                    if raw is None:
+                        logger.warning(f"Skipped a line of {size} bytes in {path} (over {FOLLOWER_MAX_LINE_BYTES})")
+                        partial = False
+                        if aggregate and line_start >= start:
+                            aggregator.offset, aggregator.inode, aggregator.dirty = pos, inode, True
+                        continue
+                    if partial:
+                        partial = False
+                        continue
+                    line = raw.decode('utf-8', errors='replace').rstrip('\n')
+                    if publish: publish_line(line)
+                    if aggregate and line_start >= start:
+                        aggregator.feed(line)
+                        aggregator.offset, aggregator.inode, aggregator.dirty = pos, inode, True
+                        pending.append(line)
+                        if len(pending) >= SEGMENT_FLUSH_LINES: await flush()
+            if proc.returncode is None: proc.kill()
+            await proc.wait()
+            diagnostics.cancel()
+            if pending: await flush()
+            if truncated:
+                # the file was emptied in place (copytruncate); lines read since then may be fed again
+                logger.info(f"{path} was truncated, following it from the start")
+                position = 0
+                continue
+            if proc.returncode == FOLLOWER_ROTATED:
+                logger.info(f"{path} was rotated, following the new file")
+                continue
+            logger.warning(f"Follower of {path} exited with code {proc.returncode}, restarting...")
+            if publish: publish_status("down", f"follower exited with code {proc.returncode}")
+        except asyncio.CancelledError:
+            if proc and proc.returncode is None: proc.kill()
+            if diagnostics: diagnostics.cancel()
+            if pending: segments.append(pending)
+            raise
+        except Exception as e:
+            if proc and proc.returncode is None: proc.kill()
+            if diagnostics: diagnostics.cancel()
+            logger.error(f"Follower of {path} failed: {e}")
+            if publish: publish_status("down", str(e))
+        await asyncio.sleep(5)
+
+
+async def follow_xray_log():
+    """The xray log follower; it also feeds the aggregator when the access log is the same file."""
+    await follow_log(LOG_PATH_IN_CONTAINER, publish=True, aggregate=ACCESS_LOG_PATH == LOG_PATH_IN_CONTAINER)
+
+
+async def save_aggregates():
+    state = aggregator.state()  # taken on the loop, where the follower changes the aggregates
+    aggregator.dirty = False
+    await asyncio.to_thread(aggregator.write, state)
+
+
+async def aggregate_access_log():
+    """
+    Snapshots the access log aggregates periodically. The lines come from the xray
+    log follower, or from a follower of its own when ACCESS_LOG_PATH is another file.
+    """
+    follower = None
+    if ACCESS_LOG_PATH != LOG_PATH_IN_CONTAINER:
+        follower = asyncio.create_task(follow_log(ACCESS_LOG_PATH, publish=False, aggregate=True))
+    try:
+        while True:
+            await asyncio.sleep(ACCESS_SNAPSHOT_SECONDS)
+            if aggregator.dirty:
+                await save_aggregates()
+    finally:
+        if follower: follower.cancel()
+        if aggregator.dirty:
+            aggregator.save()
+
+
+def json_response(data: dict, request: web.Request, status: int = 200) -> web.Response:
+    response = web.json_response(data, status=status)
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.enable_compression(web.ContentCoding.gzip)
+    return response
+
+
+@web.middleware
+async def auth_middleware(request: web.Request, handler):
+    if request.headers.get('Authorization') != f"Bearer {SECRET_TOKEN}":
+        return web.json_response({"error": "Unauthorized"}, status=401)
+    return await handler(request)
+
+
+async def get_xray_logs(request: web.Request) -> web.Response:
+    try:
+        limit = int(request.query.get('limit', LOG_LINES_TO_FETCH))
+        since = int(request.query['since']) if 'since' in request.query else None
+    except ValueError:
+        return web.json_response({"error": "since and limit must be integers."}, status=400)
+    limit = max(1, min(limit, MAX_LINES_PER_RESPONSE))
+
+    if since is None:
+        lines, reset = buffer.tail(limit), True
+    else:
+        lines, reset = buffer.since(since, limit)
+    return json_response({"logs": "\n".join(lines), "cursor": buffer.last_id, "reset": reset}, request)
+
+
+def format_sse(event: str, data: str = "", event_id: int | None = None) -> str:
+    message = f"id: {event_id}\n" if event_id is not None else ""
+    message += f"event: {event}\n"
+    for line in (data.split("\n") if data else [""]):
+        message += f"data: {line.replace(chr(13), '')}\n"
+    return message + "\n"
+
+
+async def stream_events(request: web.Request) -> web.StreamResponse:
+    """
+    Server-sent events: `log` events carry new log lines (the event id is the
+    line cursor, so reconnecting with Last-Event-ID resumes without gaps),
+    `status` events report the log follower going up or down, and `reset`
+    tells the client the following lines do not continue its previous cursor.
+    """
+    since = request.query.get('since', request.headers.get('Last-Event-ID'))
+    try:
+        since = int(since) if since is not None else None
+        limit = max(1, min(int(request.query.get('limit', LOG_LINES_TO_FETCH)), MAX_LINES_PER_RESPONSE))
+    except ValueError:
+        return web.json_response({"error": "since and limit must be integers."}, status=400)
+
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+    await response.prepare(request)
+
+    sub = StreamSubscriber(STREAM_QUEUE_SIZE)
+    subscribers.add(sub)
+    try:
+        cursor = buffer.last_id
+        message = format_sse('status', json.dumps(follower_status))
+        if since is not None:
+            lines, reset = buffer.since(since, limit)
+            if reset: message += format_sse('reset')
+            if lines: message += format_sse('log', "\n".join(lines), cursor)
+        await response.write(message.encode('utf-8'))
+
+        while True:
+            try:
+                await asyncio.wait_for(sub.wakeup.wait(), timeout=STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                await response.write(b": ping\n\n")
+                continue
+            sub.wakeup.clear()
+
+            message, batch, last_id = "", [], None
+            if sub.dropped:
+                message += format_sse('dropped', str(sub.dropped))
+                sub.dropped = 0
+            while sub.items:
+                kind, event_id, payload = sub.items.popleft()
+                if kind == 'log':
+                    if event_id <= cursor: continue
+                    batch.append(payload); last_id = event_id
+                else:
+                    if batch: message += format_sse('log', "\n".join(batch), last_id); batch = []
+                    message += format_sse(kind, json.dumps(payload))
+            if batch: message += format_sse('log', "\n".join(batch), last_id)
+            if last_id is not None: cursor = last_id
+            if message:
+                await response.write(message.encode('utf-8'))
+    except ConnectionResetError:
+        pass
+    finally:
+        subscribers.discard(sub)
+    return response
+
+
+async def get_access_stats(request: web.Request) -> web.Response:
+    try:
+        hours = max(1, min(int(request.query.get('hours', 1)), aggregator.retention_hours))
+        top = max(1, min(int(request.query.get('top', 10)), 50))
+    except ValueError:
+        return web.json_response({"error": "hours and top must be integers."}, status=400)
+    return json_response(aggregator.summary(hours, top), request)
+
+
+async def get_ip_sketches(request: web.Request) -> web.Response:
+    """Per-user HyperLogLog sketches of source IPs over the last `hours`, for the bot to merge across nodes."""
+    try:
+        hours = max(1, min(int(request.query.get('hours', 24)), aggregator.retention_hours))
+    except ValueError:
+        return web.json_response({"error": "hours must be an integer."}, status=400)
+    sketches = aggregator.ip_sketch_window(hours)
+    if request.query.get('sparse') == '1':
+        # most users come from a handful of IPs, so most sketches are a few non-zero registers
+        dense, sparse = {}, {}
+        for email, sketch in sketches.items():
+            registers = sketch.to_sparse()
+            if len(registers) < sketch.m:
+                sparse[email] = base64.b64encode(registers).decode()
+            else:
+                dense[email] = base64.b64encode(sketch.to_bytes()).decode()
+        return json_response({"precision": DEFAULT_PRECISION, "hours": hours, "as_of": aggregator.latest_ts,
+                              "sketches": dense, "sparse": sparse}, request)
+    return json_response({
+        "precision": DEFAULT_PRECISION, "hours": hours, "as_of": aggregator.latest_ts,
+        "sketches": {email: base64.b64encode(sketch.to_bytes()).decode() for email, sketch in sketches.items()}
+    }, request)
+
+
+async def search_logs(request: web.Request) -> web.Response:
+    """Searches the log segments for an email, IP or destination host, newest first."""
+    term = request.query.get('q', '').strip()
+    if not term:
+        return web.json_response({"error": "q is required."}, status=400)
+    try:
+        start = int(request.query['from']) if 'from' in request.query else None
+        end = int(request.query['to']) if 'to' in request.query else None
+        limit = max(1, min(int(request.query.get('limit', 50)), MAX_SEARCH_RESULTS))
+    except ValueError:
+        return web.json_response({"error": "from, to and limit must be integers."}, status=400)
+    try:
+        result = await asyncio.to_thread(segments.search, term, start, end, request.query.get('cursor'), limit)
+    except ValueError:
+        return web.json_response({"error": "Invalid cursor."}, status=400)
+    return json_response(result, request)
+
+
+async def get_container_state() -> str:
+    proc = await asyncio.create_subprocess_exec(
+        "docker", "inspect", "-f", "{{.State.Status}}", DOCKER_CONTAINER_NAME,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        return "missing"
+    return stdout.decode().strip()
+
+
+async def get_node_status(request: web.Request) -> web.Response:
+    try:
+        container = await asyncio.wait_for(get_container_state(), timeout=5)
+    except Exception as e:
+        container = f"unknown ({str(e) or type(e).__name__})"
+    last_line = buffer.lines[-1][1] if buffer.lines else ""
+    return json_response({"container": container, "follower": follower_status, "last_line": last_line, "cursor": buffer.last_id}, request)
+
+
+async def restart_node(request: web.Request) -> web.Response:
+    command = f"cd {NODE_DIR} && docker compose down && docker compose up -d && sleep 5 && docker compose logs --tail=20"
+    try:
+        proc = await asyncio.create_subprocess_shell(command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await proc.communicate()
+        if proc.returncode != 0:
+            return json_response({"status": "error", "details": stderr.decode('utf-8', errors='replace').strip()}, request, status=500)
+        return json_response({"status": "success", "logs": stdout.decode('utf-8', errors='replace').strip()}, request)
+    except Exception as e:
+        return json_response({"status": "error", "details": str(e)}, request, status=500)
+
+
+async def start_background_tasks(app: web.Application):
+    aggregator.load()  # before the follower asks it for the saved offset
+    app['follower'] = asyncio.create_task(follow_xray_log())
+    app['aggregator'] = asyncio.create_task(aggregate_access_log())
+
+
+async def cleanup_background_tasks(app: web.Application):
+    for name in ('follower', 'aggregator'):
+        app[name].cancel()
+        try:
+            await app[name]
+        except asyncio.CancelledError:
+            pass
+
+
+def create_app() -> web.Application:
+    app = web.Application(middlewares=[auth_middleware])
+    app.router.add_get('/logs', get_xray_logs)
+    app.router.add_get('/events', stream_events)
+    app.router.add_get('/status', get_node_status)
+    app.router.add_get('/stats', get_access_stats)
+    app.router.add_get('/hll', get_ip_sketches)
+    app.router.add_get('/search', search_logs)
+    app.router.add_post('/restart', restart_node)
+    app.on_startup.append(start_background_tasks)
+    app.on_cleanup.append(cleanup_background_tasks)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host='0.0.0.0', port=PORT)
@@ -0,0 +1,134 @@
+# loop_watchdog.py
+# Measures how late the event loop wakes up and catches what blocks it. A
+# heartbeat coroutine sleeps for a fixed interval and records the overshoot as
+# loop lag. A monitor thread notices when the heartbeat is overdue and grabs
+# the loop thread's stack right then, while the blocking call is still on it.
+# Stalls are grouped by stack, so /lag can show which code paths block the
+# loop most.
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 0.1
+LAG_THRESHOLD = 0.25
+RECENT_SAMPLES = 3000  # five minutes of heartbeats
+MAX_OFFENDERS = 50
+STACK_DEPTH = 12
+
+
+def format_stack(frame, depth: int = STACK_DEPTH) -> list:
+    """Innermost first: 'file.py:line in function'."""
+    lines = []
+    while frame is not None and len(lines) < depth:
+        lines.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} in {frame.f_code.co_name}")
+        frame = frame.f_back
+    return lines
+
+
+class LoopWatchdog:
+    def __init__(self, threshold: float = LAG_THRESHOLD, interval: float = HEARTBEAT_INTERVAL):
+        self.threshold, self.interval = threshold, interval
+        self.lags = deque(maxlen=RECENT_SAMPLES)
+        self.samples = 0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.offenders = {}  # stack signature -> {'stack', 'count', 'total', 'max', 'last'}
+        self.since = time.time()
+        self.lock = threading.Lock()
+        self.last_beat = time.perf_counter()
+        self.pending_stack = None  # captured by the monitor thread during the current stall
+        self.loop_thread = None
+        self.task = None
+        self.monitor = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        self.loop_thread = threading.get_ident()
+        self.last_beat = time.perf_counter()
+        self.task = asyncio.create_task(self.heartbeat())
+        self.monitor = threading.Thread(target=self.watch, name='loop-watchdog', daemon=True)
+        self.monitor.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.task:
+            self.task.cancel()
+
+    async def heartbeat(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self.last_beat = now
+            self.record(max(0.0, now - started - self.interval))
+
+    def watch(self):
+        """
+        Monitor thread: captures the loop thread's stack once per stall, half way
+        to the threshold so short stalls are caught too. The stack is only kept
+        if the stall then turns out to pass the threshold.
+        """
+        captured_for = None
+        while not self.stopping.wait(self.threshold / 5):
+            beat = self.last_beat
+            if time.perf_counter() - beat < self.interval + self.threshold / 2 or captured_for == beat:
+                continue
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            with self.lock:
+                self.pending_stack = format_stack(frame)
+            captured_for = beat
+
+    def record(self, lag: float):
+        self.lags.append(lag)
+        self.samples += 1
+        self.max_lag = max(self.max_lag, lag)
+        with self.lock:
+            stack, self.pending_stack = self.pending_stack, None
+        if lag < self.threshold:
+            return
+        self.stalls += 1
+        stack = stack or ["(stack not captured)"]
+        key = tuple(stack[:6])
+        entry = self.offenders.get(key)
+        if entry is None:
+            if len(self.offenders) >= MAX_OFFENDERS:
+                # forget the offender that cost the least so far
+                del self.offenders[min(self.offenders, key=lambda k: self.offenders[k]['total'])]
+            entry = self.offenders[key] = {'stack': stack, 'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0}
+        entry['count'] += 1
+        entry['total'] += lag
+        entry['max'] = max(entry['max'], lag)
+        entry['last'] = time.time()
+        logger.warning(f"Event loop blocked for {lag * 1000:.0f} ms at:\n  " + "\n  ".join(stack))
+
+    def percentile(self, p: float) -> float:
+        if not self.lags: return 0.0
+        ordered = sorted(self.lags)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    def reset(self):
+        self.lags.clear()
+        self.samples = self.stalls = 0
+        self.max_lag = 0.0
+        self.offenders = {}
+        self.since = time.time()
+
+    def report(self, limit: int = 5) -> str:
+        lines = [f"since {time.strftime('%Y-%m-%d %H:%M', time.localtime(self.since))}, {self.samples} heartbeats",
+                 f"lag (last {len(self.lags)}): p50 {self.percentile(50) * 1000:.1f} ms, p90 {self.percentile(90) * 1000:.1f} ms, "
+                 f"p99 {self.percentile(99) * 1000:.1f} ms, max ever {self.max_lag * 1000:.0f} ms",
+                 f"stalls over {self.threshold * 1000:.0f} ms: {self.stalls}"]
+        worst = sorted(self.offenders.values(), key=lambda e: e['total'], reverse=True)[:limit]
+        for i, entry in enumerate(worst, 1):
+            lines.append(f"\n{i}) {entry['count']}x, max {entry['max'] * 1000:.0f} ms, total {entry['total']:.1f}s, "
+                         f"last {time.strftime('%H:%M:%S', time.localtime(entry['last']))}")
+            lines += [f"   {line}" for line in entry['stack'][:8]]
+        return "\n".join(lines)
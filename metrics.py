@@ -0,0 +1,229 @@
+# metrics.py
+# Latency histograms, status counters and traffic for every panel endpoint and
+# Bot API method the bot calls, so a slow bot can be traced to the panel, to
+# Telegram or to the bot itself. Shown by /stats and, when METRICS_PORT is set,
+# served on 127.0.0.1 in Prometheus text format.
+import asyncio
+import contextvars
+import re
+import threading
+import time
+from collections import Counter
+
+from telegram.request import HTTPXRequest
+
+# upper bounds in seconds; the last bucket catches everything slower
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+# Bot API calls that wait on purpose (up to the polling timeout); /stats lists them apart from the real cost
+LONG_POLL_CALLS = ('getUpdates',)
+
+# per-handler totals (target -> seconds) that record() adds to; set by handler_timing
+# around each handler, and seen by to_thread workers because they run in a copy of the context
+awaited = contextvars.ContextVar('awaited', default=None)
+
+UUID_SEGMENT = re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$')
+# segments that are followed by a user-supplied value
+NAMED_SEGMENTS = {'by-username': '{username}', 'by-short-uuid': '{shortUuid}', 'by-telegram-id': '{telegramId}',
+                  'by-email': '{email}', 'by-tag': '{tag}'}
+
+
+def endpoint_template(endpoint: str) -> str:
+    """'/api/users/2b1e...' -> '/api/users/{id}', so one user's calls do not get a series of their own."""
+    segments = endpoint.split('?', 1)[0].split('/')
+    for i, segment in enumerate(segments):
+        if i and segments[i - 1] in NAMED_SEGMENTS:
+            segments[i] = NAMED_SEGMENTS[segments[i - 1]]
+        elif UUID_SEGMENT.match(segment) or segment.isdigit():
+            segments[i] = '{id}'
+    return '/'.join(segments)
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (the largest finite bound for the last bucket)."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return BUCKETS[i] if BUCKETS[i] != float('inf') else BUCKETS[-2]
+        return BUCKETS[-2]
+
+
+class CallStats:
+    __slots__ = ('latency', 'statuses', 'bytes_out', 'bytes_in')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.statuses = Counter()
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+
+class Metrics:
+    """Per-(target, name) call statistics. record() is called from worker threads as well as the event loop."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.started = time.time()
+
+    def record(self, target: str, name: str, seconds: float, status, bytes_out: int = 0, bytes_in: int = 0):
+        handler_totals = awaited.get()
+        with self.lock:
+            if handler_totals is not None:
+                handler_totals[target] += seconds
+            stats = self.calls.get((target, name))
+            if stats is None:
+                stats = self.calls[(target, name)] = CallStats()
+            stats.latency.observe(seconds)
+            stats.statuses[str(status)] += 1
+            stats.bytes_out += bytes_out
+            stats.bytes_in += bytes_in
+
+    def record_panel(self, method: str, endpoint: str, seconds: float, status, bytes_out: int = 0, bytes_in: int = 0):
+        self.record('panel', f"{method.upper()} {endpoint_template(endpoint)}", seconds, status, bytes_out, bytes_in)
+
+    def reset(self):
+        with self.lock:
+            self.calls = {}
+            self.started = time.time()
+
+    def snapshot(self) -> list:
+        """(target, name, CallStats copy) sorted by total time spent, most first."""
+        with self.lock:
+            items = []
+            for (target, name), stats in self.calls.items():
+                copy = CallStats()
+                copy.latency.counts = list(stats.latency.counts)
+                copy.latency.total, copy.latency.count = stats.latency.total, stats.latency.count
+                copy.statuses = Counter(stats.statuses)
+                copy.bytes_out, copy.bytes_in = stats.bytes_out, stats.bytes_in
+                items.append((target, name, copy))
+        return sorted(items, key=lambda item: item[2].latency.total, reverse=True)
+
+    def render_text(self, limit: int = 15) -> str:
+        """Compact table for the /stats command."""
+        lines = [f"since {time.strftime('%Y-%m-%d %H:%M', time.localtime(self.started))}, "
+                 f"bot process CPU {time.process_time():.1f}s"]
+        snapshot = self.snapshot()
+        for target in ('panel', 'telegram'):
+            items = [item for item in snapshot if item[0] == target and item[1] not in LONG_POLL_CALLS]
+            spent = sum(stats.latency.total for _, _, stats in items)
+            lines.append(f"\n{target}: {sum(s.latency.count for _, _, s in items)} calls, {spent:.1f}s total")
+            for _, name, stats in items[:limit]:
+                errors = sum(n for status, n in stats.statuses.items() if not status.startswith('2'))
+                lines.append(f"{name}\n  n={stats.latency.count} avg={stats.latency.total / stats.latency.count * 1000:.0f}ms "
+                             f"p50<={stats.latency.quantile(0.5) * 1000:.0f}ms p99<={stats.latency.quantile(0.99) * 1000:.0f}ms "
+                             f"err={errors} out={format_size(stats.bytes_out)} in={format_size(stats.bytes_in)}")
+            if len(items) > limit:
+                lines.append(f"... {len(items) - limit} more")
+        for target, name, stats in snapshot:
+            if target == 'telegram' and name in LONG_POLL_CALLS:
+                lines.append(f"\n{name} (long polling, waiting for updates): {stats.latency.count} calls, {stats.latency.total:.1f}s")
+        return "\n".join(lines)
+
+    def render_prometheus(self) -> str:
+        out = ["# HELP remna_bot_call_seconds Duration of panel API and Bot API calls.",
+               "# TYPE remna_bot_call_seconds histogram"]
+        items = self.snapshot()
+        for target, name, stats in items:
+            labels = f'target="{target}",call="{escape_label(name)}"'
+            cumulative = 0
+            for bound, n in zip(BUCKETS, stats.latency.counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                out.append(f'remna_bot_call_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            out.append(f"remna_bot_call_seconds_sum{{{labels}}} {stats.latency.total}")
+            out.append(f"remna_bot_call_seconds_count{{{labels}}} {stats.latency.count}")
+        out += ["# HELP remna_bot_calls_total Panel API and Bot API calls by status.", "# TYPE remna_bot_calls_total counter"]
+        for target, name, stats in items:
+            for status, n in sorted(stats.statuses.items()):
+                out.append(f'remna_bot_calls_total{{target="{target}",call="{escape_label(name)}",status="{escape_label(status)}"}} {n}')
+        for direction in ('out', 'in'):
+            out += [f"# HELP remna_bot_call_bytes_{direction}_total Bytes {'sent' if direction == 'out' else 'received'} by calls.",
+                    f"# TYPE remna_bot_call_bytes_{direction}_total counter"]
+            for target, name, stats in items:
+                value = stats.bytes_out if direction == 'out' else stats.bytes_in
+                out.append(f'remna_bot_call_bytes_{direction}_total{{target="{target}",call="{escape_label(name)}"}} {value}')
+        return "\n".join(out) + "\n"
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_size(size: int) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024: return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+metrics = Metrics()
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records every Bot API call in `metrics` under its method name."""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        started = time.perf_counter()
+        status, content = 'error', b''
+        try:
+            status, content = await super().do_request(url, method, request_data, *args, **kwargs)
+            return status, content
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            metrics.record('telegram', url.rsplit('/', 1)[-1], time.perf_counter() - started, status,
+                           request_size(request_data), len(content))
+
+
+def request_size(request_data) -> int:
+    if request_data is None:
+        return 0
+    if request_data.contains_files:
+        files = request_data.multipart_data or {}
+        return sum(len(value[1]) for value in files.values()) + sum(len(v) for v in request_data.json_parameters.values())
+    return len(request_data.json_payload)
+
+
+async def start_metrics_server(port: int):
+    """Serves GET /metrics on 127.0.0.1:port. Returns the asyncio server."""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            while (await asyncio.wait_for(reader.readline(), 10)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                body, status, content_type = metrics.render_prometheus().encode(), '200 OK', 'text/plain; version=0.0.4'
+            else:
+                body, status, content_type = b'Not found\n', '404 Not Found', 'text/plain'
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', port)
@@ -0,0 +1,118 @@
+# profiler.py
+# Sampling profiler for the running bot. A thread started only while a profile
+# is being taken reads the stacks of every other thread (the event loop and the
+# to_thread workers) a few hundred times a second; nothing is hooked in and
+# nothing runs while it is off. The result is in collapsed-stack format, which
+# flamegraph.pl and speedscope.app open directly.
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+SAMPLE_INTERVAL = 0.005
+MAX_STACK_DEPTH = 120
+# (file name, function) of frames where a thread is waiting for work rather than running
+IDLE_FRAMES = {('selectors.py', 'select'), ('thread.py', '_worker'), ('threading.py', 'wait'), ('queue.py', 'get')}
+
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Counts the call stacks seen in all threads except its own. stop() returns
+    once the sampler thread has exited; the result is then in `stacks`
+    ('thread;outer;...;inner' -> samples) and `idle` (thread -> idle samples).
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL, memory: bool = False):
+        self.interval = interval
+        self.memory = memory
+        self.stacks = Counter()
+        self.idle = Counter()
+        self.samples = 0
+        self.started = self.stopped = None
+        self.memory_snapshot = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(1)  # top allocations are grouped by line, deeper tracebacks only add cost
+        self.started = time.time()
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.stopped = time.time()
+        if self.memory and tracemalloc.is_tracing():
+            self.memory_snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+    def run(self):
+        own = threading.get_ident()
+        labels = {}  # code object -> label, so each function is formatted once
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                thread = names.get(ident, str(ident))
+                top = frame.f_code
+                if (os.path.basename(top.co_filename), top.co_name) in IDLE_FRAMES:
+                    self.idle[thread] += 1
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = frame_label(code)
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.append(thread)
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit: int = 10) -> list:
+        """(function, share of busy samples) by self time."""
+        own = Counter()
+        for stack, count in self.stacks.items():
+            own[stack.rsplit(';', 1)[-1]] += count
+        busy = sum(own.values()) or 1
+        return [(name, count / busy) for name, count in own.most_common(limit)]
+
+    def summary(self) -> str:
+        duration = (self.stopped or time.time()) - self.started
+        busy = sum(self.stacks.values())
+        lines = [f"{self.samples} samples over {duration:.1f}s, {busy} busy thread samples"]
+        threads = Counter()
+        for stack, count in self.stacks.items():
+            threads[stack.split(';', 1)[0]] += count
+        for thread in sorted(set(threads) | set(self.idle)):
+            total = threads[thread] + self.idle[thread]
+            lines.append(f"  {thread}: busy {threads[thread] / total:.0%} of {total}")
+        lines.append("self time:")
+        lines += [f"  {share:6.1%}  {name}" for name, share in self.top_functions()]
+        return "\n".join(lines)
+
+    def top_allocations(self, limit: int = 30) -> str:
+        """Allocations made while profiling that are still alive, grouped by line."""
+        if self.memory_snapshot is None:
+            return ''
+        snapshot = self.memory_snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                                       tracemalloc.Filter(False, __file__)))
+        stats = snapshot.statistics('lineno')
+        lines = [f"{sum(s.size for s in stats) / 1024:.0f} KiB in {sum(s.count for s in stats)} blocks still allocated"]
+        for stat in stats[:limit]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size / 1024:9.1f} KiB {stat.count:7} blocks  {frame.filename}:{frame.lineno}")
+        return "\n".join(lines)
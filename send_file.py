@@ -1,26 +1,105 @@
 # send_file.py
+# Sends a file to the admin through the running bot: the bot listens on a local
+# Unix socket and uploads queued files over its own connection. If the bot is
+# not running, the file is uploaded directly with a new Bot instance.
 import sys
 import os
+import json
 import asyncio
-from telegram import Bot
-from importlib.machinery import SourceFileLoader
+from config_store import read_config, bot_api_urls
 
-CONFIG_PATH = '/opt/remna_bot/config.py'
+SOCKET_PATH = '/opt/remna_bot/bot.sock'
+UPLOAD_RETRIES = 3
+UPLOAD_TIMEOUT = 600
 
-def load_config():
-    """Loads the bot configuration file."""
-    if not os.path.exists(CONFIG_PATH):
-        print("Error: config.py not found!", file=sys.stderr)
-        sys.exit(1)
-    return SourceFileLoader("remna_config_module", CONFIG_PATH).load_module()
+async def send_document(bot, chat_id: int, path: str, caption: str):
+    """Sends a file with retries and checks that Telegram stored all of it. Returns the sent document."""
+    from telegram.error import RetryAfter, NetworkError
+    size = os.path.getsize(path)
+    for attempt in range(1, UPLOAD_RETRIES + 1):
+        try:
+            with open(path, 'rb') as f:
+                message = await bot.send_document(chat_id=chat_id, document=f, filename=os.path.basename(path), caption=caption,
+                                                  read_timeout=UPLOAD_TIMEOUT, write_timeout=UPLOAD_TIMEOUT)
+            document = message.document
+            if document is None or document.file_size not in (None, size):
+                raise RuntimeError(f"Telegram stored {os.path.basename(path)} with {document.file_size if document else 0} "
+                                   f"bytes instead of {size}")
+            return document
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except NetworkError:
+            if attempt == UPLOAD_RETRIES: raise
+            await asyncio.sleep(5 * attempt)
+    raise RuntimeError(f"Could not upload {path}")
+
+async def bot_request(request: dict) -> dict:
+    """
+    Sends one request to the running bot and returns its reply. Raises OSError
+    when the bot is not listening and RuntimeError when the request failed.
+    """
+    reader, writer = await asyncio.open_unix_connection(SOCKET_PATH)
+    try:
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        line = await reader.readline()
+    finally:
+        writer.close()
+    if not line:
+        raise RuntimeError("The bot closed the connection without a reply")
+    reply = json.loads(line)
+    if not reply.get('ok'):
+        raise RuntimeError(reply.get('error') or "Request failed")
+    return reply
+
+async def send_via_bot(path: str, caption: str) -> dict:
+    """Queues the file on the running bot and waits until it is sent."""
+    return await bot_request({'action': 'send_file', 'path': os.path.abspath(path), 'caption': caption})
+
+def bot_is_listening() -> bool:
+    return os.path.exists(SOCKET_PATH)
+
+class Sender:
+    """
+    Uploads files to the admin, through the running bot when it is listening and
+    otherwise with a Bot of its own (created only in that case).
+    send() returns {'file_id', 'file_size'} of the uploaded document.
+    """
+
+    def __init__(self):
+        self.bot = None
+        self.chat_id = None
 
-async def send_document(bot_token, chat_id, file_path, caption):
-    """Sends a document to the specified chat ID."""
-    bot = Bot(token=bot_token)
+    async def __aenter__(self):
+        if not bot_is_listening():
+            await self.open_bot()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self.bot is not None:
+            await self.bot.shutdown()
+
+    async def open_bot(self):
+        from telegram import Bot
+        config = read_config()
+        self.bot = Bot(token=config['TELEGRAM_BOT_TOKEN'], **bot_api_urls(config))
+        self.chat_id = config['ADMIN_USER_ID']
+        await self.bot.initialize()
+
+    async def send(self, path: str, caption: str) -> dict:
+        if self.bot is None:
+            try:
+                return await send_via_bot(path, caption)
+            except OSError:
+                # سوکت قدیمی یا ربات در حال ری‌استارت؛ ارسال مستقیم
+                await self.open_bot()
+        document = await send_document(self.bot, self.chat_id, path, caption)
+        return {'file_id': document.file_id, 'file_size': document.file_size}
+
+async def main(file_path: str, caption: str):
     try:
-        # خط زیر اصلاح شده و پارامتر 'timeout' حذف گردیده است
-        with open(file_path, 'rb') as f:
-            await bot.send_document(chat_id=chat_id, document=f, caption=caption)
+        async with Sender() as sender:
+            await sender.send(file_path, caption)
         print("File sent successfully to Telegram.")
     except Exception as e:
         print(f"Error sending file via Telegram: {e}", file=sys.stderr)
@@ -38,12 +117,4 @@ if __name__ == "__main__":
         print(f"Error: File not found at {file_path}", file=sys.stderr)
         sys.exit(1)
 
-    config = load_config()
-    BOT_TOKEN = getattr(config, 'TELEGRAM_BOT_TOKEN', None)
-    ADMIN_ID = getattr(config, 'ADMIN_USER_ID', None)
-
-    if not BOT_TOKEN or not ADMIN_ID:
-        print("Error: TELEGRAM_BOT_TOKEN or ADMIN_USER_ID not found in config.py", file=sys.stderr)
-        sys.exit(1)
-
-    asyncio.run(send_document(BOT_TOKEN, ADMIN_ID, file_path, caption))
+    asyncio.run(main(file_path, caption))